@@ -0,0 +1,548 @@
+# -*- coding: utf-8 -*-
+"""asyncio transport for nameko-grpc.
+
+Drives the same `ClientConnectionManager` and `ServerConnectionManager` as the
+eventlet and threaded clients and servers, but over asyncio streams, so that it can
+be used by applications that don't run under eventlet. uvloop is used if it is
+installed.
+"""
+import asyncio
+import sys
+import time
+from logging import getLogger
+from urllib.parse import urlparse
+
+from grpc import StatusCode
+
+from nameko_grpc.channel import remove_unix_socket, target_hostname
+from nameko_grpc.client import ClientBase, Future, Method, Proxy
+from nameko_grpc.compression import SUPPORTED_ENCODINGS
+from nameko_grpc.connection import (
+    KEEPALIVE_TIMEOUT,
+    ClientConnectionManager,
+    ServerConnectionManager,
+)
+from nameko_grpc.constants import Cardinality
+from nameko_grpc.context import GrpcContext
+from nameko_grpc.errors import GrpcError
+from nameko_grpc.inspection import Inspector
+from nameko_grpc.ssl import SslConfig
+from nameko_grpc.transport import RECV_BUFFER_SIZE, SELECT_TIMEOUT, SocketOptions
+
+
+try:
+    import uvloop
+except ImportError:  # pragma: no cover
+    uvloop = None
+
+
+log = getLogger(__name__)
+
+STOP_TIMEOUT = 5
+
+
+def new_event_loop():
+    """Return a new event loop, using uvloop if it is installed."""
+    if uvloop is not None:
+        return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+
+def run(main):
+    """Run the `main` coroutine to completion on a new event loop, using uvloop
+    if it is installed.
+    """
+    loop = new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(main)
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+class AsyncioTransport:
+    """Drives a `ConnectionManager` over asyncio streams."""
+
+    def __init__(self, reader, writer, connection, recv_buffer_size=RECV_BUFFER_SIZE):
+        self.reader = reader
+        self.writer = writer
+        self.connection = connection
+        self.recv_buffer_size = recv_buffer_size
+
+        self.loop = asyncio.get_running_loop()
+        self.woken = asyncio.Event()
+
+    async def run_forever(self):
+        """Event loop."""
+        connection = self.connection
+        connection.connection_made(self)
+
+        with connection.cleanup_on_exit():
+            read = asyncio.ensure_future(self.reader.read(self.recv_buffer_size))
+            try:
+                while connection.run:
+
+                    started = time.monotonic()
+                    connection.on_iteration()
+                    connection.statistics.iterated(time.monotonic() - started)
+
+                    if not connection.run:
+                        break
+
+                    data = connection.data_to_send()
+                    if data:
+                        started = time.monotonic()
+                        self.writer.write(data)
+                        await self.writer.drain()
+                        connection.statistics.waited_to_write(
+                            time.monotonic() - started
+                        )
+
+                    wait = asyncio.ensure_future(self.woken.wait())
+                    started = time.monotonic()
+                    done, _ = await asyncio.wait(
+                        {read, wait},
+                        timeout=SELECT_TIMEOUT,
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                    if not done:
+                        # how much later than the timeout the loop was resumed
+                        waited = time.monotonic() - started
+                        connection.statistics.lagged(max(waited - SELECT_TIMEOUT, 0))
+                    wait.cancel()
+                    self.woken.clear()
+                    if not read.done():
+                        continue
+
+                    data = read.result()
+                    if not data:
+                        break
+
+                    connection.receive_data(data)
+                    read = asyncio.ensure_future(
+                        self.reader.read(self.recv_buffer_size)
+                    )
+            finally:
+                read.cancel()
+                self.close()
+
+    def wakeup(self):
+        """Wake the event loop if it is waiting for data, so that it iterates
+        immediately. May be called from any thread.
+        """
+        try:
+            self.loop.call_soon_threadsafe(self.woken.set)
+        except RuntimeError:
+            pass  # event loop has closed
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncFuture(Future):
+    def result(self):
+        """Return an awaitable for the response of a unary-response method, or an
+        asynchronous iterator over the responses of a streaming-response method.
+        """
+        response = self.response_stream.consume_async(self.output_type)
+        if self.cardinality in (Cardinality.STREAM_UNARY, Cardinality.UNARY_UNARY):
+            return self.first(response)
+        return response
+
+    async def first(self, response):
+        async for message in response:
+            return message
+        raise GrpcError(
+            code=StatusCode.UNAVAILABLE,
+            message="Stream was closed mid-request",
+        )
+
+
+class AsyncMethod(Method):
+    future_class = AsyncFuture
+
+
+class AsyncProxy(Proxy):
+    method_class = AsyncMethod
+
+
+class AsyncClientChannel:
+    """Client channel that maintains a single connection to its target on the
+    running asyncio event loop, reconnecting whenever the connection is closed.
+    """
+
+    def __init__(
+        self,
+        target,
+        ssl,
+        keepalive_time=None,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        recv_buffer_size=RECV_BUFFER_SIZE,
+        socket_options=None,
+    ):
+        self.target = urlparse(target)
+        self.ssl = ssl
+        self.keepalive_time = keepalive_time
+        self.keepalive_timeout = keepalive_timeout
+        self.recv_buffer_size = recv_buffer_size
+        self.socket_options = socket_options or SocketOptions()
+
+        self.run = False
+        self.connection = None
+        self.task = None
+
+    async def connect(self):
+        ssl = self.ssl.client_context() if self.ssl else None
+        server_hostname = target_hostname(self.target) if self.ssl else None
+        if self.target.scheme == "unix":
+            reader, writer = await asyncio.open_unix_connection(
+                self.target.path, ssl=ssl, server_hostname=server_hostname
+            )
+        else:
+            reader, writer = await asyncio.open_connection(
+                self.target.hostname,
+                self.target.port or 50051,
+                ssl=ssl,
+                server_hostname=server_hostname,
+            )
+        self.socket_options.apply(writer.get_extra_info("socket"))
+        self.connection = ClientConnectionManager(
+            keepalive_time=self.keepalive_time,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        transport = AsyncioTransport(
+            reader, writer, self.connection, recv_buffer_size=self.recv_buffer_size
+        )
+        self.task = asyncio.ensure_future(self.run_with_reconnect(transport))
+
+    async def run_with_reconnect(self, transport):
+        await transport.run_forever()
+        if self.run:
+            await self.connect()
+
+    async def start(self):
+        self.run = True
+        try:
+            await self.connect()
+        except OSError as e:
+            raise type(e)(f"Failed to connect to {self.target.geturl()}") from e
+
+    async def stop(self):
+        self.run = False
+        if self.connection is None:
+            return
+        self.connection.terminate()
+        await asyncio.wait({self.task}, timeout=STOP_TIMEOUT)
+
+    def stats(self):
+        """Return a list of the statistics of the channel's connection, as returned
+        by `ConnectionManager.stats`.
+        """
+        if self.connection is None:
+            return []
+        return [self.connection.stats()]
+
+    def send_request(self, request_headers, request=None, metrics=None, timing=None):
+        if self.connection is None or not self.connection.alive:
+            raise GrpcError(
+                code=StatusCode.UNAVAILABLE, message="No connection available"
+            )
+        return self.connection.send_request(request_headers, request, metrics, timing)
+
+
+class AsyncClient(ClientBase):
+    """Standalone gRPC client for asyncio.
+
+    Must be started and used on a running event loop. Calls to methods with a
+    unary response are awaitable, and calls to methods with a streaming response
+    return an asynchronous iterator. Streaming requests may be given as an
+    asynchronous iterable.
+    """
+
+    def __init__(
+        self,
+        target,
+        stub,
+        compression_algorithm="none",
+        compression_level="high",
+        ssl=False,
+        keepalive_time=None,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        recv_buffer_size=RECV_BUFFER_SIZE,
+        socket_options=None,
+        metrics=False,
+        timings=None,
+    ):
+        super().__init__(
+            target,
+            stub,
+            compression_algorithm,
+            compression_level,
+            ssl,
+            keepalive_time=keepalive_time,
+            keepalive_timeout=keepalive_timeout,
+            recv_buffer_size=recv_buffer_size,
+            socket_options=socket_options,
+            metrics=metrics,
+            timings=timings,
+        )
+        self.loop = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *args):
+        await self.stop()
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        channel = AsyncClientChannel(
+            self.target,
+            self.ssl,
+            keepalive_time=self.keepalive_time,
+            keepalive_timeout=self.keepalive_timeout,
+            recv_buffer_size=self.recv_buffer_size,
+            socket_options=self.socket_options,
+        )
+        await channel.start()
+        self._channel = channel
+        return AsyncProxy(self)
+
+    async def stop(self):
+        if self._channel is not None:
+            await self._channel.stop()
+            self._channel = None
+
+    def channel(self):
+        if self._channel is None:
+            raise GrpcError(code=StatusCode.UNAVAILABLE, message="Client not started")
+        return self._channel
+
+    def spawn_task(self, target, args=(), name=None):
+        # iterating a synchronous request may block, so keep it off the event loop
+        self.loop.run_in_executor(None, target, *args)
+
+    def schedule(self, delay, target, args=()):
+        return self.loop.call_later(delay, target, *args)
+
+    def invoke(self, request_headers, request, timeout, metrics=None, timing=None):
+        if not hasattr(request, "__aiter__"):
+            return super().invoke(request_headers, request, timeout, metrics, timing)
+
+        send_stream, response_stream = self.channel().send_request(
+            request_headers, metrics=metrics, timing=timing
+        )
+        if metrics is not None:
+            metrics.finish_when_closed(response_stream)
+        if timing is not None:
+            timing.finish_when_closed(response_stream)
+        self.loop.create_task(send_stream.populate_async(request))
+        if timeout:
+            timer = self.schedule(
+                timeout, self.timeout, args=(send_stream, response_stream)
+            )
+            if not response_stream.when_closed(timer.cancel):
+                timer.cancel()
+        return response_stream
+
+
+class AsyncServer:
+    """Standalone gRPC server for asyncio.
+
+    Serves the methods of one or more servicers added with `add_servicer`. Methods
+    with a unary response must be coroutine functions, and methods with a streaming
+    response must be asynchronous generators. Streaming requests are passed to
+    methods as an asynchronous iterator.
+
+    If `bind_unix` is given the server listens on a unix domain socket at that path
+    instead of on `host` and `port`.
+
+    Any additional keyword arguments are passed to each `ServerConnectionManager`.
+    """
+
+    def __init__(
+        self,
+        host="0.0.0.0",
+        port=50051,
+        ssl=False,
+        recv_buffer_size=RECV_BUFFER_SIZE,
+        socket_options=None,
+        reuse_port=False,
+        bind_unix=None,
+        **kwargs,
+    ):
+        self.host = host
+        self.port = port
+        self.ssl = SslConfig(ssl)
+        self.recv_buffer_size = recv_buffer_size
+        self.socket_options = SocketOptions(socket_options)
+        self.reuse_port = reuse_port
+        self.bind_unix = bind_unix
+        self.connection_kwargs = kwargs
+
+        self.methods = {}
+        self.connections = set()
+        self.tasks = set()
+        self.server = None
+        self.loop = None
+
+    def add_servicer(self, stub, servicer):
+        """Serve the methods of the service described by `stub` that are
+        implemented by `servicer`.
+        """
+        inspector = Inspector(stub)
+        for method_name in inspector.method_descriptors:
+            method = getattr(servicer, method_name, None)
+            if method is not None:
+                self.methods[inspector.path_for_method(method_name)] = (
+                    method,
+                    inspector.cardinality_for_method(method_name),
+                    inspector.input_type_for_method(method_name),
+                )
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.stop()
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        ssl = self.ssl.server_context() if self.ssl else None
+        if self.bind_unix:
+            remove_unix_socket(self.bind_unix)
+            self.server = await asyncio.start_unix_server(
+                self.handle_connection, self.bind_unix, ssl=ssl
+            )
+        else:
+            self.server = await asyncio.start_server(
+                self.handle_connection,
+                self.host,
+                self.port,
+                ssl=ssl,
+                reuse_port=self.reuse_port,
+            )
+
+    async def stop(self):
+        """Stop accepting connections and gracefully terminate existing ones,
+        waiting for any in-flight requests to complete.
+        """
+        self.server.close()
+        for connection in list(self.connections):
+            connection.terminate()
+        if self.tasks:
+            await asyncio.wait(set(self.tasks), timeout=STOP_TIMEOUT)
+        await self.server.wait_closed()
+        if self.bind_unix:
+            remove_unix_socket(self.bind_unix)
+
+    def stats(self):
+        """Return a list of the statistics of each open connection, as returned by
+        `ConnectionManager.stats`.
+        """
+        return [connection.stats() for connection in list(self.connections)]
+
+    async def handle_connection(self, reader, writer):
+        self.socket_options.apply(writer.get_extra_info("socket"))
+        connection = ServerConnectionManager(
+            self.handle_request, **self.connection_kwargs
+        )
+        task = asyncio.current_task()
+        self.connections.add(connection)
+        self.tasks.add(task)
+        try:
+            transport = AsyncioTransport(
+                reader, writer, connection, recv_buffer_size=self.recv_buffer_size
+            )
+            await transport.run_forever()
+        finally:
+            self.connections.discard(connection)
+            self.tasks.discard(task)
+
+    def timeout(self, request_stream, response_stream):
+        """Called when the deadline of a request expires.
+
+        Closes the request and response streams, unless the request has already
+        completed.
+        """
+        if request_stream.closed and response_stream.closed:
+            return
+        request_stream.close()
+        error = GrpcError(
+            code=StatusCode.DEADLINE_EXCEEDED, message="Deadline Exceeded"
+        )
+        response_stream.close(error)
+
+    def handle_request(self, request_stream, response_stream):
+        try:
+            method_path = request_stream.headers.get(":path")
+            method, cardinality, input_type = self.methods[method_path]
+        except KeyError:
+            raise GrpcError(code=StatusCode.UNIMPLEMENTED, message="Method not found!")
+
+        encoding = request_stream.headers.get("grpc-encoding", "identity")
+        if encoding not in SUPPORTED_ENCODINGS:
+            raise GrpcError(
+                code=StatusCode.UNIMPLEMENTED,
+                message="Algorithm not supported: {}".format(encoding),
+            )
+
+        timeout = request_stream.time_remaining()
+        if timeout is not None:
+            timer = self.loop.call_later(
+                timeout, self.timeout, request_stream, response_stream
+            )
+            if not response_stream.when_closed(timer.cancel):
+                timer.cancel()
+
+        task = self.loop.create_task(
+            self.dispatch(
+                method, cardinality, input_type, request_stream, response_stream
+            )
+        )
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        # stop the method if the call is cancelled, reset or times out
+        if not response_stream.when_closed(task.cancel):
+            task.cancel()
+
+    async def dispatch(
+        self, method, cardinality, input_type, request_stream, response_stream
+    ):
+        request = request_stream.consume_async(input_type)
+
+        if cardinality in (Cardinality.UNARY_STREAM, Cardinality.UNARY_UNARY):
+            try:
+                request = await request.__anext__()
+            except Exception:
+                exc_info = sys.exc_info()
+                message = "Exception deserializing request!"
+                error = GrpcError.from_exception(
+                    exc_info,
+                    code=StatusCode.INTERNAL,
+                    message=message,
+                )
+                response_stream.close(error)
+                return
+
+        context = GrpcContext(request_stream, response_stream)
+
+        if cardinality in (Cardinality.UNARY_STREAM, Cardinality.STREAM_STREAM):
+            try:
+                await response_stream.populate_async(method(request, context))
+            except Exception as exception:
+                message = "Exception iterating responses: {}".format(exception)
+                error = GrpcError.from_exception(sys.exc_info(), message=message)
+                response_stream.close(error)
+        else:
+            try:
+                result = await method(request, context)
+            except Exception as exception:
+                message = "Exception calling application: {}".format(exception)
+                error = GrpcError.from_exception(sys.exc_info(), message=message)
+                response_stream.close(error)
+            else:
+                response_stream.populate((result,))
@@ -1,19 +1,54 @@
 # -*- coding: utf-8 -*-
+import os
 import queue
 import socket
+import stat
+import threading
 import weakref
+from collections import deque
 from logging import getLogger
 from urllib.parse import urlparse
 
 import eventlet
+from grpc import StatusCode
 
-from nameko_grpc.connection import ClientConnectionManager, ServerConnectionManager
+from nameko_grpc.connection import (
+    KEEPALIVE_TIMEOUT,
+    ClientConnectionManager,
+    ServerConnectionManager,
+)
+from nameko_grpc.errors import GrpcError
+from nameko_grpc.transport import RECV_BUFFER_SIZE, SocketOptions, SocketTransport
 
 
 log = getLogger(__name__)
 
 CONNECT_TIMEOUT = 5
 
+CONNECTION_READY_TIMEOUT = 5
+
+HANDSHAKE_TIMEOUT = 10
+
+MAX_CONCURRENT_HANDSHAKES = 100
+
+
+def target_hostname(target):
+    """Return the hostname of the parsed `target`, used for the `:authority` header
+    and TLS verification. As in gRPC, this is "localhost" for unix domain sockets.
+    """
+    if target.scheme == "unix":
+        return "localhost"
+    return target.hostname
+
+
+def remove_unix_socket(path):
+    """Remove the unix domain socket file at `path`, if there is one."""
+    try:
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+
 
 class ClientConnectionPool:
     """Simple connection pool for clients.
@@ -22,6 +57,8 @@ class ClientConnectionPool:
     round-robining requests between them.
 
     Currently expects each target to be a valid argument to `urllib.parse.urlparse`.
+    Targets with the `unix` scheme, such as `unix:///path/to/socket`, connect to a
+    unix domain socket rather than over TCP.
     If the ClientChannel becomes more complex to support pluggable resolvers and
     load-balancing, `targets` will need more structure. Something like:
 
@@ -31,49 +68,152 @@ class ClientConnectionPool:
            hostname: ... (for ssl verification)
            service config: ... (maybe)
 
+
+    If `keepalive_time` is set, each connection pings its target after that many
+    seconds without receiving anything, and is replaced if the ping is not
+    acknowledged within `keepalive_timeout` seconds. This detects half-dead
+    connections while they are idle rather than on the next call.
+
+    Each connection reads from its socket into a buffer of `recv_buffer_size` bytes,
+    and `socket_options` are applied to each new socket.
+
+    When using TLS, the session of each target's last connection is resumed when
+    reconnecting to it, avoiding a full handshake.
     """
 
-    def __init__(self, targets, ssl, spawn_thread):
+    def __init__(
+        self,
+        targets,
+        ssl,
+        spawn_thread,
+        keepalive_time=None,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        recv_buffer_size=RECV_BUFFER_SIZE,
+        socket_options=None,
+    ):
         self.targets = targets
         self.ssl = ssl
         self.spawn_thread = spawn_thread
-
-        self.connections = queue.Queue()
+        self.keepalive_time = keepalive_time
+        self.keepalive_timeout = keepalive_timeout
+        self.recv_buffer_size = recv_buffer_size
+        self.socket_options = socket_options or SocketOptions()
+
+        self.sessions = {}
+        self.connections = deque()
+        self.connection_ready = threading.Condition()
         self.is_accepting = False
         self.listening_socket = None
 
     def connect(self, target):
-        sock = socket.create_connection(
-            (target.hostname, target.port or 50051), timeout=CONNECT_TIMEOUT
-        )
+        if target.scheme == "unix":
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(CONNECT_TIMEOUT)
+            try:
+                sock.connect(target.path)
+            except OSError:
+                sock.close()
+                raise
+        else:
+            sock = socket.create_connection(
+                (target.hostname, target.port or 50051), timeout=CONNECT_TIMEOUT
+            )
+        self.socket_options.apply(sock)
 
         if self.ssl:
             context = self.ssl.client_context()
             sock = context.wrap_socket(
-                sock=sock, server_hostname=target.hostname, suppress_ragged_eofs=True
+                sock=sock,
+                server_hostname=target_hostname(target),
+                suppress_ragged_eofs=True,
+                session=self.sessions.get(target),
             )
 
-        sock.settimeout(60)  # XXX needed and/or correct value?
-        connection = ClientConnectionManager(sock)
-        self.connections.put(weakref.ref(connection))
+        # each connection is replaced once, either as soon as the server sends a
+        # GOAWAY, so that new calls needn't wait for this connection to drain, or
+        # when it stops
+        replace_lock = threading.Lock()
+        replaced = []
+
+        def replace():
+            with replace_lock:
+                if replaced or not self.run:
+                    return
+                replaced.append(True)
+            try:
+                self.connect(target)
+            except OSError:
+                with replace_lock:
+                    replaced.clear()
+                raise
+
+        def replace_in_background():
+            try:
+                replace()
+            except OSError:
+                log.warning("Failed to replace terminating connection to %s", target)
+
+        def on_terminated():
+            self.spawn_thread(
+                target=replace_in_background,
+                name=f"grpc client reconnect [{target}]",
+            )
+
+        # bounds blocking sends; dead peers are detected by keepalive pings
+        sock.settimeout(60)
+        connection = ClientConnectionManager(
+            keepalive_time=self.keepalive_time,
+            keepalive_timeout=self.keepalive_timeout,
+            on_terminated=on_terminated,
+        )
+        transport = SocketTransport(
+            sock, connection, recv_buffer_size=self.recv_buffer_size
+        )
+        with self.connection_ready:
+            self.connections.append(weakref.ref(connection))
+            self.connection_ready.notify_all()
 
         def run_with_reconnect():
-            connection.run_forever()
-            if self.run:
-                self.connect(target)
+            transport.run_forever()
+            if transport.session is not None:
+                self.sessions[target] = transport.session
+            replace()
 
         self.spawn_thread(
             target=run_with_reconnect, name=f"grpc client connection [{target}]"
         )
 
-    def get(self):
-        while True:
-            connection_weakref = self.connections.get()
+    def next_alive(self):
+        """Return the next alive connection in round-robin order, or None.
+
+        Must be called while holding `connection_ready`. Connections that have
+        stopped (or been garbage collected) can never become alive again, so they
+        are pruned. Terminating connections are retained so that `stop` can still
+        wait for them to finish.
+        """
+        for _ in range(len(self.connections)):
+            connection_weakref = self.connections[0]
+            self.connections.rotate(-1)
             conn = connection_weakref()
-            if conn and conn.alive:
-                self.connections.put(connection_weakref)
+            if conn is None or conn.stopped.is_set():
+                self.connections.remove(connection_weakref)
+            elif conn.alive:
                 return conn
 
+    def get(self, timeout=CONNECTION_READY_TIMEOUT):
+        """Return an alive connection, waiting up to `timeout` seconds for one
+        to become available.
+
+        Raises UNAVAILABLE if no connection becomes available in time.
+        """
+        with self.connection_ready:
+            conn = self.connection_ready.wait_for(self.next_alive, timeout)
+        if conn is None:
+            raise GrpcError(
+                code=StatusCode.UNAVAILABLE, message="No connection available"
+            )
+        return conn
+
     def start(self):
         self.run = True
         for target in self.targets:
@@ -82,10 +222,18 @@ class ClientConnectionPool:
             except OSError as e:
                 raise type(e)(f"Failed to connect to {target}") from e
 
+    def stats(self):
+        """Return the statistics of each open connection."""
+        with self.connection_ready:
+            connections = [ref() for ref in self.connections]
+        return [conn.stats() for conn in connections if conn is not None]
+
     def stop(self):
         self.run = False
-        while not self.connections.empty():
-            connection_weakref = self.connections.get()
+        with self.connection_ready:
+            connections = list(self.connections)
+            self.connections.clear()
+        for connection_weakref in connections:
             conn = connection_weakref()
             if conn:
                 conn.stop()
@@ -97,8 +245,25 @@ class ClientChannel:
     Channels could eventually suppport pluggable resolvers and load-balancing.
     """
 
-    def __init__(self, target, ssl, spawn_thread):
-        self.conn_pool = ClientConnectionPool([target], ssl, spawn_thread)
+    def __init__(
+        self,
+        target,
+        ssl,
+        spawn_thread,
+        keepalive_time=None,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        recv_buffer_size=RECV_BUFFER_SIZE,
+        socket_options=None,
+    ):
+        self.conn_pool = ClientConnectionPool(
+            [target],
+            ssl,
+            spawn_thread,
+            keepalive_time=keepalive_time,
+            keepalive_timeout=keepalive_timeout,
+            recv_buffer_size=recv_buffer_size,
+            socket_options=socket_options,
+        )
 
     def start(self):
         self.conn_pool.start()
@@ -106,50 +271,161 @@ class ClientChannel:
     def stop(self):
         self.conn_pool.stop()
 
-    def send_request(self, request_headers):
-        return self.conn_pool.get().send_request(request_headers)
+    def stats(self):
+        """Return a list of the statistics of each of the channel's connections,
+        as returned by `ConnectionManager.stats`.
+        """
+        return self.conn_pool.stats()
+
+    def send_request(self, request_headers, request=None, metrics=None, timing=None):
+        return self.conn_pool.get().send_request(
+            request_headers, request, metrics, timing
+        )
 
 
 class ServerConnectionPool:
     """Simple connection pool for servers.
 
     Just accepts new connections and allows them to run until close.
+
+    Connections are gracefully closed with a GOAWAY frame once they are older than
+    `max_connection_age` seconds or have been idle for `max_connection_idle`
+    seconds, and forcibly closed `max_connection_age_grace` seconds after that.
+
+    If `max_concurrent_streams` is set it is advertised to clients in the
+    SETTINGS_MAX_CONCURRENT_STREAMS setting, and any streams over the limit are
+    refused with REFUSED_STREAM.
+
+    Each connection reads from its socket into a buffer of `recv_buffer_size` bytes,
+    and `socket_options` are applied to each accepted socket.
+
+    If `bind_unix` is given the pool listens on a unix domain socket at that path
+    instead of on `host` and `port`. Any existing socket file at the path is
+    replaced, and the file is removed when the pool stops.
+
+    If `reuse_port` is set the listening socket is bound with SO_REUSEPORT, so that
+    several processes can listen on the same port and the kernel distributes new
+    connections between them.
+
+    TLS handshakes run in each connection's own thread rather than the accept loop,
+    so a slow client can't delay others from connecting. At most
+    `max_concurrent_handshakes` run at once, and connections that haven't completed
+    their handshake within `handshake_timeout` seconds, including any time spent
+    waiting to start it, are closed.
     """
 
-    def __init__(self, host, port, ssl, spawn_thread, handle_request):
+    def __init__(
+        self,
+        host,
+        port,
+        ssl,
+        spawn_thread,
+        handle_request,
+        max_connection_age=None,
+        max_connection_age_grace=None,
+        max_connection_idle=None,
+        max_concurrent_streams=None,
+        recv_buffer_size=RECV_BUFFER_SIZE,
+        socket_options=None,
+        reuse_port=False,
+        bind_unix=None,
+        handshake_timeout=HANDSHAKE_TIMEOUT,
+        max_concurrent_handshakes=MAX_CONCURRENT_HANDSHAKES,
+    ):
         self.host = host
         self.port = port
         self.ssl = ssl
         self.spawn_thread = spawn_thread
         self.handle_request = handle_request
+        self.max_connection_age = max_connection_age
+        self.max_connection_age_grace = max_connection_age_grace
+        self.max_connection_idle = max_connection_idle
+        self.max_concurrent_streams = max_concurrent_streams
+        self.recv_buffer_size = recv_buffer_size
+        self.socket_options = socket_options or SocketOptions()
+        self.reuse_port = reuse_port
+        self.bind_unix = bind_unix
+        self.handshake_timeout = handshake_timeout
+        self.handshake_slots = threading.Semaphore(max_concurrent_handshakes)
 
         self.connections = queue.Queue()
 
     def listen(self):
-        sock = eventlet.listen((self.host, self.port))
+        if self.bind_unix:
+            remove_unix_socket(self.bind_unix)
+            sock = eventlet.listen(self.bind_unix, family=socket.AF_UNIX)
+        else:
+            sock = eventlet.listen((self.host, self.port), reuse_port=self.reuse_port)
         sock.settimeout(None)
-
-        if self.ssl:
-            context = self.ssl.server_context()
-            sock = context.wrap_socket(
-                sock=sock,
-                server_side=True,
-                suppress_ragged_eofs=True,
-            )
-
         return sock
 
+    def handshake(self, sock):
+        """Perform the TLS handshake on the accepted `sock`, returning the wrapped
+        socket, or None if the handshake failed or timed out.
+        """
+        context = self.ssl.server_context()
+        try:
+            with eventlet.Timeout(self.handshake_timeout):
+                with self.handshake_slots:
+                    return context.wrap_socket(
+                        sock=sock, server_side=True, suppress_ragged_eofs=True
+                    )
+        except (OSError, eventlet.Timeout) as exc:
+            log.debug("TLS handshake failed for %s: %r", sock, exc)
+            sock.close()
+
     def run(self):
         while self.is_accepting:
             sock, _ = self.listening_socket.accept()
-            sock.settimeout(60)  # XXX needed and/or correct value?
-
-            connection = ServerConnectionManager(sock, self.handle_request)
-            self.connections.put(weakref.ref(connection))
             self.spawn_thread(
-                target=connection.run_forever, name=f"grpc server connection [{sock}]"
+                target=self.handle_connection,
+                args=(sock,),
+                name=f"grpc server connection [{sock}]",
             )
 
+    def handle_connection(self, sock):
+        sock.settimeout(60)  # XXX needed and/or correct value?
+        self.socket_options.apply(sock)
+
+        if self.ssl:
+            sock = self.handshake(sock)
+            if sock is None:
+                return
+        if not self.is_accepting:
+            sock.close()
+            return
+
+        connection = ServerConnectionManager(
+            self.handle_request,
+            max_connection_age=self.max_connection_age,
+            max_connection_age_grace=self.max_connection_age_grace,
+            max_connection_idle=self.max_connection_idle,
+            max_concurrent_streams=self.max_concurrent_streams,
+        )
+        self.prune_connections()
+        self.connections.put(weakref.ref(connection))
+        transport = SocketTransport(
+            sock, connection, recv_buffer_size=self.recv_buffer_size
+        )
+        transport.run_forever()
+
+    def prune_connections(self):
+        """Discard references to connections that have already stopped."""
+        for _ in range(self.connections.qsize()):
+            connection_weakref = self.connections.get_nowait()
+            conn = connection_weakref()
+            if conn is not None and not conn.stopped.is_set():
+                self.connections.put(connection_weakref)
+
+    def stats(self):
+        """Return the statistics of each open connection."""
+        connections = [ref() for ref in list(self.connections.queue)]
+        return [
+            conn.stats()
+            for conn in connections
+            if conn is not None and not conn.stopped.is_set()
+        ]
+
     def start(self):
         self.listening_socket = self.listen()
         self.is_accepting = True
@@ -165,14 +441,16 @@ class ServerConnectionPool:
             if conn is not None:
                 conn.stop()
         self.listening_socket.close()
+        if self.bind_unix:
+            remove_unix_socket(self.bind_unix)
 
 
 class ServerChannel:
     """Simple server channel encapsulating incoming connection management."""
 
-    def __init__(self, host, port, ssl, spawn_thread, handle_request):
+    def __init__(self, host, port, ssl, spawn_thread, handle_request, **kwargs):
         self.conn_pool = ServerConnectionPool(
-            host, port, ssl, spawn_thread, handle_request
+            host, port, ssl, spawn_thread, handle_request, **kwargs
         )
 
     def start(self):
@@ -180,3 +458,9 @@ class ServerChannel:
 
     def stop(self):
         self.conn_pool.stop()
+
+    def stats(self):
+        """Return a list of the statistics of each of the channel's connections,
+        as returned by `ConnectionManager.stats`.
+        """
+        return self.conn_pool.stats()
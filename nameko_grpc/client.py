@@ -1,18 +1,25 @@
 # -*- coding: utf-8 -*-
+import heapq
+import itertools
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
 from urllib.parse import urlparse
 
 from grpc import StatusCode
 
-from nameko_grpc.channel import ClientChannel
+from nameko_grpc.channel import ClientChannel, target_hostname
 from nameko_grpc.compression import SUPPORTED_ENCODINGS
+from nameko_grpc.connection import KEEPALIVE_TIMEOUT
 from nameko_grpc.constants import Cardinality
 from nameko_grpc.errors import GrpcError
 from nameko_grpc.inspection import Inspector
+from nameko_grpc.interceptors import CallDetails, compose_interceptors
+from nameko_grpc.metrics import CallMetrics, Metrics
 from nameko_grpc.ssl import SslConfig
 from nameko_grpc.timeout import bucket_timeout
+from nameko_grpc.transport import RECV_BUFFER_SIZE, SocketOptions
 
 
 log = getLogger(__name__)
@@ -21,6 +28,8 @@ log = getLogger(__name__)
 USER_AGENT = "grpc-python-nameko/0.0.1"
 CONTENT_TYPE = "application/grpc+proto"
 
+MAX_WORKERS = 100
+
 
 class Future:
     def __init__(self, response_stream, output_type, cardinality):
@@ -34,6 +43,21 @@ class Future:
     def trailing_metadata(self):
         return self.response_stream.trailers.for_application
 
+    @property
+    def timing(self):
+        """The call's `CallTiming`, or None unless the client records timings."""
+        return self.response_stream.timing
+
+    def cancel(self):
+        """Cancel the call, resetting its stream so that the server stops working
+        on it. Returns False if the call has already completed.
+        """
+        if self.response_stream.closed:
+            return False
+        error = GrpcError(code=StatusCode.CANCELLED, message="Cancelled")
+        self.response_stream.close(error)
+        return True
+
     def result(self):
         response = self.response_stream.consume(self.output_type)
         if self.cardinality in (Cardinality.STREAM_UNARY, Cardinality.UNARY_UNARY):
@@ -47,16 +71,50 @@ class Future:
         return response
 
 
+class InterceptedFuture:
+    """Wraps the future of a call so that its result passes through the client's
+    interceptors.
+    """
+
+    def __init__(self, future, interceptors, call):
+        self.future = future
+        self.interceptors = interceptors
+        self.call = call
+
+    def __getattr__(self, name):
+        return getattr(self.future, name)
+
+    def result(self):
+        try:
+            response = self.future.result()
+        except Exception as error:
+            raise self.interceptors.intercept_error(self.call, error)
+        return self.interceptors.intercept_response(self.call, response)
+
+
 class Method:
-    def __init__(self, client, name, extra_metadata=None):
+
+    future_class = Future
+
+    def __init__(self, client, name, extra_metadata=None, deadline=None):
         self.client = client
         self.name = name
         self.extra_metadata = extra_metadata or []
+        self.deadline = deadline
 
     def __call__(self, request, **kwargs):
         return self.future(request, **kwargs).result()
 
     def future(self, request, timeout=None, compression=None, metadata=None):
+        if self.deadline is not None:
+            # calls may not outlive the deadline, e.g. of an upstream request
+            remaining = self.deadline - time.monotonic()
+            if remaining <= 0:
+                raise GrpcError(
+                    code=StatusCode.DEADLINE_EXCEEDED, message="Deadline Exceeded"
+                )
+            timeout = remaining if timeout is None else min(timeout, remaining)
+
         inspector = Inspector(self.client.stub)
 
         cardinality = inspector.cardinality_for_method(self.name)
@@ -71,13 +129,32 @@ class Method:
             )
             compression = self.client.default_compression
 
+        if metadata is not None:
+            metadata = metadata[:]
+        else:
+            metadata = []
+
+        metadata.extend(self.extra_metadata)
+
+        path = "/{}/{}".format(service_name, self.name)
+
+        timing = None
+        if self.client.timings is not None:
+            timing = self.client.timings.start("client", path)
+
+        interceptors = self.client.interceptors
+        if interceptors is not None:
+            call = CallDetails(path, cardinality, metadata, timeout)
+            request = interceptors.intercept_request(call, request)
+            metadata, timeout = call.metadata, call.timeout
+
         scheme = "https" if self.client.ssl else "http"
 
         request_headers = [
             (":method", "POST"),
             (":scheme", scheme),
-            (":authority", urlparse(self.client.target).hostname),
-            (":path", "/{}/{}".format(inspector.service_name, self.name)),
+            (":authority", target_hostname(urlparse(self.client.target))),
+            (":path", path),
             ("te", "trailers"),
             ("content-type", CONTENT_TYPE),
             ("user-agent", USER_AGENT),
@@ -86,13 +163,6 @@ class Method:
             ("grpc-accept-encoding", ",".join(SUPPORTED_ENCODINGS)),
         ]
 
-        if metadata is not None:
-            metadata = metadata[:]
-        else:
-            metadata = []
-
-        metadata.extend(self.extra_metadata)
-
         for key, value in metadata:
             request_headers.append((key, value))
 
@@ -102,17 +172,29 @@ class Method:
         if cardinality in (Cardinality.UNARY_UNARY, Cardinality.UNARY_STREAM):
             request = (request,)
 
-        response_stream = self.client.invoke(request_headers, request, timeout)
+        metrics = None
+        if self.client.metrics is not None:
+            metrics = CallMetrics(self.client.metrics, path)
 
-        return Future(response_stream, output_type, cardinality)
+        response_stream = self.client.invoke(
+            request_headers, request, timeout, metrics, timing
+        )
+
+        future = self.future_class(response_stream, output_type, cardinality)
+        if interceptors is not None:
+            return InterceptedFuture(future, interceptors, call)
+        return future
 
 
 class Proxy:
+
+    method_class = Method
+
     def __init__(self, client):
         self.client = client
 
     def __getattr__(self, name):
-        return Method(self.client, name)
+        return self.method_class(self.client, name)
 
 
 class ClientBase:
@@ -128,6 +210,13 @@ class ClientBase:
         compression_level="high",
         ssl=False,
         lazy_startup=False,
+        keepalive_time=None,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        recv_buffer_size=RECV_BUFFER_SIZE,
+        socket_options=None,
+        interceptors=None,
+        metrics=False,
+        timings=None,
     ):
         self.target = target
         self.stub = stub
@@ -135,12 +224,37 @@ class ClientBase:
         self.compression_level = compression_level  # NOTE not used
         self.ssl = SslConfig(ssl)
         self.lazy_startup = lazy_startup
+        self.keepalive_time = keepalive_time
+        self.keepalive_timeout = keepalive_timeout
+        self.recv_buffer_size = recv_buffer_size
+        self.socket_options = SocketOptions(socket_options)
+        self.interceptors = compose_interceptors(interceptors)
+        if metrics is True:
+            metrics = Metrics("client")
+        self.metrics = metrics or None
+        self.timings = timings
         self._channel_creation_lock = threading.Lock()
         self._channel = None
 
     def spawn_thread(self, target, args=(), kwargs=None, name=None):
         raise NotImplementedError
 
+    def spawn_task(self, target, args=(), name=None):
+        """Run a task on behalf of a single call. The task may run for as long as
+        the call, e.g. while iterating over a streaming request.
+
+        Defaults to spawning a new thread; subclasses may use a pool instead.
+        """
+        self.spawn_thread(target=target, args=args, name=name)
+
+    def schedule(self, delay, target, args=()):
+        """Call `target` with `args` after `delay` seconds.
+
+        Returns a handle whose `cancel()` method prevents the call if it hasn't
+        happened yet.
+        """
+        raise NotImplementedError
+
     @property
     def default_compression(self):
         if self.compression_algorithm != "none":
@@ -154,7 +268,15 @@ class ClientBase:
     def _start_channel(self):
         with self._channel_creation_lock:
             if self._channel is None:
-                channel = ClientChannel(self.target, self.ssl, self.spawn_thread)
+                channel = ClientChannel(
+                    self.target,
+                    self.ssl,
+                    self.spawn_thread,
+                    keepalive_time=self.keepalive_time,
+                    keepalive_timeout=self.keepalive_timeout,
+                    recv_buffer_size=self.recv_buffer_size,
+                    socket_options=self.socket_options,
+                )
                 channel.start()
                 self._channel = channel
 
@@ -168,39 +290,149 @@ class ClientBase:
             self._start_channel()
         return self._channel
 
-    def timeout(self, send_stream, response_stream, deadline):
-        start = time.time()
-        while True:
-            if send_stream.closed and response_stream.closed:
-                break
-            elapsed = time.time() - start
-            if elapsed > deadline:
-                error = GrpcError(
-                    code=StatusCode.DEADLINE_EXCEEDED, message="Deadline Exceeded"
-                )
-                response_stream.close(error)
-                send_stream.close()
-                break
-            time.sleep(0.001)
+    def timeout(self, send_stream, response_stream):
+        """Called when the deadline of a call expires.
 
-    def invoke(self, request_headers, request, timeout):
-        send_stream, response_stream = self.channel().send_request(request_headers)
+        Closes the request and response streams, unless the call has already
+        completed.
+        """
+        if send_stream.closed and response_stream.closed:
+            return
+        error = GrpcError(
+            code=StatusCode.DEADLINE_EXCEEDED, message="Deadline Exceeded"
+        )
+        response_stream.close(error)
+        send_stream.close()
+
+    def invoke(self, request_headers, request, timeout, metrics=None, timing=None):
+        # requests that are already materialised are sent without a separate task
+        if isinstance(request, (list, tuple)):
+            send_stream, response_stream = self.channel().send_request(
+                request_headers, request, metrics, timing
+            )
+        else:
+            send_stream, response_stream = self.channel().send_request(
+                request_headers, metrics=metrics, timing=timing
+            )
+            self.spawn_task(
+                target=send_stream.populate,
+                args=(request,),
+                name=f"populate request [{request}]",
+            )
+        if metrics is not None:
+            metrics.finish_when_closed(response_stream)
+        if timing is not None:
+            timing.finish_when_closed(response_stream)
         if timeout:
-            self.spawn_thread(
-                target=self.timeout,
-                args=(send_stream, response_stream, timeout),
-                name=f"client timeout [{request}]",
+            timer = self.schedule(
+                timeout, self.timeout, args=(send_stream, response_stream)
             )
-        self.spawn_thread(
-            target=send_stream.populate,
-            args=(request,),
-            name=f"populate request [{request}]",
-        )
+            if not response_stream.when_closed(timer.cancel):
+                timer.cancel()
         return response_stream
 
 
+class ScheduledCall:
+    """A call pending in a `Scheduler`."""
+
+    def __init__(self, scheduler, deadline, target, args):
+        self.scheduler = scheduler
+        self.deadline = deadline
+        self.target = target
+        self.args = args
+        self.cancelled = False
+        self.started = False
+
+    def cancel(self):
+        """Prevent the call, unless it has already started."""
+        self.scheduler.cancel(self)
+
+
+class Scheduler:
+    """Calls functions after a delay, using a single background thread."""
+
+    def __init__(self, name):
+        self.name = name
+        self.timers = []
+        self.cancelled = 0
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.running = False
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self.run, name=self.name, daemon=True).start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.timers.clear()
+            self.cancelled = 0
+            self.condition.notify()
+
+    def schedule(self, delay, target, args=()):
+        call = ScheduledCall(self, time.monotonic() + delay, target, args)
+        with self.condition:
+            heapq.heappush(self.timers, (call.deadline, next(self.counter), call))
+            self.condition.notify()
+        return call
+
+    def cancel(self, call):
+        with self.condition:
+            if call.cancelled or call.started:
+                return
+            call.cancelled = True
+            self.cancelled += 1
+            # cancelled calls are left in the heap until they're due, unless they
+            # come to outnumber the pending ones
+            if self.cancelled > len(self.timers) // 2:
+                self.timers = [entry for entry in self.timers if not entry[2].cancelled]
+                heapq.heapify(self.timers)
+                self.cancelled = 0
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running:
+                    if not self.timers:
+                        self.condition.wait()
+                        continue
+                    if self.timers[0][2].cancelled:
+                        heapq.heappop(self.timers)
+                        self.cancelled -= 1
+                        continue
+                    remaining = self.timers[0][0] - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+
+                if not self.running:
+                    return
+                _, _, call = heapq.heappop(self.timers)
+                call.started = True
+
+            try:
+                call.target(*call.args)
+            except Exception:
+                log.exception("Error in scheduled call to %s", call.target)
+
+
 class Client(ClientBase):
-    """Standalone gRPC client that uses native threads."""
+    """Standalone gRPC client that uses native threads.
+
+    Connections each run in a dedicated thread. Per-call work, such as populating
+    streaming requests, runs in a pool of up to `max_workers` reusable threads, or
+    in a dedicated thread while the pool is busy. Deadlines are enforced by a
+    single scheduler thread.
+    """
+
+    def __init__(self, *args, max_workers=MAX_WORKERS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_workers = max_workers
+        self.executor = None
+        self.scheduler = None
+        self.tasks = 0
+        self.tasks_lock = threading.Lock()
 
     def __enter__(self):
         return self.start()
@@ -209,8 +441,44 @@ class Client(ClientBase):
         self.stop()
 
     def start(self):
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="grpc client worker"
+        )
+        self.scheduler = Scheduler(name="grpc client scheduler")
+        self.scheduler.start()
         super().start()
         return Proxy(self)
 
+    def stop(self):
+        super().stop()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        if self.scheduler is not None:
+            self.scheduler.stop()
+            self.scheduler = None
+
     def spawn_thread(self, target, args=(), kwargs=None, name=None):
         threading.Thread(target=target, args=args, kwargs=kwargs, name=name).start()
+
+    def spawn_task(self, target, args=(), name=None):
+        # tasks may last as long as their call, so rather than queue behind them
+        # when every pooled thread is busy, fall back to a thread of its own
+        with self.tasks_lock:
+            pooled = self.tasks < self.max_workers
+            if pooled:
+                self.tasks += 1
+        if pooled:
+            self.executor.submit(self.run_task, target, args)
+        else:
+            self.spawn_thread(target=target, args=args, name=name)
+
+    def run_task(self, target, args):
+        try:
+            target(*args)
+        finally:
+            with self.tasks_lock:
+                self.tasks -= 1
+
+    def schedule(self, delay, target, args=()):
+        return self.scheduler.schedule(delay, target, args)
@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
 import itertools
 import logging
-import select
+import os
+import random
 import sys
+import time
 from collections import deque
 from contextlib import contextmanager
 from logging import getLogger
-from threading import Event
+from threading import Event, Lock
 
 from grpc import StatusCode
 from h2.config import DummyLogger, H2Configuration
@@ -15,6 +17,7 @@ from h2.errors import ErrorCodes
 from h2.events import (
     ConnectionTerminated,
     DataReceived,
+    PingAckReceived,
     RemoteSettingsChanged,
     RequestReceived,
     ResponseReceived,
@@ -25,6 +28,7 @@ from h2.events import (
     WindowUpdated,
 )
 from h2.exceptions import StreamClosedError
+from h2.settings import SettingCodes, Settings
 
 from nameko_grpc.compression import (
     SUPPORTED_ENCODINGS,
@@ -32,7 +36,9 @@ from nameko_grpc.compression import (
     select_algorithm,
 )
 from nameko_grpc.errors import GrpcError
+from nameko_grpc.metrics import Histogram
 from nameko_grpc.streams import ReceiveStream, SendStream
+from nameko_grpc.timeout import unbucket_timeout
 
 
 log = getLogger(__name__)
@@ -55,24 +61,188 @@ class H2Logger(DummyLogger):
         self.logger.log(5, *vargs, **kwargs)
 
 
-SELECT_TIMEOUT = 0.01
+KEEPALIVE_TIMEOUT = 20
+
+FRAME_HEADER_LENGTH = 9
+
+# the client sends this many bytes of connection preface before its first frame
+PREFACE_LENGTH = 24
+
+FRAME_TYPES = {
+    0x0: "DATA",
+    0x1: "HEADERS",
+    0x2: "PRIORITY",
+    0x3: "RST_STREAM",
+    0x4: "SETTINGS",
+    0x5: "PUSH_PROMISE",
+    0x6: "PING",
+    0x7: "GOAWAY",
+    0x8: "WINDOW_UPDATE",
+    0x9: "CONTINUATION",
+}
 
 
 class ConnectionTerminatingError(Exception):
     pass
 
 
+class KeepaliveTimeoutError(Exception):
+    pass
+
+
+class FrameCounter:
+    """Counts the HTTP2 frames in a stream of bytes by type, by reading just their
+    headers. Frames may be split across the chunks passed to `feed`.
+    """
+
+    def __init__(self, skip=0):
+        self.counts = {}
+        self.skip = skip
+        self.header = bytearray()
+
+    def feed(self, data):
+        position = 0
+        length = len(data)
+        while position < length:
+            if self.skip:
+                step = min(self.skip, length - position)
+                self.skip -= step
+                position += step
+                continue
+
+            end = position + FRAME_HEADER_LENGTH - len(self.header)
+            self.header += data[position:end]
+            position = end
+            if len(self.header) < FRAME_HEADER_LENGTH:
+                break
+
+            frame_type = FRAME_TYPES.get(self.header[3], "UNKNOWN")
+            self.counts[frame_type] = self.counts.get(frame_type, 0) + 1
+            self.skip = int.from_bytes(self.header[:3], "big")
+            self.header.clear()
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+
+class ConnectionStats:
+    """Statistics about a single connection.
+
+    Only the connection's own event loop records statistics, so they are updated
+    without locks. They may be read from any thread with `ConnectionManager.stats`.
+    """
+
+    def __init__(self, client_side):
+        self.started_at = time.monotonic()
+
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.frames_received = FrameCounter(skip=0 if client_side else PREFACE_LENGTH)
+        self.frames_sent = FrameCounter(skip=PREFACE_LENGTH if client_side else 0)
+
+        self.iterations = 0
+        self.iteration_time = 0.0
+        self.max_iteration_time = 0.0
+        self.receive_time = 0.0
+        self.write_wait_time = 0.0
+
+        self.flow_control_stalls = 0
+        self.flow_control_blocked_time = 0.0
+        self.flow_control_blocked = {}
+
+        self.max_send_streams = 0
+
+        self.loop_lag = Histogram()
+        self.max_loop_lag = 0.0
+
+    def received(self, data, duration):
+        self.bytes_received += len(data)
+        self.frames_received.feed(data)
+        self.receive_time += duration
+
+    def sent(self, data):
+        self.bytes_sent += len(data)
+        self.frames_sent.feed(data)
+
+    def iterated(self, duration):
+        """Called by the transport after each iteration of the event loop."""
+        self.iterations += 1
+        self.iteration_time += duration
+        if duration > self.max_iteration_time:
+            self.max_iteration_time = duration
+
+    def lagged(self, lag):
+        """Called by the transport with how much later than its timeout the event
+        loop was resumed after waiting for data, i.e. its scheduling lag.
+        """
+        self.loop_lag.record(lag)
+        if lag > self.max_loop_lag:
+            self.max_loop_lag = lag
+
+    def waited_to_write(self, duration):
+        """Called by the transport with the time it spent writing data to the peer,
+        which is mostly spent waiting for the peer to read it.
+        """
+        self.write_wait_time += duration
+
+    def blocked(self, stream_id):
+        """Record that a stream has data to send but no flow control window."""
+        if stream_id not in self.flow_control_blocked:
+            self.flow_control_stalls += 1
+            self.flow_control_blocked[stream_id] = time.monotonic()
+
+    def unblocked(self, stream_id):
+        since = self.flow_control_blocked.pop(stream_id, None)
+        if since is not None:
+            self.flow_control_blocked_time += time.monotonic() - since
+
+
+class UnenforcedStreamLimitSettings(Settings):
+    """Local settings whose SETTINGS_MAX_CONCURRENT_STREAMS is advertised to the
+    peer, but not enforced by H2.
+
+    H2 raises `TooManyStreamsError` for a stream over the limit, tearing down the
+    whole connection, whereas only that stream should be refused. The
+    `ServerConnectionManager` enforces the limit itself instead.
+    """
+
+    @property
+    def max_concurrent_streams(self):
+        return 2**32 + 1  # H2's default, i.e. unlimited
+
+
 class ConnectionManager:
     """
     Base class for managing a single GRPC HTTP/2 connection.
 
-    Provides the H2 event loop that manages the connection over a socket. Methods for
-    handling each HTTP2 event are fully or partially implemented and can be extended
-    by subclasses.
+    Implements the protocol without performing any I/O: bytes received from the
+    peer are passed to `receive_data`, and bytes to be sent to the peer are
+    collected from `data_to_send`. A transport drives the connection by doing so
+    in a loop, calling `on_iteration` on every pass. See `nameko_grpc.transport`.
+
+    Methods for handling each HTTP2 event are fully or partially implemented and
+    can be extended by subclasses.
     """
 
-    def __init__(self, sock, client_side):
-        self.sock = sock
+    # maps each type of H2 event to the name of the method that handles it.
+    # subclasses may extend the mapping to handle additional events
+    event_handlers = {
+        RequestReceived: "request_received",
+        ResponseReceived: "response_received",
+        DataReceived: "data_received",
+        StreamEnded: "stream_ended",
+        StreamReset: "stream_reset",
+        WindowUpdated: "window_updated",
+        RemoteSettingsChanged: "settings_changed",
+        SettingsAcknowledged: "settings_acknowledged",
+        TrailersReceived: "trailers_received",
+        ConnectionTerminated: "connection_terminated",
+        PingAckReceived: "ping_ack_received",
+    }
+
+    def __init__(self, client_side):
+        self.transport = None
 
         h2_logger = H2Logger(log.getChild("h2"))
         config = H2Configuration(client_side=client_side, logger=h2_logger)
@@ -85,12 +255,20 @@ class ConnectionManager:
         self.stopped = Event()
         self.terminating = False
 
+        self.last_received = time.monotonic()
+        self.statistics = ConnectionStats(client_side)
+
     @property
     def alive(self):
         return not self.stopped.is_set() and not self.terminating
 
     @contextmanager
     def cleanup_on_exit(self):
+        """Run a transport's event loop for this connection.
+
+        When the loop exits, any open streams are closed (with UNAVAILABLE if the
+        loop raised) and the connection is marked as stopped.
+        """
         error = None
         try:
             yield
@@ -119,62 +297,113 @@ class ConnectionManager:
                     f"{f' with error {error}' if error else ''}."
                 )
                 receive_stream.close(error)
-            self.sock.close()
             self.stopped.set()
             log.debug(f"connection terminated {self}")
 
-    def run_forever(self):
-        """Event loop."""
-        log.debug(f"connection initiated {self}")
-        self.conn.initiate_connection()
+    def connection_made(self, transport):
+        """Called by `transport` when it starts driving this connection.
 
-        with self.cleanup_on_exit():
+        Sends the connection preamble and initial SETTINGS frame.
+        """
+        log.debug(f"connection initiated {self}")
+        self.transport = transport
+        self.initiate_connection()
 
-            while self.run:
+    def receive_data(self, data):
+        """Pass bytes received from the peer to the H2 state machine and handle the
+        resulting events.
+        """
+        self.last_received = started = time.monotonic()
+        events = self.conn.receive_data(data)
+
+        for event in events:
+            handler = self.event_handlers.get(type(event))
+            if handler is not None:
+                getattr(self, handler)(event)
+
+        self.statistics.received(data, time.monotonic() - started)
+
+    def data_to_send(self):
+        """Return any bytes that should be sent to the peer."""
+        data = self.conn.data_to_send()
+        if data:
+            self.statistics.sent(data)
+        return data
+
+    def stats(self):
+        """Return a dictionary of statistics about this connection.
+
+        Time spent blocked on flow control, when streams had data to send but the
+        peer hadn't granted a window for it, is summed over streams. Time spent
+        iterating the event loop and handling received data is the CPU time spent
+        on the connection, including framing and serializing messages. Time spent
+        waiting to write is time the peer was slow to read. Loop lag is how late the
+        event loop was resumed after waiting for data, which is high when other code
+        on the same eventlet hub or asyncio loop doesn't yield.
+        """
+        statistics = self.statistics
+        now = time.monotonic()
+        age = now - statistics.started_at
+        blocked = list(statistics.flow_control_blocked.values())
+        return {
+            "age": age,
+            "open_send_streams": len(self.send_streams),
+            "open_receive_streams": len(self.receive_streams),
+            "max_send_streams": statistics.max_send_streams,
+            "bytes_received": statistics.bytes_received,
+            "bytes_sent": statistics.bytes_sent,
+            "frames_received": dict(statistics.frames_received.counts),
+            "frames_sent": dict(statistics.frames_sent.counts),
+            "window_updates_received": statistics.frames_received.counts.get(
+                "WINDOW_UPDATE", 0
+            ),
+            "window_updates_sent": statistics.frames_sent.counts.get(
+                "WINDOW_UPDATE", 0
+            ),
+            "flow_control_stalls": statistics.flow_control_stalls,
+            "flow_control_blocked_streams": len(blocked),
+            "flow_control_blocked_time": statistics.flow_control_blocked_time
+            + sum(now - since for since in blocked),
+            "iterations": statistics.iterations,
+            "iteration_rate": statistics.iterations / age if age else 0.0,
+            "iteration_time": statistics.iteration_time,
+            "max_iteration_time": statistics.max_iteration_time,
+            "receive_time": statistics.receive_time,
+            "write_wait_time": statistics.write_wait_time,
+            "loop_lag_p50": statistics.loop_lag.percentile(50),
+            "loop_lag_p99": statistics.loop_lag.percentile(99),
+            "max_loop_lag": statistics.max_loop_lag,
+        }
+
+    def wakeup(self):
+        """Ask the transport to iterate its event loop immediately, rather than
+        waiting for data from the peer. May be called from any thread.
+        """
+        if self.transport is not None:
+            self.transport.wakeup()
 
-                self.on_iteration()
+    def initiate_connection(self):
+        """Called when the event loop starts, to send the connection preamble and
+        initial SETTINGS frame.
 
-                if not self.run:
-                    break
+        Subclasses may extend this method to advertise additional settings.
+        """
+        self.conn.initiate_connection()
 
-                self.sock.sendall(self.conn.data_to_send())
-                ready = select.select([self.sock], [], [], SELECT_TIMEOUT)
-                if not ready[0]:
-                    continue
+    def stop(self):
+        self.terminate()
+        log.debug("waiting for connection to terminate (Timeout 5s)")
+        self.stopped.wait(5)
 
-                data = self.sock.recv(65535)
-                if not data:
-                    break
-
-                events = self.conn.receive_data(data)
-
-                for event in events:
-                    if isinstance(event, RequestReceived):
-                        self.request_received(event)
-                    elif isinstance(event, ResponseReceived):
-                        self.response_received(event)
-                    elif isinstance(event, DataReceived):
-                        self.data_received(event)
-                    elif isinstance(event, StreamEnded):
-                        self.stream_ended(event)
-                    elif isinstance(event, StreamReset):
-                        self.stream_reset(event)
-                    elif isinstance(event, WindowUpdated):
-                        self.window_updated(event)
-                    elif isinstance(event, RemoteSettingsChanged):
-                        self.settings_changed(event)
-                    elif isinstance(event, SettingsAcknowledged):
-                        self.settings_acknowledged(event)
-                    elif isinstance(event, TrailersReceived):
-                        self.trailers_received(event)
-                    elif isinstance(event, ConnectionTerminated):
-                        self.connection_terminated(event)
+    def terminate(self):
+        """Send a GOAWAY frame and begin a graceful termination.
 
-    def stop(self):
+        Existing streams are allowed to finish sending and receiving, after which
+        the event loop exits. Does not block.
+        """
         self.conn.close_connection()
         self.terminating = True
-        log.debug("waiting for connection to terminate (Timeout 5s)")
-        self.stopped.wait(5)
+        self.wakeup()
 
     def on_iteration(self):
         """Called on every iteration of the event loop.
@@ -186,6 +415,12 @@ class ConnectionManager:
             self.send_headers(stream_id)
             self.send_data(stream_id)
 
+        # streams that ended or were reset while blocked are no longer blocked
+        statistics = self.statistics
+        for stream_id in list(statistics.flow_control_blocked):
+            if stream_id not in self.send_streams:
+                statistics.unblocked(stream_id)
+
         if self.terminating:
             send_streams_closed = all(
                 stream.exhausted for stream in self.send_streams.values()
@@ -280,6 +515,9 @@ class ConnectionManager:
 
         receive_stream.trailers.set(*event.headers, from_wire=True)
 
+    def ping_ack_received(self, event):
+        log.debug("ping ack received")
+
     def connection_terminated(self, event: ConnectionTerminated):
         """H2 signals a connection terminated event after receiving a GOAWAY frame
 
@@ -312,6 +550,8 @@ class ConnectionManager:
         headers = send_stream.headers_to_send(not immediate)
         if headers:
             self.conn.send_headers(stream_id, headers, end_stream=False)
+            if send_stream.timing is not None:
+                send_stream.timing.mark("headers_sent")
 
     def send_data(self, stream_id):
         """Attempt to send any pending data on a stream.
@@ -327,6 +567,10 @@ class ConnectionManager:
             # has been completely sent
             return
 
+        statistics = self.statistics
+        if len(self.send_streams) > statistics.max_send_streams:
+            statistics.max_send_streams = len(self.send_streams)
+
         # When a stream is closed, a STREAM_END item or ERROR is placed in the queue.
         # If we never read from the stream again, these are not consumed, and the
         # stream is never exhausted which prevents a graceful termination.
@@ -346,10 +590,18 @@ class ConnectionManager:
                 log.debug("sending data on stream %s: %s...", stream_id, chunk[:100])
 
                 self.conn.send_data(stream_id=stream_id, data=chunk)
+                if send_stream.timing is not None:
+                    send_stream.timing.mark("first_data_sent")
 
         except StreamClosedError:
             return
 
+        if send_stream.buffer.empty():
+            statistics.unblocked(stream_id)
+        else:
+            # the window was exhausted before all of the data was sent
+            statistics.blocked(stream_id)
+
         if send_stream.exhausted:
             log.debug("closing exhausted stream, stream %s", stream_id)
             self.end_stream(stream_id)
@@ -365,7 +617,10 @@ class ConnectionManager:
             else:
                 self.conn.end_stream(stream_id)
         except StreamClosedError:
-            pass
+            return
+
+        if send_stream.timing is not None:
+            send_stream.timing.mark("end_stream_sent")
 
 
 class ClientConnectionManager(ConnectionManager):
@@ -375,19 +630,87 @@ class ClientConnectionManager(ConnectionManager):
     Extends the base `ConnectionManager` to make outbound GRPC requests.
     """
 
-    def __init__(self, sock):
-        super().__init__(sock, client_side=True)
+    def __init__(
+        self,
+        keepalive_time=None,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        on_terminated=None,
+    ):
+        super().__init__(client_side=True)
 
         self.pending_requests = deque()
 
+        # called when the server sends a GOAWAY, so that a replacement connection
+        # can be established while this one drains
+        self.on_terminated = on_terminated
+
         self.counter = itertools.count(start=1, step=2)
+        self.request_lock = Lock()
+        self.streams_closed = False
+
+        self.keepalive_time = keepalive_time
+        self.keepalive_timeout = keepalive_timeout
+        self.ping_data = None
+        self.ping_sent_at = None
 
     def on_iteration(self):
-        """On each iteration of the event loop, also initiate any pending requests."""
+        """On each iteration of the event loop, also cancel abandoned requests,
+        initiate any pending requests and maintain keepalive pings.
+        """
+        self.cancel_abandoned_requests()
         self.send_pending_requests()
+        self.send_keepalive()
         super().on_iteration()
 
-    def send_request(self, request_headers):
+    def send_keepalive(self):
+        """Send a PING if nothing has been received from the server for
+        `keepalive_time` seconds.
+
+        If a PING is not acknowledged within `keepalive_timeout` seconds the
+        connection is considered dead and is torn down, which closes any open
+        streams with UNAVAILABLE and allows the connection pool to replace it.
+        """
+        if not self.keepalive_time:
+            return
+
+        now = time.monotonic()
+
+        if self.ping_data is not None:
+            if now - self.ping_sent_at > self.keepalive_timeout:
+                raise KeepaliveTimeoutError(
+                    "Keepalive ping not acknowledged within {}s".format(
+                        self.keepalive_timeout
+                    )
+                )
+            return
+
+        if now - self.last_received >= self.keepalive_time:
+            log.debug("sending keepalive ping")
+            self.ping_data = os.urandom(8)
+            self.ping_sent_at = now
+            self.conn.ping(self.ping_data)
+
+    def ping_ack_received(self, event):
+        """Called when a PING is acknowledged.
+
+        Clear any outstanding keepalive ping.
+        """
+        super().ping_ack_received(event)
+        if event.ping_data == self.ping_data:
+            self.ping_data = None
+            self.ping_sent_at = None
+
+    @contextmanager
+    def cleanup_on_exit(self):
+        with super().cleanup_on_exit():
+            try:
+                yield
+            finally:
+                # don't register new requests once the remaining streams are closed
+                with self.request_lock:
+                    self.streams_closed = True
+
+    def send_request(self, request_headers, request=None, metrics=None, timing=None):
         """Called by the client to invoke a GRPC method.
 
         Establish a `SendStream` to send the request payload and `ReceiveStream`
@@ -395,7 +718,16 @@ class ClientConnectionManager(ConnectionManager):
         returned to the client for providing the request payload and iterating
         over the response.
 
-        Invocations are queued and sent on the next iteration of the event loop.
+        If the complete `request` is provided as a sequence of messages, they are
+        serialized and framed immediately on the calling thread, and the
+        `SendStream` is closed. Otherwise the caller should populate the returned
+        `SendStream`.
+
+        If `metrics` is given, it is set as the `CallMetrics` of both streams, and
+        `timing` as their `CallTiming`.
+
+        Invocations are queued and sent on the next iteration of the event loop,
+        which is woken immediately.
 
         raises ConnectionTerminatingError if connection is terminating. Check
          connection .is_alive() before initiating send_request
@@ -410,16 +742,36 @@ class ClientConnectionManager(ConnectionManager):
             raise ConnectionTerminatingError(
                 "Connection is terminating. No new streams can be initiated"
             )
-        stream_id = next(self.counter)
-
-        request_stream = SendStream(stream_id)
-        response_stream = ReceiveStream(stream_id)
-        self.receive_streams[stream_id] = response_stream
-        self.send_streams[stream_id] = request_stream
 
+        request_stream = SendStream(None)
         request_stream.headers.set(*request_headers)
-
-        self.pending_requests.append(stream_id)
+        request_stream.metrics = metrics
+        request_stream.timing = timing
+
+        if request is not None:
+            request_stream.populate(request)
+            request_stream.flush_queue_to_buffer()
+
+        # stream ids must be allocated in the order requests are initiated
+        with self.request_lock:
+            stream_id = next(self.counter)
+            request_stream.stream_id = stream_id
+            response_stream = ReceiveStream(stream_id)
+            response_stream.metrics = metrics
+            response_stream.timing = timing
+            if self.streams_closed:
+                # the connection shut down while the request was being prepared
+                response_stream.close()
+                request_stream.close()
+                return request_stream, response_stream
+            self.receive_streams[stream_id] = response_stream
+            self.send_streams[stream_id] = request_stream
+            self.pending_requests.append(stream_id)
+
+        if timing is not None:
+            timing.mark("enqueued")
+
+        self.wakeup()
 
         return request_stream, response_stream
 
@@ -463,12 +815,45 @@ class ClientConnectionManager(ConnectionManager):
             response_stream.close(error)
             del self.receive_streams[stream_id]
 
+    def cancel_abandoned_requests(self):
+        """Reset the stream of any request whose response stream has been closed
+        locally, i.e. by its deadline expiring or the call being cancelled, so that
+        the server stops working on it.
+
+        Requests that are still pending are discarded without being initiated.
+        """
+        for stream_id, response_stream in list(self.receive_streams.items()):
+            if not response_stream.closed:
+                continue
+
+            log.debug("cancelling abandoned request, stream %s", stream_id)
+            del self.receive_streams[stream_id]
+            request_stream = self.send_streams.pop(stream_id, None)
+            if request_stream is not None:
+                request_stream.close()
+
+            with self.request_lock:
+                if stream_id in self.pending_requests:
+                    self.pending_requests.remove(stream_id)
+                    continue
+            try:
+                self.conn.reset_stream(stream_id, error_code=ErrorCodes.CANCEL)
+            except StreamClosedError:
+                pass
+
     def send_pending_requests(self):
         """Initiate requests for any pending invocations.
 
         Sends initial headers and any request data that is ready to be sent.
+
+        Requests remain pending while the server's SETTINGS_MAX_CONCURRENT_STREAMS
+        limit is reached, and are initiated in order as other streams close.
         """
         while self.pending_requests:
+            max_streams = self.conn.remote_settings.max_concurrent_streams
+            if self.conn.open_outbound_streams >= max_streams:
+                break
+
             stream_id = self.pending_requests.popleft()
 
             log.debug("initiating request, new stream %s", stream_id)
@@ -479,6 +864,49 @@ class ClientConnectionManager(ConnectionManager):
             self.send_headers(stream_id, immediate=True)
             self.send_data(stream_id)
 
+    def send_headers(self, stream_id, immediate=False):
+        """Request headers are only sent by `send_pending_requests`, which
+        initiates streams in order and within the server's concurrency limit.
+        """
+        if immediate:
+            super().send_headers(stream_id, immediate=True)
+
+    def stream_reset(self, event):
+        """Called when an incoming stream is reset.
+
+        A stream refused by the server was never processed, so fail the call as
+        UNAVAILABLE rather than letting the response end silently.
+        """
+        if event.error_code == ErrorCodes.REFUSED_STREAM:
+            response_stream = self.receive_streams.get(event.stream_id)
+            if response_stream is not None:
+                error = GrpcError(
+                    code=StatusCode.UNAVAILABLE, message="Stream refused by server"
+                )
+                response_stream.close(error)
+        super().stream_reset(event)
+
+    def connection_terminated(self, event):
+        """Called when the server sends a GOAWAY frame.
+
+        If the connection is terminating gracefully, requests that are still pending
+        will never be initiated on it, so fail them as UNAVAILABLE.
+        """
+        super().connection_terminated(event)
+        if self.on_terminated is not None:
+            self.on_terminated()
+        if not self.run:
+            return  # all streams are closed as the connection shuts down
+
+        while self.pending_requests:
+            stream_id = self.pending_requests.popleft()
+            error = GrpcError(
+                code=StatusCode.UNAVAILABLE,
+                message="Connection terminated before request was sent",
+            )
+            self.receive_streams.pop(stream_id).close(error)
+            self.send_streams.pop(stream_id).close()
+
     def send_data(self, stream_id):
         try:
             super().send_data(stream_id)
@@ -505,9 +933,86 @@ class ServerConnectionManager(ConnectionManager):
     Extends the base `ConnectionManager` to handle incoming GRPC requests.
     """
 
-    def __init__(self, sock, handle_request):
-        super().__init__(sock, client_side=False)
+    def __init__(
+        self,
+        handle_request,
+        max_connection_age=None,
+        max_connection_age_grace=None,
+        max_connection_idle=None,
+        max_concurrent_streams=None,
+    ):
+        super().__init__(client_side=False)
         self.handle_request = handle_request
+        self.max_concurrent_streams = max_concurrent_streams
+        self.conn.local_settings = UnenforcedStreamLimitSettings(
+            client=False, initial_values=dict(self.conn.local_settings)
+        )
+
+        # jitter the maximum age by +/- 10% to spread out reconnections from
+        # connections that were established at the same time
+        if max_connection_age:
+            max_connection_age *= random.uniform(0.9, 1.1)
+        self.max_connection_age = max_connection_age
+        self.max_connection_age_grace = max_connection_age_grace
+        self.max_connection_idle = max_connection_idle
+
+        self.created_at = self.last_active = time.monotonic()
+        self.terminating_since = None
+
+    def initiate_connection(self):
+        """Also advertise SETTINGS_MAX_CONCURRENT_STREAMS, if configured.
+
+        The limit is sent in a separate SETTINGS frame, after the connection
+        preface. Streams over the limit are refused in `request_received`, whether
+        or not the client has acknowledged it yet.
+        """
+        super().initiate_connection()
+        if self.max_concurrent_streams:
+            self.conn.update_settings(
+                {SettingCodes.MAX_CONCURRENT_STREAMS: self.max_concurrent_streams}
+            )
+
+    def on_iteration(self):
+        """On each iteration of the event loop, also enforce the maximum connection
+        age and idle time.
+        """
+        self.check_connection_age()
+        super().on_iteration()
+
+    def check_connection_age(self):
+        """Gracefully terminate the connection with a GOAWAY frame if it has
+        exceeded `max_connection_age`, or has had no open streams for longer than
+        `max_connection_idle`. Well-behaved clients will then reconnect, allowing
+        load to rebalance over all available servers.
+
+        If streams remain open for longer than `max_connection_age_grace` after
+        the GOAWAY was sent, the connection is closed forcibly.
+        """
+        now = time.monotonic()
+
+        if self.send_streams or self.receive_streams:
+            self.last_active = now
+
+        if self.terminating:
+            if self.terminating_since is None:
+                self.terminating_since = now
+            elif (
+                self.max_connection_age_grace is not None
+                and now - self.terminating_since > self.max_connection_age_grace
+            ):
+                log.debug("connection grace period expired, closing")
+                self.run = False
+            return
+
+        if self.max_connection_age and now - self.created_at > self.max_connection_age:
+            log.debug("connection exceeded maximum age, terminating")
+            self.terminate()
+        elif (
+            self.max_connection_idle
+            and now - self.last_active > self.max_connection_idle
+        ):
+            log.debug("connection exceeded maximum idle time, terminating")
+            self.terminate()
 
     def request_received(self, event):
         """Receive a GRPC request and pass it to the GrpcServer to fire any
@@ -520,6 +1025,16 @@ class ServerConnectionManager(ConnectionManager):
 
         stream_id = event.stream_id
 
+        # H2 advertises a limit of 100 streams by default
+        max_concurrent_streams = (
+            self.max_concurrent_streams
+            or self.conn.local_settings[SettingCodes.MAX_CONCURRENT_STREAMS]
+        )
+        if self.conn.open_inbound_streams > max_concurrent_streams:
+            log.debug("refusing stream %s, too many concurrent streams", stream_id)
+            self.conn.reset_stream(stream_id, error_code=ErrorCodes.REFUSED_STREAM)
+            return
+
         request_stream = ReceiveStream(stream_id)
         response_stream = SendStream(stream_id)
         self.receive_streams[stream_id] = request_stream
@@ -527,6 +1042,11 @@ class ServerConnectionManager(ConnectionManager):
 
         request_stream.headers.set(*event.headers, from_wire=True)
 
+        # the deadline is measured from when the request was received
+        timeout = request_stream.headers.get("grpc-timeout")
+        if timeout:
+            request_stream.deadline = time.monotonic() + unbucket_timeout(timeout)
+
         compression = select_algorithm(
             request_stream.headers.get("grpc-accept-encoding"),
             request_stream.headers.get("grpc-encoding"),
@@ -545,6 +1065,7 @@ class ServerConnectionManager(ConnectionManager):
 
         except GrpcError as error:
             response_stream.trailers.set((":status", "200"), *error.as_headers())
+            response_stream.close(error)
             self.end_stream(stream_id)
 
     def send_data(self, stream_id):
@@ -554,3 +1075,21 @@ class ServerConnectionManager(ConnectionManager):
             send_stream = self.send_streams.get(stream_id)
             send_stream.trailers.set(*error.as_headers())
             self.end_stream(stream_id)
+
+    def stream_reset(self, event):
+        """Called when the client resets a stream, e.g. because the call was
+        cancelled or its deadline expired.
+
+        The request stream is closed with CANCELLED so that a method reading it
+        stops, and closing the response stream stops a streaming response at its
+        next message. The response stream is closed with the same error, so that
+        the call is recorded as cancelled even if its request was complete.
+        """
+        log.debug("stream reset by client, stream %s", event.stream_id)
+        error = GrpcError(code=StatusCode.CANCELLED, message="Cancelled by client")
+        request_stream = self.receive_streams.pop(event.stream_id, None)
+        if request_stream is not None:
+            request_stream.close(error)
+        response_stream = self.send_streams.pop(event.stream_id, None)
+        if response_stream is not None:
+            response_stream.close(error)
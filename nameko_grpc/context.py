@@ -63,6 +63,8 @@ class GrpcContext:
     def __init__(self, request_stream, response_stream):
         self.request_stream = request_stream
         self.response_stream = response_stream
+        # applies the entrypoint's request interceptors, once, in the worker
+        self.request_interceptor = None
 
     def set_code(self, code):
         self.response_stream.trailers.set(
@@ -80,3 +82,29 @@ class GrpcContext:
 
     def set_trailing_metadata(self, metadata):
         self.response_stream.trailers.set(*metadata)
+
+    def time_remaining(self):
+        """Return the number of seconds until the call's deadline, or None if the
+        client didn't set one.
+        """
+        return self.request_stream.time_remaining()
+
+    @property
+    def timing(self):
+        """The call's `CallTiming`, or None unless the server records timings."""
+        return self.request_stream.timing
+
+    def is_active(self):
+        """Return False once the call has terminated, whether because it was
+        completed, cancelled by the client, or exceeded its deadline.
+        """
+        return not self.response_stream.closed
+
+    def add_callback(self, callback):
+        """Register `callback` to be called with no arguments when the call
+        terminates.
+
+        Returns False without registering the callback if the call has already
+        terminated.
+        """
+        return self.response_stream.when_closed(callback)
@@ -1,29 +1,61 @@
 # -*- coding: utf-8 -*-
 from logging import getLogger
 
+import eventlet
+from eventlet import hubs
 from nameko import config
 from nameko.extensions import DependencyProvider
 
 from nameko_grpc.client import ClientBase, Method
-from nameko_grpc.context import metadata_from_context_data
+from nameko_grpc.connection import KEEPALIVE_TIMEOUT
+from nameko_grpc.context import GrpcContext, metadata_from_context_data
+from nameko_grpc.entrypoint import GrpcServer
+from nameko_grpc.timing import timings_from_config
+from nameko_grpc.transport import RECV_BUFFER_SIZE
 
 
 log = getLogger(__name__)
 
 
+DEADLINE_MARGIN = 0.01
+
+
 class Proxy:
-    def __init__(self, client, context_data):
+    def __init__(self, client, context_data, deadline=None):
         self.client = client
         self.context_data = context_data
+        self.deadline = deadline
 
     def __getattr__(self, name):
         extra_metadata = metadata_from_context_data(self.context_data)
-        return Method(self.client, name, extra_metadata)
+        return Method(self.client, name, extra_metadata, deadline=self.deadline)
 
 
 class GrpcProxy(ClientBase, DependencyProvider):
+    """DependencyProvider for making calls to a gRPC service.
+
+    Calls made while handling a gRPC request inherit its deadline, less
+    `deadline_margin` seconds to allow for the response to be returned upstream.
+    """
+
     def __init__(self, *args, **kwargs):
+        self.deadline_margin = kwargs.pop(
+            "deadline_margin", config.get("GRPC_DEADLINE_MARGIN", DEADLINE_MARGIN)
+        )
         ssl = kwargs.pop("ssl", config.get("GRPC_SSL"))
+        kwargs.setdefault("keepalive_time", config.get("GRPC_KEEPALIVE_TIME"))
+        kwargs.setdefault(
+            "keepalive_timeout",
+            config.get("GRPC_KEEPALIVE_TIMEOUT", KEEPALIVE_TIMEOUT),
+        )
+        kwargs.setdefault(
+            "recv_buffer_size",
+            config.get("GRPC_RECV_BUFFER_SIZE", RECV_BUFFER_SIZE),
+        )
+        kwargs.setdefault("socket_options", config.get("GRPC_SOCKET_OPTIONS"))
+        kwargs.setdefault("interceptors", config.get("GRPC_CLIENT_INTERCEPTORS"))
+        kwargs.setdefault("metrics", config.get("GRPC_METRICS", False))
+        kwargs.setdefault("timings", timings_from_config(config))
         super().__init__(*args, ssl=ssl, **kwargs)
 
     def spawn_thread(self, target, args=(), kwargs=None, name=None):
@@ -31,5 +63,44 @@ class GrpcProxy(ClientBase, DependencyProvider):
             lambda: target(*args, **kwargs or {}), identifier=name
         )
 
+    def schedule(self, delay, target, args=()):
+        # a hub timer, rather than a greenthread sleeping until it's due
+        return hubs.get_hub().schedule_call_global(
+            delay, eventlet.spawn_n, target, *args
+        )
+
+    def get_deadline(self, worker_ctx):
+        """Return the deadline for calls made by the worker, if it is handling a
+        gRPC request with a deadline.
+        """
+        for arg in worker_ctx.args:
+            if isinstance(arg, GrpcContext):
+                deadline = arg.request_stream.deadline
+                if deadline is not None:
+                    return deadline - self.deadline_margin
+
+    def get_dependency(self, worker_ctx):
+        return Proxy(self, worker_ctx.context_data, self.get_deadline(worker_ctx))
+
+
+class GrpcMetrics(DependencyProvider):
+    """DependencyProvider giving access to the `Metrics` of the service's gRPC
+    server, or None unless metrics are enabled with the `GRPC_METRICS` config key.
+
+    The server is shared with the service's `Grpc` entrypoints rather than
+    declared here, so that a service without any doesn't serve gRPC just to
+    provide metrics. Such a service gets None.
+    """
+
+    grpc_server = None
+
+    def setup(self):
+        for extension in self.container.subextensions:
+            if isinstance(extension, GrpcServer):
+                self.grpc_server = extension
+                break
+
     def get_dependency(self, worker_ctx):
-        return Proxy(self, worker_ctx.context_data)
+        if self.grpc_server is None:
+            return None
+        return self.grpc_server.metrics
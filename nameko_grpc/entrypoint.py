@@ -1,32 +1,80 @@
 # -*- coding: utf-8 -*-
 import sys
-import time
 import types
-from functools import partial
+from functools import partial, wraps
 from logging import getLogger
 
+import eventlet
+from eventlet import hubs
 from grpc import StatusCode
 from nameko import config
+from nameko.constants import DEFAULT_MAX_WORKERS, MAX_WORKERS_CONFIG_KEY
 from nameko.exceptions import ContainerBeingKilled
 from nameko.extensions import Entrypoint, SharedExtension, register_entrypoint
 
-from nameko_grpc.channel import ServerChannel
+from nameko_grpc.channel import (
+    HANDSHAKE_TIMEOUT,
+    MAX_CONCURRENT_HANDSHAKES,
+    ServerChannel,
+)
 from nameko_grpc.compression import SUPPORTED_ENCODINGS
 from nameko_grpc.constants import Cardinality
 from nameko_grpc.context import GrpcContext, context_data_from_metadata
 from nameko_grpc.errors import GrpcError
 from nameko_grpc.inspection import Inspector
+from nameko_grpc.interceptors import (
+    CallDetails,
+    compose_interceptors,
+    load_interceptor,
+)
+from nameko_grpc.lag import LAG_MONITOR_INTERVAL, LagMonitor
+from nameko_grpc.metrics import CallMetrics, Metrics
 from nameko_grpc.ssl import SslConfig
-from nameko_grpc.timeout import unbucket_timeout
+from nameko_grpc.timing import timings_from_config
+from nameko_grpc.transport import RECV_BUFFER_SIZE, SocketOptions
 
 
 log = getLogger(__name__)
 
 
+def intercept_requests(fn):
+    """Wrap a gRPC method so that its request passes through the entrypoint's
+    request interceptors before the method is called.
+
+    The interceptors are applied by the worker running the method rather than on
+    the connection's event loop, so that they may block, e.g. to look up a token.
+    Calls that don't come from a `Grpc` entrypoint with interceptors are passed
+    straight through.
+    """
+    if getattr(fn, "intercepts_requests", False):
+        return fn
+
+    @wraps(fn)
+    def wrapper(service, *args, **kwargs):
+        if len(args) == 2 and isinstance(args[1], GrpcContext):
+            request, context = args
+            interceptor = context.request_interceptor
+            if interceptor is not None:
+                context.request_interceptor = None
+                args = (interceptor(request), context)
+        # bind `fn` as a method, in case it is itself a decorator that expects to be
+        return fn.__get__(service, type(service))(*args, **kwargs)
+
+    wrapper.intercepts_requests = True
+    return wrapper
+
+
 class GrpcServer(SharedExtension):
     def __init__(self):
         super(GrpcServer, self).__init__()
         self.entrypoints = {}
+        self.interceptors = None
+        self.metrics = None
+        self.timings = None
+        self.lag_monitor = None
+        # workers spawned for gRPC requests that haven't finished yet
+        self.workers = 0
+        self.max_workers = DEFAULT_MAX_WORKERS
 
     def register(self, entrypoint):
         self.entrypoints[entrypoint.method_path] = entrypoint
@@ -34,20 +82,32 @@ class GrpcServer(SharedExtension):
     def unregister(self, entrypoint):
         self.entrypoints.pop(entrypoint.method_path, None)
 
-    def timeout(self, request_stream, response_stream, deadline):
-        start = time.time()
-        while True:
-            if request_stream.closed and response_stream.closed:
-                break
-            elapsed = time.time() - start
-            if elapsed > deadline:
-                request_stream.close()
-                error = GrpcError(
-                    code=StatusCode.DEADLINE_EXCEEDED, message="Deadline Exceeded"
-                )
-                response_stream.close(error)
-                break
-            time.sleep(0.001)
+    def get_interceptors(self):
+        """Return the server-wide interceptors from the `GRPC_SERVER_INTERCEPTORS`
+        config key. They are loaded once and shared by every entrypoint.
+        """
+        if self.interceptors is None:
+            self.interceptors = [
+                load_interceptor(interceptor)
+                for interceptor in config.get("GRPC_SERVER_INTERCEPTORS") or ()
+            ]
+        return self.interceptors
+
+    def timeout(self, request_stream, response_stream):
+        """Called when the deadline of a request expires.
+
+        Closes the request and response streams, unless the request has already
+        completed. The response stream is closed first, because closing the
+        request stream may dispatch a unary request that is still waiting for its
+        message, which must see that the call has already failed.
+        """
+        if request_stream.closed and response_stream.closed:
+            return
+        error = GrpcError(
+            code=StatusCode.DEADLINE_EXCEEDED, message="Deadline Exceeded"
+        )
+        response_stream.close(error)
+        request_stream.close()
 
     def handle_request(self, request_stream, response_stream):
         try:
@@ -56,6 +116,16 @@ class GrpcServer(SharedExtension):
         except KeyError:
             raise GrpcError(code=StatusCode.UNIMPLEMENTED, message="Method not found!")
 
+        if self.metrics is not None:
+            metrics = CallMetrics(self.metrics, method_path)
+            request_stream.metrics = response_stream.metrics = metrics
+            metrics.finish_when_closed(response_stream, request_stream)
+
+        if self.timings is not None:
+            timing = self.timings.start("server", method_path)
+            request_stream.timing = response_stream.timing = timing
+            timing.finish_when_closed(response_stream, request_stream)
+
         encoding = request_stream.headers.get("grpc-encoding", "identity")
         if encoding not in SUPPORTED_ENCODINGS:
             raise GrpcError(
@@ -63,18 +133,64 @@ class GrpcServer(SharedExtension):
                 message="Algorithm not supported: {}".format(encoding),
             )
 
-        timeout = request_stream.headers.get("grpc-timeout")
-        if timeout:
-            timeout = unbucket_timeout(timeout)
+        if not entrypoint.acquire():
+            raise GrpcError(
+                code=StatusCode.RESOURCE_EXHAUSTED,
+                message="Too many concurrent requests",
+            )
+
+        timeout = request_stream.time_remaining()
+        if timeout is not None:
+            # a hub timer rather than a greenthread per request, cancelled as soon
+            # as the call completes so that it doesn't hold on to the streams
+            timer = hubs.get_hub().schedule_call_global(
+                timeout, eventlet.spawn_n, self.timeout, request_stream, response_stream
+            )
+            if not response_stream.when_closed(timer.cancel):
+                timer.cancel()
+
+        dispatch = partial(self.dispatch, entrypoint, request_stream, response_stream)
+        if entrypoint.cardinality in (
+            Cardinality.UNARY_UNARY,
+            Cardinality.UNARY_STREAM,
+        ):
+            # the entrypoint blocks until the request message is available, so
+            # defer dispatch until it has arrived
+            request_stream.when_ready(dispatch)
+        else:
+            dispatch()
+
+    def dispatch(self, entrypoint, request_stream, response_stream):
+        """Pass a request to its entrypoint to spawn a worker.
+
+        Called from the connection's event loop, which must not block. Spawning a
+        worker blocks when the container's worker pool is full, so once
+        `max_workers` gRPC workers are running, requests are handed to a managed
+        thread to wait for a free worker instead. Workers spawned by other
+        entrypoints share the pool, so spawning may still wait for them briefly.
+        """
+        if self.workers >= self.max_workers:
             self.container.spawn_managed_thread(
-                partial(self.timeout, request_stream, response_stream, timeout)
+                partial(entrypoint.handle_request, request_stream, response_stream)
             )
+            return
 
-        self.container.spawn_managed_thread(
-            partial(entrypoint.handle_request, request_stream, response_stream)
-        )
+        try:
+            entrypoint.handle_request(request_stream, response_stream)
+        except GrpcError as error:
+            response_stream.close(error)
 
     def setup(self):
+        self.max_workers = config.get(MAX_WORKERS_CONFIG_KEY, DEFAULT_MAX_WORKERS)
+        if config.get("GRPC_METRICS"):
+            self.metrics = Metrics("server")
+        self.timings = timings_from_config(config)
+        if config.get("GRPC_LAG_MONITOR"):
+            self.lag_monitor = LagMonitor(
+                interval=config.get("GRPC_LAG_MONITOR_INTERVAL", LAG_MONITOR_INTERVAL),
+                log_threshold=config.get("GRPC_LAG_MONITOR_LOG_THRESHOLD"),
+            )
+
         host = config.get("GRPC_BIND_HOST", "0.0.0.0")
         port = config.get("GRPC_BIND_PORT", 50051)
         ssl = SslConfig(config.get("GRPC_SSL"))
@@ -84,12 +200,34 @@ class GrpcServer(SharedExtension):
                 lambda: target(*args, **kwargs or {}), identifier=name
             )
 
-        self.channel = ServerChannel(host, port, ssl, spawn_thread, self.handle_request)
+        self.channel = ServerChannel(
+            host,
+            port,
+            ssl,
+            spawn_thread,
+            self.handle_request,
+            max_connection_age=config.get("GRPC_MAX_CONNECTION_AGE"),
+            max_connection_age_grace=config.get("GRPC_MAX_CONNECTION_AGE_GRACE"),
+            max_connection_idle=config.get("GRPC_MAX_CONNECTION_IDLE"),
+            max_concurrent_streams=config.get("GRPC_MAX_CONCURRENT_STREAMS"),
+            recv_buffer_size=config.get("GRPC_RECV_BUFFER_SIZE", RECV_BUFFER_SIZE),
+            socket_options=SocketOptions(config.get("GRPC_SOCKET_OPTIONS")),
+            reuse_port=config.get("GRPC_REUSE_PORT", False),
+            bind_unix=config.get("GRPC_BIND_UNIX"),
+            handshake_timeout=config.get("GRPC_HANDSHAKE_TIMEOUT", HANDSHAKE_TIMEOUT),
+            max_concurrent_handshakes=config.get(
+                "GRPC_MAX_CONCURRENT_HANDSHAKES", MAX_CONCURRENT_HANDSHAKES
+            ),
+        )
 
     def start(self):
         self.channel.start()
+        if self.lag_monitor is not None:
+            self.lag_monitor.start()
 
     def stop(self):
+        if self.lag_monitor is not None:
+            self.lag_monitor.stop()
         self.channel.stop()
         super(GrpcServer, self).stop()
 
@@ -101,9 +239,21 @@ class Grpc(Entrypoint):
 
     grpc_server = GrpcServer()
 
-    def __init__(self, stub, **kwargs):
+    def __init__(
+        self,
+        stub,
+        max_concurrency=None,
+        min_time_remaining=None,
+        interceptors=None,
+        **kwargs
+    ):
         super().__init__(**kwargs)
         self.stub = stub
+        self.max_concurrency = max_concurrency
+        self.min_time_remaining = min_time_remaining
+        self.entrypoint_interceptors = list(interceptors or ())
+        self.interceptors = None
+        self.in_flight = 0
 
     @property
     def method_path(self):
@@ -138,6 +288,7 @@ class Grpc(Entrypoint):
 
         def registering_decorator(fn, args, kwargs):
             instance = cls(stub, *args, **kwargs)
+            fn = intercept_requests(fn)
             register_entrypoint(fn, instance)
             return fn
 
@@ -155,13 +306,41 @@ class Grpc(Entrypoint):
             return partial(registering_decorator, args=args, kwargs=kwargs)
 
     def setup(self):
+        if self.max_concurrency is None:
+            self.max_concurrency = config.get("GRPC_MAX_CONCURRENT_REQUESTS")
+        if self.min_time_remaining is None:
+            self.min_time_remaining = config.get("GRPC_MIN_TIME_REMAINING", 0)
+        # server-wide interceptors are outermost
+        self.interceptors = compose_interceptors(
+            self.grpc_server.get_interceptors() + self.entrypoint_interceptors
+        )
         self.grpc_server.register(self)
 
     def stop(self):
         self.grpc_server.unregister(self)
 
+    def acquire(self):
+        """Reserve capacity for a new request to this entrypoint.
+
+        Returns False if `max_concurrency` requests are already in flight, in which
+        case the request should be rejected. Otherwise the caller must ensure that
+        `release` is eventually called.
+        """
+        if self.max_concurrency and self.in_flight >= self.max_concurrency:
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+
     def handle_request(self, request_stream, response_stream):
 
+        if response_stream.closed:
+            # timed out or cancelled before its request arrived
+            self.release()
+            return
+
         request = request_stream.consume(self.input_type)
 
         if self.cardinality in (Cardinality.UNARY_STREAM, Cardinality.UNARY_UNARY):
@@ -176,16 +355,47 @@ class Grpc(Entrypoint):
                     message=message,
                 )
                 response_stream.close(error)
+                self.release()
                 return
 
         context = GrpcContext(request_stream, response_stream)
 
+        handle_result = partial(self.handle_result, response_stream)
+
+        if self.interceptors is not None:
+            call = CallDetails(
+                self.method_path,
+                self.cardinality,
+                context.invocation_metadata(),
+                context.time_remaining(),
+                context,
+            )
+            if self.interceptors.request_hooks:
+                # applied in the worker, so that the hooks may block; an error
+                # raised by one fails the call without running the method
+                context.request_interceptor = partial(
+                    self.interceptors.intercept_request, call
+                )
+            handle_result = partial(self.handle_intercepted_result, call, handle_result)
+
         args = (request, context)
         kwargs = {}
 
         context_data = context_data_from_metadata(context.invocation_metadata())
 
-        handle_result = partial(self.handle_result, response_stream)
+        # requests with a deadline are only admitted while at least
+        # `min_time_remaining` seconds of it are left, including while waiting
+        # for a free worker. requests that have already timed out or been
+        # cancelled are dropped
+        budget = request_stream.time_remaining()
+        if budget is not None:
+            budget -= self.min_time_remaining
+        if response_stream.closed or (budget is not None and budget <= 0):
+            self.reject_expired(response_stream)
+            return
+
+        admission = eventlet.Timeout(budget)
+        self.grpc_server.workers += 1
         try:
             self.container.spawn_worker(
                 self,
@@ -195,7 +405,62 @@ class Grpc(Entrypoint):
                 handle_result=handle_result,
             )
         except ContainerBeingKilled:
+            self.grpc_server.workers -= 1
+            self.release()
             raise GrpcError(code=StatusCode.UNAVAILABLE, message="Server shutting down")
+        except eventlet.Timeout as timeout:
+            self.grpc_server.workers -= 1
+            if timeout is not admission:
+                raise
+            self.reject_expired(response_stream)
+        else:
+            if request_stream.metrics is not None:
+                request_stream.metrics.phase("queued")
+            if request_stream.timing is not None:
+                request_stream.timing.mark("worker_started")
+        finally:
+            admission.cancel()
+
+    def reject_expired(self, response_stream):
+        """Reject a request without running it because its deadline has expired,
+        or is too close to run it usefully.
+        """
+        log.debug("rejecting request, deadline expired")
+        error = GrpcError(
+            code=StatusCode.DEADLINE_EXCEEDED, message="Deadline Exceeded"
+        )
+        response_stream.close(error)
+        self.release()
+
+    def intercept_error(self, call, error):
+        """Pass an error through the entrypoint's interceptors.
+
+        If an interceptor's `intercept_error` hook fails, the exception it raises
+        replaces the error, so that the call is still completed.
+        """
+        try:
+            return self.interceptors.intercept_error(call, error)
+        except Exception as exception:
+            return exception
+
+    def handle_intercepted_result(
+        self, call, handle_result, worker_ctx, result, exc_info
+    ):
+        """Pass the result of a worker through the entrypoint's interceptors before
+        handling it with `handle_result`.
+        """
+        if exc_info is None:
+            try:
+                result = self.interceptors.intercept_response(call, result)
+            except Exception:
+                exc_info = sys.exc_info()
+
+        if exc_info is not None:
+            error = self.intercept_error(call, exc_info[1])
+            if error is not exc_info[1]:
+                exc_info = (type(error), error, error.__traceback__)
+
+        return handle_result(worker_ctx, result, exc_info)
 
     def handle_result(self, response_stream, worker_ctx, result, exc_info):
 
@@ -216,4 +481,11 @@ class Grpc(Entrypoint):
 
             response_stream.close(error)
 
+        if response_stream.metrics is not None:
+            response_stream.metrics.phase("handler")
+        if response_stream.timing is not None:
+            response_stream.timing.mark("handler_finished")
+
+        self.grpc_server.workers -= 1
+        self.release()
         return result, exc_info
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Interceptors observe or modify the calls made by clients and handled by servers.
+
+An interceptor subclasses `Interceptor` and overrides any of its hooks:
+
+* `intercept_request` is called with each call's request before it is sent by a
+  client or handled by a server, and returns the request to use in its place;
+* `intercept_response` is called with each call's response, and returns the
+  response to use in its place;
+* `intercept_error` is called with the exception raised when a call fails instead
+  of producing a response, and returns the exception to raise in its place.
+
+The request or response of a streaming call is an iterator of messages, which a
+hook may wrap to observe or transform individual messages. Errors raised part-way
+through a streaming response are raised from its iterator rather than passed to
+`intercept_error`.
+
+On a server, the hooks run in the worker handling the call, so they may block.
+`intercept_request` runs just before the method is called, and if it raises, the
+method isn't called. If any server hook raises, the exception becomes the call's
+error.
+
+Interceptors are composed into an `InterceptorChain` once, when a client or
+server is created, and the chain only includes the hooks that each interceptor
+overrides. Calls made without any interceptors skip the chain entirely.
+"""
+from nameko.utils import import_from_path
+
+
+class CallDetails:
+    """Describes an intercepted call.
+
+    `metadata` and `timeout` may be modified by a client's `intercept_request`
+    hooks before the call is sent. `context` is the call's `GrpcContext` on a
+    server, and None on a client. Interceptors may keep per-call state in `state`.
+    """
+
+    def __init__(self, method, cardinality, metadata, timeout, context=None):
+        self.method = method
+        self.cardinality = cardinality
+        self.metadata = metadata
+        self.timeout = timeout
+        self.context = context
+        self.state = {}
+
+
+class Interceptor:
+    """Base class for interceptors. The hooks pass calls through unchanged."""
+
+    def intercept_request(self, call, request):
+        return request
+
+    def intercept_response(self, call, response):
+        return response
+
+    def intercept_error(self, call, error):
+        return error
+
+
+def overridden_hooks(interceptors, name):
+    """Return the bound `name` hooks of the `interceptors` that override the
+    `Interceptor` default.
+    """
+    default = getattr(Interceptor, name)
+    return tuple(
+        getattr(interceptor, name)
+        for interceptor in interceptors
+        if getattr(type(interceptor), name, default) is not default
+    )
+
+
+class InterceptorChain:
+    """A sequence of interceptors composed into flat tuples of hooks.
+
+    Request hooks run in the order the interceptors are given, and response and
+    error hooks in reverse, so that the first interceptor is outermost.
+    """
+
+    def __init__(self, interceptors):
+        interceptors = list(interceptors)
+        self.request_hooks = overridden_hooks(interceptors, "intercept_request")
+        self.response_hooks = overridden_hooks(
+            reversed(interceptors), "intercept_response"
+        )
+        self.error_hooks = overridden_hooks(reversed(interceptors), "intercept_error")
+
+    def __bool__(self):
+        return bool(self.request_hooks or self.response_hooks or self.error_hooks)
+
+    def intercept_request(self, call, request):
+        for hook in self.request_hooks:
+            request = hook(call, request)
+        return request
+
+    def intercept_response(self, call, response):
+        for hook in self.response_hooks:
+            response = hook(call, response)
+        return response
+
+    def intercept_error(self, call, error):
+        for hook in self.error_hooks:
+            error = hook(call, error)
+        return error
+
+
+def load_interceptor(interceptor):
+    """Return `interceptor`, or an instance of the class at its import path if it
+    is a string, such as one given in config.
+    """
+    if isinstance(interceptor, str):
+        return import_from_path(interceptor)()
+    return interceptor
+
+
+def compose_interceptors(interceptors):
+    """Compose `interceptors` into an `InterceptorChain`, or return None if none of
+    them override any hooks.
+    """
+    chain = InterceptorChain(load_interceptor(i) for i in interceptors or ())
+    return chain or None
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Monitoring of the eventlet hub's scheduling lag.
+
+Connections, streams and service methods share a single eventlet hub, so code
+that runs for a long time without yielding, such as a CPU-heavy method, delays
+every connection's sends and receives. `LagMonitor` detects this with a sentinel
+greenthread that repeatedly sleeps for `interval` seconds and records how much
+later than that it wakes up.
+
+With a `log_threshold`, a watchdog OS thread also captures the stack of the code
+running on the hub whenever it has been blocked for longer than `log_threshold`
+seconds. The stack of the longest block so far is logged when the block ends.
+"""
+import sys
+import time
+import traceback
+from logging import getLogger
+
+import eventlet
+from eventlet.patcher import original
+
+from nameko_grpc.metrics import Histogram, get_ident
+
+
+log = getLogger(__name__)
+
+
+LAG_MONITOR_INTERVAL = 0.1
+
+
+class LagMonitor:
+    """Measures the scheduling lag of the eventlet hub of the thread it is started
+    on.
+    """
+
+    def __init__(self, interval=LAG_MONITOR_INTERVAL, log_threshold=None):
+        self.interval = interval
+        self.log_threshold = log_threshold
+        self.lag = Histogram()
+        self.max_lag = 0.0
+        self.longest_block = None
+        self.blocked_stack = None
+        self.last_tick = None
+        self.hub_ident = None
+        self.sentinel = None
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self.last_tick = time.monotonic()
+        self.hub_ident = get_ident()
+        self.sentinel = eventlet.spawn(self.run_sentinel)
+        if self.log_threshold is not None:
+            watchdog = original("threading").Thread(
+                target=self.run_watchdog, name="grpc lag watchdog", daemon=True
+            )
+            watchdog.start()
+
+    def stop(self):
+        self.running = False
+        if self.sentinel is not None:
+            self.sentinel.kill()
+            self.sentinel = None
+
+    def run_sentinel(self):
+        while self.running:
+            started = time.monotonic()
+            eventlet.sleep(self.interval)
+            self.last_tick = now = time.monotonic()
+            self.record(max(now - started - self.interval, 0))
+
+    def record(self, lag):
+        self.lag.record(lag)
+        if lag > self.max_lag:
+            self.max_lag = lag
+
+        stack, self.blocked_stack = self.blocked_stack, None
+        if stack is None:
+            return
+        if self.longest_block is None or lag > self.longest_block[0]:
+            self.longest_block = (lag, stack)
+            log.warning(
+                "eventlet hub blocked for %.3fs, longest so far, by:\n%s", lag, stack
+            )
+
+    def run_watchdog(self):
+        """Capture the stack of the hub's thread while it is blocked.
+
+        Runs in an OS thread, so that it isn't blocked along with the hub.
+        """
+        sleep = original("time").sleep
+        while self.running:
+            sleep(self.log_threshold / 2)
+            blocked_for = time.monotonic() - self.last_tick - self.interval
+            if blocked_for < self.log_threshold or self.blocked_stack is not None:
+                continue
+            frame = sys._current_frames().get(self.hub_ident)
+            if frame is not None:
+                self.blocked_stack = "".join(traceback.format_stack(frame))
+
+    def snapshot(self):
+        """Return a dictionary of the lag percentiles, in seconds."""
+        return {
+            "count": self.lag.count,
+            "p50": self.lag.percentile(50),
+            "p90": self.lag.percentile(90),
+            "p99": self.lag.percentile(99),
+            "max": self.max_lag,
+        }
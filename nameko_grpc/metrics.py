@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""Metrics about the calls made by clients and handled by servers.
+
+For each method, `Metrics` counts the calls started and the calls finished with each
+status code, the messages and bytes sent and received, and keeps histograms of call
+latency. The number of calls in flight is the difference between the calls started
+and finished.
+
+Recording doesn't take any locks. Each OS thread records into its own shard, which
+only that thread writes to, and the shards are merged when the metrics are read.
+Greenthreads share the shard of the OS thread they run on; they can't preempt
+each other while recording.
+"""
+import time
+
+from eventlet.patcher import original
+
+from nameko_grpc.errors import STATUS_CODE_INT_TO_ENUM_MAP
+
+
+get_ident = original("_thread").get_ident
+
+
+# durations are recorded in microseconds, into histogram buckets that are linear
+# within each power of two. with 16 sub-buckets, the relative error is under 6.25%
+RESOLUTION = 1e-6
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+# `le` bounds of the histograms exported to Prometheus, in seconds
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+
+def bucket_index(value):
+    """Return the index of the histogram bucket for the non-negative integer
+    `value`.
+    """
+    if value < SUB_BUCKETS:
+        return value
+    exponent = value.bit_length() - SUB_BUCKET_BITS - 1
+    return (exponent + 1) * SUB_BUCKETS + (value >> exponent) - SUB_BUCKETS
+
+
+def bucket_upper_bound(index):
+    """Return the exclusive upper bound of the values in the bucket at `index`."""
+    if index < 2 * SUB_BUCKETS:
+        return index + 1
+    exponent = index // SUB_BUCKETS - 1
+    mantissa = index % SUB_BUCKETS + SUB_BUCKETS
+    return (mantissa + 1) << exponent
+
+
+def status_code(response_stream, request_stream=None):
+    """Return the `StatusCode` of a call whose `response_stream` has closed.
+
+    An error that closed `request_stream`, such as a cancellation, takes precedence
+    over a successful response.
+    """
+    error = response_stream.error or (request_stream and request_stream.error)
+    if error:
+        return error.code
+    status = int(response_stream.trailers.get("grpc-status", 0))
+    return STATUS_CODE_INT_TO_ENUM_MAP[status]
+
+
+class Histogram:
+    """Histogram of durations in seconds, with a bounded relative error in the
+    style of HdrHistogram.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.sum = 0.0
+
+    def record(self, seconds):
+        index = bucket_index(max(int(seconds / RESOLUTION), 0))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.sum += seconds
+
+    def merge(self, other):
+        for index, count in list(other.counts.items()):
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.sum += other.sum
+
+    def percentile(self, percentile):
+        """Return an upper bound of the `percentile`th percentile duration, or None
+        if nothing has been recorded.
+        """
+        target = self.count * percentile / 100
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return bucket_upper_bound(index) * RESOLUTION
+
+    def cumulative_counts(self, bounds):
+        """Return the number of durations recorded at or below each of `bounds`,
+        to the resolution of the histogram's buckets.
+        """
+        counts = sorted(self.counts.items())
+        result = []
+        seen = 0
+        position = 0
+        for bound in bounds:
+            while (
+                position < len(counts)
+                and bucket_upper_bound(counts[position][0]) * RESOLUTION <= bound
+            ):
+                seen += counts[position][1]
+                position += 1
+            result.append(seen)
+        return result
+
+
+class MethodMetrics:
+    """The metrics of a single method."""
+
+    def __init__(self):
+        self.started = 0
+        self.handled = {}
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency = {}
+
+    @property
+    def in_flight(self):
+        return self.started - sum(self.handled.values())
+
+    def observe(self, phase, seconds):
+        try:
+            histogram = self.latency[phase]
+        except KeyError:
+            histogram = self.latency[phase] = Histogram()
+        histogram.record(seconds)
+
+    def merge(self, other):
+        self.started += other.started
+        for code, count in list(other.handled.items()):
+            self.handled[code] = self.handled.get(code, 0) + count
+        self.messages_sent += other.messages_sent
+        self.messages_received += other.messages_received
+        self.bytes_sent += other.bytes_sent
+        self.bytes_received += other.bytes_received
+        for phase, histogram in list(other.latency.items()):
+            self.latency.setdefault(phase, Histogram()).merge(histogram)
+
+
+class Metrics:
+    """Collects the metrics of the calls made by a client or handled by a server.
+
+    `side` is "client" or "server", and prefixes the names of the exported
+    metrics.
+    """
+
+    def __init__(self, side):
+        self.side = side
+        self.shards = {}
+
+    def method(self, method):
+        """Return the current thread's `MethodMetrics` for `method`."""
+        ident = get_ident()
+        try:
+            shard = self.shards[ident]
+        except KeyError:
+            shard = self.shards.setdefault(ident, {})
+        try:
+            return shard[method]
+        except KeyError:
+            metrics = shard[method] = MethodMetrics()
+            return metrics
+
+    def snapshot(self):
+        """Return a dictionary of the `MethodMetrics` of each method, merged from
+        every thread.
+        """
+        merged = {}
+        for shard in list(self.shards.values()):
+            for method, metrics in list(shard.items()):
+                merged.setdefault(method, MethodMetrics()).merge(metrics)
+        return merged
+
+    def render_prometheus(self):
+        """Render the metrics in the Prometheus text exposition format."""
+        prefix = "grpc_{}".format(self.side)
+        snapshot = sorted(self.snapshot().items())
+        lines = []
+
+        def family(name, kind, description):
+            lines.append("# HELP {} {}".format(name, description))
+            lines.append("# TYPE {} {}".format(name, kind))
+
+        def sample(name, labels, value):
+            labels = ",".join('{}="{}"'.format(key, val) for key, val in labels)
+            lines.append("{}{{{}}} {}".format(name, labels, value))
+
+        def method_labels(method):
+            _, service, name = method.split("/")
+            return [("grpc_service", service), ("grpc_method", name)]
+
+        counters = [
+            ("started_total", "started", "Total number of calls started."),
+            ("msg_sent_total", "messages_sent", "Total number of messages sent."),
+            (
+                "msg_received_total",
+                "messages_received",
+                "Total number of messages received.",
+            ),
+            ("bytes_sent_total", "bytes_sent", "Total number of bytes sent."),
+            (
+                "bytes_received_total",
+                "bytes_received",
+                "Total number of bytes received.",
+            ),
+        ]
+        for suffix, attr, description in counters:
+            name = "{}_{}".format(prefix, suffix)
+            family(name, "counter", description)
+            for method, metrics in snapshot:
+                sample(name, method_labels(method), getattr(metrics, attr))
+
+        name = "{}_handled_total".format(prefix)
+        family(name, "counter", "Total number of calls finished, by status code.")
+        for method, metrics in snapshot:
+            for code, count in sorted(metrics.handled.items()):
+                sample(name, method_labels(method) + [("grpc_code", code)], count)
+
+        name = "{}_in_flight".format(prefix)
+        family(name, "gauge", "Number of calls in flight.")
+        for method, metrics in snapshot:
+            sample(name, method_labels(method), metrics.in_flight)
+
+        phases = sorted({phase for _, metrics in snapshot for phase in metrics.latency})
+        for phase in phases:
+            name = "{}_{}_seconds".format(prefix, phase)
+            family(name, "histogram", "Latency of calls, {} phase.".format(phase))
+            for method, metrics in snapshot:
+                histogram = metrics.latency.get(phase)
+                if histogram is None:
+                    continue
+                labels = method_labels(method)
+                cumulative = histogram.cumulative_counts(LATENCY_BUCKETS)
+                for bound, count in zip(LATENCY_BUCKETS, cumulative):
+                    le = ("le", repr(float(bound)))
+                    sample(name + "_bucket", labels + [le], count)
+                sample(name + "_bucket", labels + [("le", "+Inf")], histogram.count)
+                sample(name + "_sum", labels, histogram.sum)
+                sample(name + "_count", labels, histogram.count)
+
+        return "\n".join(lines) + "\n"
+
+
+class CallMetrics:
+    """Records the metrics of a single call as it progresses.
+
+    Set as the `metrics` of both streams of the call, so that they count the
+    messages they send and receive. The call's latency is recorded in phases:
+    each call to `phase` records the time since the previous one, and `finish`
+    records the total time since the call started as the "handling" phase.
+    """
+
+    def __init__(self, metrics, method):
+        self.metrics = metrics
+        self.method = method
+        self.started_at = self.phase_started_at = time.monotonic()
+        metrics.method(method).started += 1
+
+    def message_sent(self, size):
+        metrics = self.metrics.method(self.method)
+        metrics.messages_sent += 1
+        metrics.bytes_sent += size
+
+    def message_received(self, size):
+        metrics = self.metrics.method(self.method)
+        metrics.messages_received += 1
+        metrics.bytes_received += size
+
+    def phase(self, name):
+        now = time.monotonic()
+        self.metrics.method(self.method).observe(name, now - self.phase_started_at)
+        self.phase_started_at = now
+
+    def finish(self, code):
+        metrics = self.metrics.method(self.method)
+        metrics.observe("handling", time.monotonic() - self.started_at)
+        metrics.handled[code.name] = metrics.handled.get(code.name, 0) + 1
+
+    def finish_when_closed(self, response_stream, request_stream=None):
+        """Finish the call when `response_stream` closes, with the status code
+        returned by `status_code`.
+        """
+
+        def closed():
+            self.finish(status_code(response_stream, request_stream))
+
+        if not response_stream.when_closed(closed):
+            closed()
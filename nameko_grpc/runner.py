@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Run Nameko services in several worker processes sharing one gRPC port.
+
+Each worker is a separate process with its own `GrpcServer`, bound to the port with
+SO_REUSEPORT so that the kernel distributes incoming connections between them.
+
+    $ python -m nameko_grpc.runner --processes 4 --config config.yaml module
+"""
+import os
+import signal
+import sys
+from logging import getLogger
+
+import click
+from nameko import config
+from nameko.cli.click_arguments import argument_services
+from nameko.cli.click_options import option_config_file, option_define
+from nameko.cli.utils import setup_config
+
+
+log = getLogger(__name__)
+
+
+def run_worker(services):
+    import eventlet
+
+    eventlet.monkey_patch()  # noqa (code before rest of imports)
+
+    from nameko.cli.run import main
+
+    main(services, None)
+
+
+def run_workers(services, processes):
+    """Fork `processes` worker processes, each running `services`, and wait for
+    them to exit.
+
+    The workers run in their own process group. SIGINT and SIGTERM are forwarded
+    to them as SIGINT, which stops them gracefully in the same way as `nameko run`;
+    a second signal kills them. Returns the number of workers that exited
+    unsuccessfully.
+    """
+    config["GRPC_REUSE_PORT"] = True
+
+    pids = set()
+    for _ in range(processes):
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover (runs in the worker)
+            os.setpgid(0, 0)
+            status = 0
+            try:
+                run_worker(services)
+            except BaseException:
+                log.exception("Worker process failed")
+                status = 1
+            finally:
+                os._exit(status)
+        pids.add(pid)
+
+    def forward(signum, frame):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGINT)
+            except ProcessLookupError:
+                pass  # already exited
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+
+    failures = 0
+    while pids:
+        pid, status = os.waitpid(-1, 0)
+        if pid in pids:
+            pids.discard(pid)
+            if status != 0:
+                failures += 1
+    return failures
+
+
+@click.command()
+@click.option(
+    "-p",
+    "--processes",
+    help="The number of worker processes. Defaults to the number of CPUs.",
+    type=click.IntRange(min=1),
+    default=os.cpu_count,
+)
+@option_config_file()
+@option_define()
+@argument_services()
+def main(processes, config_file, define, services):
+    setup_config(config_file, define)
+    sys.exit(1 if run_workers(services, processes) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -34,6 +34,9 @@ class SslConfig:
             config = DEFAULT_SSL_CONFIG
         self.config = config
 
+        self._server_context = None
+        self._client_context = None
+
     def __bool__(self):
         return bool(self.config)
 
@@ -66,17 +69,30 @@ class SslConfig:
         return self.config.get("cert_chain", None)
 
     def server_context(self):
-        """Returns a configured context for use in a server."""
-        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-        if self.cert_chain:
-            context.load_cert_chain(**self.cert_chain)
-        context.set_alpn_protocols(["h2"])
-        return context
+        """Returns a configured context for use in a server.
+
+        The context is created once and reused. Session tickets are enabled so that
+        reconnecting clients can resume their sessions.
+        """
+        if self._server_context is None:
+            context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            if self.cert_chain:
+                context.load_cert_chain(**self.cert_chain)
+            context.set_alpn_protocols(["h2"])
+            context.options &= ~ssl.OP_NO_TICKET
+            self._server_context = context
+        return self._server_context
 
     def client_context(self):
-        """Returns a configured context for use in a client."""
-        context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
-        context.check_hostname = self.check_hostname
-        context.verify_mode = self.verify_mode
-        context.set_alpn_protocols(["h2"])
-        return context
+        """Returns a configured context for use in a client.
+
+        The context is created once and reused, which avoids reloading the CA
+        certificates on every connection and allows sessions to be resumed.
+        """
+        if self._client_context is None:
+            context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
+            context.check_hostname = self.check_hostname
+            context.verify_mode = self.verify_mode
+            context.set_alpn_protocols(["h2"])
+            self._client_context = context
+        return self._client_context
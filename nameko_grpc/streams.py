@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import struct
+import time
+from functools import partial
 from queue import Empty, Queue
 
 from eventlet import greenthread
@@ -14,6 +17,11 @@ HEADER_LENGTH = 5
 STREAM_END = object()
 
 
+def set_ready(future):
+    if not future.done():
+        future.set_result(None)
+
+
 class ByteBuffer:
     def __init__(self):
         self.bytes = bytearray()
@@ -54,6 +62,13 @@ class StreamBase:
         self.queue = Queue()
         self.buffer = ByteBuffer()
         self.closed = False
+        self.error = None
+        self.close_callbacks = []
+
+        # per-call `CallMetrics`, if metrics are enabled
+        self.metrics = None
+        # per-call `CallTiming`, if timing records are enabled
+        self.timing = None
 
     @property
     def exhausted(self):
@@ -62,6 +77,18 @@ class StreamBase:
         """
         return self.closed and self.queue.empty() and self.buffer.empty()
 
+    def when_closed(self, callback):
+        """Invoke `callback` when this stream is closed, whether because it was
+        completed, cancelled or timed out.
+
+        Returns False without registering the callback if the stream is already
+        closed.
+        """
+        if self.closed:
+            return False
+        self.close_callbacks.append(callback)
+        return True
+
     def close(self, error=None):
         """Close this stream, preventing further messages or data to be added.
 
@@ -84,19 +111,64 @@ class StreamBase:
             assert isinstance(error, GrpcError)
 
         self.closed = True
+        self.error = error
         self.queue.put(error or STREAM_END)
 
+        callbacks, self.close_callbacks = self.close_callbacks, []
+        for callback in callbacks:
+            callback()
+
 
 class ReceiveStream(StreamBase):
     """An HTTP2 stream that receives data as bytes to be iterated over as GRPC
     messages.
     """
 
+    def __init__(self, *args, **kwargs):
+        self.ready_callbacks = []
+        # for requests with a timeout, the `time.monotonic` time by which they
+        # must complete
+        self.deadline = None
+        super().__init__(*args, **kwargs)
+
+    def time_remaining(self):
+        """Return the number of seconds until this stream's deadline, or None if it
+        has no deadline.
+        """
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0)
+
+    def when_ready(self, callback):
+        """Invoke `callback` as soon as there is something to consume from this
+        stream, i.e. a complete message or the end of the stream.
+
+        The callback is invoked immediately if the stream is already ready.
+        Otherwise it is invoked by whichever thread writes to or closes the
+        stream, so it must not block.
+        """
+        if self.queue.empty():
+            self.ready_callbacks.append(callback)
+        else:
+            callback()
+
+    def notify_ready(self):
+        callbacks, self.ready_callbacks = self.ready_callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def close(self, error=None):
+        super().close(error)
+        self.notify_ready()
+
     def write(self, data):
         """Write data to this stream, separating it into message-sized chunks."""
         if self.closed:
             return
 
+        if self.timing is not None:
+            self.timing.mark("first_data_received")
+
         self.buffer.write(data)
         while True:
 
@@ -111,7 +183,10 @@ class ReceiveStream(StreamBase):
 
             self.buffer.discard(HEADER_LENGTH)
             message_data = bytes(self.buffer.read(message_length))
+            if self.metrics is not None:
+                self.metrics.message_received(HEADER_LENGTH + message_length)
             self.queue.put((compressed_flag, message_data))
+            self.notify_ready()
 
     def consume(self, message_type):
         """Consume the data in this stream by yielding `message_type` messages,
@@ -119,19 +194,42 @@ class ReceiveStream(StreamBase):
         """
         while True:
             item = self.queue.get()
-            if isinstance(item, GrpcError):
-                raise item
-            elif item is STREAM_END:
+            if item is STREAM_END:
+                break
+            yield self.parse(item, message_type)
+
+    async def consume_async(self, message_type):
+        """Asynchronous version of `consume`, for use on an asyncio event loop.
+
+        The stream must be written to and closed from the thread running the loop.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            if self.queue.empty():
+                ready = loop.create_future()
+                self.when_ready(partial(set_ready, ready))
+                await ready
+
+            item = self.queue.get_nowait()
+            if item is STREAM_END:
                 break
+            yield self.parse(item, message_type)
 
-            compressed, message_data = item
-            if compressed:
-                message_data = decompress(message_data)
+    def parse(self, item, message_type):
+        """Parse a `message_type` message from an item in the queue, or raise if
+        the stream was closed with an error.
+        """
+        if isinstance(item, GrpcError):
+            raise item
+
+        compressed, message_data = item
+        if compressed:
+            message_data = decompress(message_data)
 
-            message = message_type()
-            message.ParseFromString(message_data)
+        message = message_type()
+        message.ParseFromString(message_data)
 
-            yield message
+        return message
 
 
 class SendStream(StreamBase):
@@ -148,9 +246,25 @@ class SendStream(StreamBase):
         return self.headers.get("grpc-encoding")
 
     def populate(self, iterable):
-        """Populate this stream with an iterable of messages."""
+        """Populate this stream with an iterable of messages.
+
+        If the stream is closed before the iterable is exhausted, e.g. because the
+        call was cancelled, a generator is closed at the point it yielded.
+        """
         for item in iterable:
             if self.closed:
+                if hasattr(iterable, "close"):
+                    iterable.close()
+                return
+            self.queue.put(item)
+        self.close()
+
+    async def populate_async(self, aiterable):
+        """Populate this stream with an asynchronous iterable of messages."""
+        async for item in aiterable:
+            if self.closed:
+                if hasattr(aiterable, "aclose"):
+                    await aiterable.aclose()
                 return
             self.queue.put(item)
         self.close()
@@ -195,13 +309,23 @@ class SendStream(StreamBase):
 
             # add the bytes from the message to the buffer
             if message and message != STREAM_END:
-                body = self.serialize_message(message)
-                compressed, body = compress(body, self.encoding)
+                if self.timing is None:
+                    body = self.serialize_message(message)
+                    compressed, body = compress(body, self.encoding)
+                else:
+                    started = time.monotonic()
+                    body = self.serialize_message(message)
+                    serialized = time.monotonic()
+                    compressed, body = compress(body, self.encoding)
+                    self.timing.serialize_time += serialized - started
+                    self.timing.compress_time += time.monotonic() - serialized
 
                 data = (
                     struct.pack("?", compressed) + struct.pack(">I", len(body)) + body
                 )
                 self.buffer.write(data)
+                if self.metrics is not None:
+                    self.metrics.message_sent(len(data))
 
             # This while loop can lockup the main thread for a long time if we have a
             # large queue of large messages to process. We need to yield to cooperate
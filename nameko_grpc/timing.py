@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""Timing records of individual calls, for debugging slow calls.
+
+When enabled, each call made by a client or handled by a server gets a
+`CallTiming`, which records when the call passes each of these events:
+
+* `enqueued`: the request was queued on a client connection, to be sent once the
+  server's concurrency limit allows;
+* `headers_sent`: the request or response headers were sent;
+* `first_data_sent`: the first DATA frame of the request or response was sent;
+* `first_data_received`: the first bytes of the response or request were received;
+* `end_stream_sent`: the request or response was completely sent;
+* `worker_started`, `handler_finished`: on a server, when the worker handling the
+  call was spawned and when the method produced its response.
+
+It also accumulates the time spent serializing and compressing the messages
+sent. Events that don't happen, such as `first_data_sent` for a call that fails
+before responding, are omitted.
+
+When the call completes, its record is passed to a callback. Records of calls
+slower than `slow_threshold` are always passed; other records are sampled at
+`sample_rate`.
+"""
+import random
+import time
+from logging import getLogger
+
+from nameko.utils import import_from_path
+
+from nameko_grpc.metrics import status_code
+
+
+log = getLogger(__name__)
+
+
+class CallTiming:
+    """The timing record of a single call.
+
+    `side` is "client" or "server". Once the call has completed, `code` is its
+    `StatusCode` and `duration` its total duration in seconds.
+    """
+
+    def __init__(self, timings, side, method):
+        self.timings = timings
+        self.side = side
+        self.method = method
+        self.started_at = time.monotonic()
+        self.events = {}
+        self.serialize_time = 0.0
+        self.compress_time = 0.0
+        self.code = None
+        self.duration = None
+
+    def mark(self, event):
+        """Record the time of `event`, unless it has already happened."""
+        if event not in self.events:
+            self.events[event] = time.monotonic()
+
+    def finish(self, code):
+        self.code = code
+        self.duration = time.monotonic() - self.started_at
+        self.timings.finished(self)
+
+    def finish_when_closed(self, response_stream, request_stream=None):
+        """Finish the call when `response_stream` closes."""
+
+        def closed():
+            self.finish(status_code(response_stream, request_stream))
+
+        if not response_stream.when_closed(closed):
+            closed()
+
+    def as_dict(self):
+        """Return the record as a dictionary, with the time of each event as the
+        number of seconds since the call started, in the order they happened.
+        """
+        events = sorted(self.events.items(), key=lambda item: item[1])
+        return {
+            "side": self.side,
+            "method": self.method,
+            "code": self.code.name if self.code else None,
+            "duration": self.duration,
+            "events": {event: at - self.started_at for event, at in events},
+            "serialize_time": self.serialize_time,
+            "compress_time": self.compress_time,
+        }
+
+
+class Timings:
+    """Creates the `CallTiming` records of calls, and passes completed records to
+    `callback`, or to the function at its import path if it is a string.
+
+    Records of calls that took at least `slow_threshold` seconds are always passed
+    on, and other records with probability `sample_rate`. `sample_rate` defaults
+    to 1 without a `slow_threshold`, and to 0 with one.
+
+    The callback is called on whichever thread completes the call, which may be a
+    connection's event loop, so it should be quick, for example logging the record.
+    """
+
+    def __init__(self, callback, sample_rate=None, slow_threshold=None):
+        if isinstance(callback, str):
+            callback = import_from_path(callback)
+        if sample_rate is None:
+            sample_rate = 1 if slow_threshold is None else 0
+        self.callback = callback
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+
+    def start(self, side, method):
+        return CallTiming(self, side, method)
+
+    def sampled(self, timing):
+        if self.slow_threshold is not None and timing.duration >= self.slow_threshold:
+            return True
+        return random.random() < self.sample_rate
+
+    def finished(self, timing):
+        if not self.sampled(timing):
+            return
+        try:
+            self.callback(timing)
+        except Exception:
+            log.exception("Error in call timing callback %s", self.callback)
+
+
+def timings_from_config(config):
+    """Return `Timings` configured with the `GRPC_TIMING_CALLBACK`,
+    `GRPC_TIMING_SAMPLE_RATE` and `GRPC_TIMING_SLOW_THRESHOLD` config keys, or None
+    if no callback is configured.
+    """
+    callback = config.get("GRPC_TIMING_CALLBACK")
+    if not callback:
+        return None
+    return Timings(
+        callback,
+        sample_rate=config.get("GRPC_TIMING_SAMPLE_RATE"),
+        slow_threshold=config.get("GRPC_TIMING_SLOW_THRESHOLD"),
+    )
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+import select
+import socket
+import ssl
+import time
+from logging import getLogger
+
+
+log = getLogger(__name__)
+
+
+SELECT_TIMEOUT = 0.01
+
+RECV_BUFFER_SIZE = 65535
+
+DEFAULT_SOCKET_OPTIONS = {
+    "nodelay": True,
+    "keepalive": True,
+}
+
+
+class SocketOptions:
+    def __init__(self, config=None):
+        """Valid values for `config` are:
+
+        - None, to use the defaults
+        - A dict with the following format, all keys optional:
+
+            {
+                "nodelay": <True|False>,
+                "keepalive": <True|False>,
+                "sndbuf": <bytes>,
+                "rcvbuf": <bytes>
+            }
+
+        `nodelay` sets TCP_NODELAY, disabling Nagle's algorithm so that small
+        frames are sent immediately, and `keepalive` sets SO_KEEPALIVE. Both are
+        enabled by default. `sndbuf` and `rcvbuf` set SO_SNDBUF and SO_RCVBUF; the
+        operating system's defaults are used if they are omitted.
+        """
+        self.config = dict(DEFAULT_SOCKET_OPTIONS, **(config or {}))
+
+    @property
+    def nodelay(self):
+        return self.config["nodelay"]
+
+    @property
+    def keepalive(self):
+        return self.config["keepalive"]
+
+    @property
+    def sndbuf(self):
+        return self.config.get("sndbuf", None)
+
+    @property
+    def rcvbuf(self):
+        return self.config.get("rcvbuf", None)
+
+    def apply(self, sock):
+        """Set the configured options on the TCP socket `sock`.
+
+        Sockets of other families are left untouched.
+        """
+        if sock.family not in (socket.AF_INET, socket.AF_INET6):
+            return
+
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self.nodelay))
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, int(self.keepalive))
+        if self.sndbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+        if self.rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+
+
+class SocketTransport:
+    """Drives a `ConnectionManager` over a blocking socket.
+
+    The same transport is used by the threaded client and, with Eventlet's green
+    sockets and `select`, by the Nameko extensions.
+
+    Data is read into a reusable buffer of `recv_buffer_size` bytes, and the socket
+    is drained until it would block before the connection is iterated again. For
+    TLS sockets this includes any data already decrypted, which `select` can't see.
+    Everything the connection has to send after each iteration, for any number of
+    streams, is written to the socket at once.
+    """
+
+    def __init__(self, sock, connection, recv_buffer_size=RECV_BUFFER_SIZE):
+        self.sock = sock
+        self.connection = connection
+
+        self.recv_buffer = bytearray(recv_buffer_size)
+        self.recv_view = memoryview(self.recv_buffer)
+
+        # the TLS session, if any, recorded when the transport closes
+        self.session = None
+
+        # a socket pair used by other threads to wake the event loop from `select`
+        self.wakeup_sock, self.wakeup_trigger = socket.socketpair()
+        self.wakeup_pending = False
+
+    def run_forever(self):
+        """Event loop."""
+        connection = self.connection
+        connection.connection_made(self)
+
+        with connection.cleanup_on_exit():
+            try:
+                while connection.run:
+
+                    started = time.monotonic()
+                    connection.on_iteration()
+                    connection.statistics.iterated(time.monotonic() - started)
+
+                    if not connection.run:
+                        break
+
+                    data = connection.data_to_send()
+                    if data:
+                        started = time.monotonic()
+                        self.sock.sendall(data)
+                        connection.statistics.waited_to_write(
+                            time.monotonic() - started
+                        )
+
+                    started = time.monotonic()
+                    ready, _, _ = select.select(
+                        [self.sock, self.wakeup_sock], [], [], SELECT_TIMEOUT
+                    )
+                    if not ready:
+                        # how much later than the timeout the loop was resumed
+                        waited = time.monotonic() - started
+                        connection.statistics.lagged(max(waited - SELECT_TIMEOUT, 0))
+                    if self.wakeup_sock in ready:
+                        self.wakeup_sock.recv(4096)
+                        self.wakeup_pending = False
+                    if self.sock not in ready:
+                        continue
+
+                    if not self.receive():
+                        break
+            finally:
+                self.close()
+
+    def receive(self):
+        """Read from the socket until it would block, passing the data to the
+        connection. Returns False if the peer has closed the connection.
+        """
+        timeout = self.sock.gettimeout()
+        self.sock.settimeout(0)
+        try:
+            while self.connection.run:
+                try:
+                    length = self.sock.recv_into(self.recv_buffer)
+                except (BlockingIOError, ssl.SSLWantReadError, socket.timeout):
+                    break  # would block
+                if not length:
+                    return False
+
+                self.connection.receive_data(bytes(self.recv_view[:length]))
+        finally:
+            self.sock.settimeout(timeout)
+        return True
+
+    def wakeup(self):
+        """Wake the event loop if it is waiting for data, so that it iterates
+        immediately. May be called from any thread.
+        """
+        if self.wakeup_pending:
+            return
+        self.wakeup_pending = True
+        try:
+            self.wakeup_trigger.send(b"\x00")
+        except OSError:
+            pass  # transport has closed
+
+    def close(self):
+        self.session = getattr(self.sock, "session", None)
+        self.recv_view.release()
+        self.sock.close()
+        self.wakeup_sock.close()
+        self.wakeup_trigger.close()
@@ -41,7 +41,8 @@ setup(
             "objgraph",
             "wrapt",
             "zmq",
-        ]
+        ],
+        "uvloop": ["uvloop"],
     },
     zip_safe=True,
     license="Apache License, Version 2.0",
@@ -313,6 +313,7 @@ def start_nameko_server(request, spec_dir, container_factory, grpc_port):
         proto_name=None,
         compression_algorithm="none",
         compression_level="high",
+        extra_config=None,
     ):
         if proto_name is None:
             proto_name = service_name
@@ -327,6 +328,8 @@ def start_nameko_server(request, spec_dir, container_factory, grpc_port):
         }
         if ssl_options:
             conf.update({"GRPC_SSL": ssl_options})
+        if extra_config:
+            conf.update(extra_config)
 
         config.setup(conf)
         container = container_factory(service_cls)
@@ -427,7 +430,7 @@ def start_dependency_provider(
 
             grpc_proxy = get_extension(container, GrpcProxy)
             clients.append(grpc_proxy)
-            return grpc_proxy.get_dependency(Mock(context_data={}))
+            return grpc_proxy.get_dependency(Mock(context_data={}, args=()))
 
         yield make
 
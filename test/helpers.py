@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import base64
 import json
 import os
@@ -427,3 +428,36 @@ def instrumented(wrapped, instance, args, kwargs):
         response = stash.stash_response(response)
 
     return response
+
+
+class AsyncExample:
+    """Implementation of the example service for `nameko_grpc.aio.AsyncServer`."""
+
+    def __init__(self, protobufs):
+        self.protobufs = protobufs
+
+    async def unary_unary(self, request, context):
+        await asyncio.sleep(request.delay / 1000)
+        message = request.value * (request.multiplier or 1)
+        return self.protobufs.ExampleReply(message=message)
+
+    async def unary_stream(self, request, context):
+        message = request.value * (request.multiplier or 1)
+        for i in range(request.response_count):
+            yield self.protobufs.ExampleReply(message=message, seqno=i + 1)
+
+    async def stream_unary(self, request, context):
+        messages = []
+        async for req in request:
+            messages.append(req.value * (req.multiplier or 1))
+        return self.protobufs.ExampleReply(message=",".join(messages))
+
+    async def stream_stream(self, request, context):
+        index = 0
+        async for req in request:
+            index += 1
+            message = req.value * (req.multiplier or 1)
+            yield self.protobufs.ExampleReply(message=message, seqno=index)
+
+    async def unary_error(self, request, context):
+        raise Exception("boom")
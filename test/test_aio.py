@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+import time
+
+import pytest
+from grpc import StatusCode
+from mock import patch
+
+from nameko_grpc.aio import (
+    AsyncClient,
+    AsyncProxy,
+    AsyncServer,
+    new_event_loop,
+    run,
+)
+from nameko_grpc.errors import GrpcError
+
+from helpers import AsyncExample
+
+
+@pytest.fixture
+def servicer(protobufs):
+    return AsyncExample(protobufs)
+
+
+@pytest.fixture
+def async_server(grpc_port, stubs, servicer):
+    """Run an `AsyncServer` on an event loop in a background thread."""
+    loop = new_event_loop()
+    server = AsyncServer("127.0.0.1", grpc_port)
+    server.add_servicer(stubs.exampleStub, servicer)
+
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+    asyncio.run_coroutine_threadsafe(server.start(), loop).result(5)
+
+    yield server
+
+    asyncio.run_coroutine_threadsafe(server.stop(), loop).result(10)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+class TestAsyncClient:
+    @pytest.fixture(params=["client=nameko"])
+    def client_type(self, request):
+        return request.param[7:]
+
+    @pytest.fixture
+    def make_client(self, grpc_port, stubs):
+        def make():
+            return AsyncClient(f"//127.0.0.1:{grpc_port}", stubs.exampleStub)
+
+        return make
+
+    def test_unary_unary(self, server, make_client, protobufs):
+        async def main():
+            async with make_client() as client:
+                return await client.unary_unary(protobufs.ExampleRequest(value="A"))
+
+        response = run(main())
+        assert response.message == "A"
+
+    def test_unary_stream(self, server, make_client, protobufs):
+        async def main():
+            async with make_client() as client:
+                request = protobufs.ExampleRequest(value="A", response_count=2)
+                return [
+                    (response.message, response.seqno)
+                    async for response in client.unary_stream(request)
+                ]
+
+        assert run(main()) == [("A", 1), ("A", 2)]
+
+    def test_stream_unary(self, server, make_client, protobufs):
+        async def generate_requests():
+            for value in ["A", "B"]:
+                yield protobufs.ExampleRequest(value=value)
+
+        async def main():
+            async with make_client() as client:
+                return await client.stream_unary(generate_requests())
+
+        response = run(main())
+        assert response.message == "A,B"
+
+    def test_stream_unary_synchronous_iterator(self, server, make_client, protobufs):
+        def generate_requests():
+            for value in ["A", "B"]:
+                yield protobufs.ExampleRequest(value=value)
+
+        async def main():
+            async with make_client() as client:
+                return await client.stream_unary(generate_requests())
+
+        response = run(main())
+        assert response.message == "A,B"
+
+    def test_stream_stream(self, server, make_client, protobufs):
+        async def generate_requests():
+            for value in ["A", "B"]:
+                yield protobufs.ExampleRequest(value=value)
+
+        async def main():
+            async with make_client() as client:
+                return [
+                    (response.message, response.seqno)
+                    async for response in client.stream_stream(generate_requests())
+                ]
+
+        assert run(main()) == [("A", 1), ("B", 2)]
+
+    def test_concurrent_calls(self, server, make_client, protobufs):
+        async def main():
+            async with make_client() as client:
+                return await asyncio.gather(
+                    *[
+                        client.unary_unary(protobufs.ExampleRequest(value=str(i)))
+                        for i in range(10)
+                    ]
+                )
+
+        responses = run(main())
+        assert [response.message for response in responses] == [
+            str(i) for i in range(10)
+        ]
+
+    def test_error(self, server, make_client, protobufs):
+        async def main():
+            async with make_client() as client:
+                await client.unary_error(protobufs.ExampleRequest(value="A"))
+
+        with pytest.raises(GrpcError) as error:
+            run(main())
+        assert error.value.code == StatusCode.UNKNOWN
+        assert error.value.message == "Exception calling application: boom"
+
+    def test_timeout(self, server, make_client, protobufs):
+        async def main():
+            async with make_client() as client:
+                await client.unary_unary(
+                    protobufs.ExampleRequest(value="A", delay=1000), timeout=0.05
+                )
+
+        with pytest.raises(GrpcError) as error:
+            run(main())
+        assert error.value.code == StatusCode.DEADLINE_EXCEEDED
+
+    def test_channel_stats(self, server, make_client, protobufs):
+        async def main():
+            client = make_client()
+            async with client as proxy:
+                await proxy.unary_unary(protobufs.ExampleRequest(value="A"))
+                return client.channel().stats()
+
+        (stats,) = run(main())
+        assert stats["frames_sent"]["HEADERS"] == 1
+        assert stats["bytes_received"] > 0
+        assert stats["iterations"] > 0
+
+    def test_not_started(self, make_client, protobufs):
+        client = AsyncProxy(make_client())
+        with pytest.raises(GrpcError) as error:
+            client.unary_unary.future(protobufs.ExampleRequest(value="A"))
+        assert error.value.code == StatusCode.UNAVAILABLE
+
+
+class CancellableExample(AsyncExample):
+    """Records when its `unary_unary` method is cancelled."""
+
+    def __init__(self, protobufs):
+        super().__init__(protobufs)
+        self.cancelled = threading.Event()
+
+    async def unary_unary(self, request, context):
+        try:
+            return await super().unary_unary(request, context)
+        except asyncio.CancelledError:
+            self.cancelled.set()
+            raise
+
+
+class TestAsyncServer:
+    @pytest.fixture(params=["client=grpc", "client=nameko"])
+    def client_type(self, request):
+        return request.param[7:]
+
+    @pytest.fixture
+    def client(self, start_client, async_server):
+        return start_client("example")
+
+    def test_unary_unary(self, client, protobufs):
+        response = client.unary_unary(protobufs.ExampleRequest(value="A"))
+        assert response.message == "A"
+
+    def test_unary_stream(self, client, protobufs):
+        responses = client.unary_stream(
+            protobufs.ExampleRequest(value="A", response_count=2)
+        )
+        assert [(response.message, response.seqno) for response in responses] == [
+            ("A", 1),
+            ("A", 2),
+        ]
+
+    def test_stream_unary(self, client, protobufs):
+        def generate_requests():
+            for value in ["A", "B"]:
+                yield protobufs.ExampleRequest(value=value)
+
+        response = client.stream_unary(generate_requests())
+        assert response.message == "A,B"
+
+    def test_stream_stream(self, client, protobufs):
+        def generate_requests():
+            for value in ["A", "B"]:
+                yield protobufs.ExampleRequest(value=value)
+
+        responses = client.stream_stream(generate_requests())
+        assert [(response.message, response.seqno) for response in responses] == [
+            ("A", 1),
+            ("B", 2),
+        ]
+
+    def test_error(self, client, protobufs):
+        with pytest.raises(GrpcError) as error:
+            client.unary_error(protobufs.ExampleRequest(value="A"))
+        assert error.value.code == StatusCode.UNKNOWN
+        assert error.value.message == "Exception calling application: boom"
+
+    def test_method_not_found(self, client, protobufs):
+        with pytest.raises(GrpcError) as error:
+            client.not_found(protobufs.ExampleRequest(value="A"))
+        assert error.value.code == StatusCode.UNIMPLEMENTED
+
+    def test_timeout(self, client, protobufs):
+        with pytest.raises(GrpcError) as error:
+            client.unary_unary(
+                protobufs.ExampleRequest(value="A", delay=1000), timeout=0.05
+            )
+        assert error.value.code == StatusCode.DEADLINE_EXCEEDED
+
+
+class TestAsyncServerCancellation:
+    @pytest.fixture(params=["client=nameko"])
+    def client_type(self, request):
+        return request.param[7:]
+
+    @pytest.fixture
+    def servicer(self, protobufs):
+        return CancellableExample(protobufs)
+
+    @pytest.fixture
+    def client(self, start_client, async_server):
+        return start_client("example")
+
+    def test_cancel(self, client, servicer, protobufs):
+        future = client.unary_unary.future(
+            protobufs.ExampleRequest(value="A", delay=5000)
+        )
+        time.sleep(0.1)
+        assert future.cancel()
+
+        assert servicer.cancelled.wait(1)
+
+    def test_deadline(self, client, servicer, protobufs):
+        with pytest.raises(GrpcError) as error:
+            client.unary_unary(
+                protobufs.ExampleRequest(value="A", delay=5000), timeout=0.1
+            )
+        assert error.value.code == StatusCode.DEADLINE_EXCEEDED
+
+        assert servicer.cancelled.wait(1)
+
+    def test_deadline_timer_cancelled(self, client, async_server, protobufs):
+        loop = async_server.loop
+        timers = []
+
+        def call_later(delay, callback, *args):
+            timer = schedule(delay, callback, *args)
+            if callback == async_server.timeout:
+                timers.append(timer)
+            return timer
+
+        schedule = loop.call_later
+        with patch.object(loop, "call_later", new=call_later):
+            response = client.unary_unary(
+                protobufs.ExampleRequest(value="A"), timeout=30
+            )
+            assert response.message == "A"
+
+        assert len(timers) == 1
+        assert timers[0].cancelled()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import eventlet
+import pytest
+from eventlet.event import Event
+from grpc import StatusCode
+from nameko import config
+
+from nameko_grpc.client import Client
+from nameko_grpc.entrypoint import Grpc
+from nameko_grpc.errors import GrpcError
+
+
+class TestCancellation:
+    @pytest.fixture
+    def events(self):
+        return {"stopped": Event(), "callback": Event()}
+
+    @pytest.fixture
+    def service(self, container_factory, grpc_port, stubs, protobufs, events):
+        grpc = Grpc.implementing(stubs.exampleStub)
+
+        class Service:
+            name = "cancellation"
+
+            @grpc
+            def unary_unary(self, request, context):
+                context.add_callback(events["callback"].send)
+                while context.is_active():
+                    eventlet.sleep(0.01)
+                events["stopped"].send()
+                return protobufs.ExampleReply()
+
+            @grpc
+            def unary_stream(self, request, context):
+                context.add_callback(events["callback"].send)
+                seqno = 0
+                try:
+                    while True:
+                        seqno += 1
+                        yield protobufs.ExampleReply(seqno=seqno)
+                        eventlet.sleep(0.01)
+                finally:
+                    events["stopped"].send()
+
+        with config.patch({"GRPC_BIND_PORT": grpc_port}):
+            container = container_factory(Service)
+            container.start()
+            yield container
+
+    @pytest.fixture
+    def client(self, service, grpc_port, stubs):
+        client = Client(f"//localhost:{grpc_port}", stubs.exampleStub)
+        yield client.start()
+        client.stop()
+
+    def test_deadline_stops_streaming_response(self, client, protobufs, events):
+        responses = client.unary_stream(protobufs.ExampleRequest(), timeout=0.2)
+        with pytest.raises(GrpcError) as error:
+            for _ in responses:
+                pass
+        assert error.value.code == StatusCode.DEADLINE_EXCEEDED
+
+        with eventlet.Timeout(5):
+            events["stopped"].wait()
+            events["callback"].wait()
+
+    def test_cancel_stops_streaming_response(self, client, protobufs, events):
+        future = client.unary_stream.future(protobufs.ExampleRequest())
+        responses = future.result()
+        assert next(responses).seqno == 1
+
+        assert future.cancel()
+        with pytest.raises(GrpcError) as error:
+            for _ in responses:
+                pass
+        assert error.value.code == StatusCode.CANCELLED
+
+        with eventlet.Timeout(5):
+            events["stopped"].wait()
+            events["callback"].wait()
+
+    def test_cancel_after_completion(self, client, protobufs):
+        future = client.unary_stream.future(protobufs.ExampleRequest(), timeout=0.1)
+        with pytest.raises(GrpcError):
+            list(future.result())
+        assert not future.cancel()
+
+    def test_context_inactive_after_deadline(self, client, protobufs, events):
+        with pytest.raises(GrpcError) as error:
+            client.unary_unary(protobufs.ExampleRequest(), timeout=0.2)
+        assert error.value.code == StatusCode.DEADLINE_EXCEEDED
+
+        with eventlet.Timeout(5):
+            events["stopped"].wait()
+            events["callback"].wait()
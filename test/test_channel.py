@@ -1,11 +1,18 @@
 # -*- coding: utf-8 -*-
 # TODO would be good to have some unit tests for the channels here
 import gc
+import threading
+import time
+import weakref
 
 import objgraph
 import pytest
+from grpc import StatusCode
+from mock import Mock
 
+from nameko_grpc.channel import ClientConnectionPool
 from nameko_grpc.client import Client
+from nameko_grpc.errors import GrpcError
 
 
 class TestDisposeServerConnectionOnExit:
@@ -82,3 +89,67 @@ class TestDisposeClientConnectionOnExit:
 
         gc.collect()
         assert len(objgraph.by_type("ClientConnectionManager")) == 0
+
+
+class TestClientConnectionPoolGet:
+    def make_connection(self, alive=True, stopped=False):
+        connection = Mock(alive=alive)
+        connection.stopped.is_set.return_value = stopped
+        return connection
+
+    @pytest.fixture
+    def pool(self):
+        return ClientConnectionPool([], ssl=False, spawn_thread=Mock())
+
+    def add(self, pool, connection):
+        pool.connections.append(weakref.ref(connection))
+
+    def test_round_robin(self, pool):
+        conn_a = self.make_connection()
+        conn_b = self.make_connection()
+        self.add(pool, conn_a)
+        self.add(pool, conn_b)
+
+        assert [pool.get() for _ in range(4)] == [conn_a, conn_b, conn_a, conn_b]
+        assert len(pool.connections) == 2
+
+    def test_skips_terminating_connection(self, pool):
+        terminating = self.make_connection(alive=False)
+        conn = self.make_connection()
+        self.add(pool, terminating)
+        self.add(pool, conn)
+
+        assert pool.get() == conn
+        assert pool.get() == conn
+        # terminating connections are retained so they can be stopped
+        assert len(pool.connections) == 2
+
+    def test_prunes_stopped_connection(self, pool):
+        stopped = self.make_connection(alive=False, stopped=True)
+        conn = self.make_connection()
+        self.add(pool, stopped)
+        self.add(pool, conn)
+
+        assert pool.get() == conn
+        assert len(pool.connections) == 1
+
+    def test_unavailable_after_timeout(self, pool):
+        self.add(pool, self.make_connection(alive=False))
+
+        start = time.time()
+        with pytest.raises(GrpcError) as error:
+            pool.get(timeout=0.05)
+        assert time.time() - start >= 0.05
+        assert error.value.code == StatusCode.UNAVAILABLE
+
+    def test_waits_for_new_connection(self, pool):
+        conn = self.make_connection()
+
+        def add_connection():
+            time.sleep(0.01)
+            with pool.connection_ready:
+                self.add(pool, conn)
+                pool.connection_ready.notify_all()
+
+        threading.Thread(target=add_connection).start()
+        assert pool.get(timeout=1) == conn
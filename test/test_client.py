@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import pytest
+from mock import Mock, call, patch
+
+from nameko_grpc.client import Scheduler
+
+
+class TestScheduler:
+    @pytest.fixture
+    def scheduler(self):
+        scheduler = Scheduler(name="test scheduler")
+        scheduler.start()
+        yield scheduler
+        scheduler.stop()
+
+    def test_schedule(self, scheduler):
+        called = threading.Event()
+
+        start = time.monotonic()
+        scheduler.schedule(0.05, called.set)
+
+        assert called.wait(1)
+        assert time.monotonic() - start >= 0.05
+
+    def test_order(self, scheduler):
+        target = Mock()
+        done = threading.Event()
+
+        scheduler.schedule(0.03, target, args=("b",))
+        scheduler.schedule(0.01, target, args=("a",))
+        scheduler.schedule(0.05, done.set)
+
+        assert done.wait(1)
+        assert target.call_args_list == [call("a"), call("b")]
+
+    def test_error_does_not_stop_scheduler(self, scheduler):
+        called = threading.Event()
+
+        scheduler.schedule(0, Mock(side_effect=Exception("boom")))
+        scheduler.schedule(0.01, called.set)
+
+        assert called.wait(1)
+
+    def test_stop_discards_pending(self, scheduler):
+        target = Mock()
+
+        scheduler.schedule(0.01, target)
+        scheduler.stop()
+
+        time.sleep(0.05)
+        assert not target.called
+
+    def test_cancel(self, scheduler):
+        target = Mock()
+        done = threading.Event()
+
+        scheduler.schedule(0.01, target).cancel()
+        scheduler.schedule(0.03, done.set)
+
+        assert done.wait(1)
+        assert not target.called
+        assert scheduler.timers == []
+
+    def test_cancel_after_call(self, scheduler):
+        called = threading.Event()
+
+        scheduled = scheduler.schedule(0, called.set)
+        assert called.wait(1)
+
+        scheduled.cancel()
+        assert scheduler.cancelled == 0
+
+    def test_cancelled_calls_discarded(self, scheduler):
+        scheduled = [scheduler.schedule(60, Mock()) for _ in range(10)]
+        for call_ in scheduled[:6]:
+            call_.cancel()
+
+        assert len(scheduler.timers) == 4
+        assert scheduler.cancelled == 0
+
+
+class TestThreadReuse:
+    @pytest.fixture(params=["server=nameko"])
+    def server_type(self, request):
+        return request.param[7:]
+
+    @pytest.fixture(params=["client=nameko"])
+    def client_type(self, request):
+        return request.param[7:]
+
+    def test_no_thread_per_call(self, client, protobufs):
+        def generate_requests():
+            yield protobufs.ExampleRequest(value="A")
+
+        with patch.object(
+            client.client, "spawn_thread", wraps=client.client.spawn_thread
+        ) as spawn_thread:
+            for _ in range(5):
+                response = client.stream_unary(generate_requests(), timeout=1)
+                assert response.message == "A"
+
+        assert not spawn_thread.called
+
+    def test_materialised_request_sent_inline(self, client, protobufs):
+        requests = [protobufs.ExampleRequest(value="A")]
+
+        with patch.object(
+            client.client, "spawn_task", wraps=client.client.spawn_task
+        ) as spawn_task:
+            response = client.stream_unary(requests, timeout=1)
+            assert response.message == "A"
+
+        assert not spawn_task.called
+
+    def test_deadline_cancelled_when_call_completes(self, client, protobufs):
+        scheduler = client.client.scheduler
+        timers = []
+
+        def schedule(*args, **kwargs):
+            timer = original(*args, **kwargs)
+            timers.append(timer)
+            return timer
+
+        original = scheduler.schedule
+        with patch.object(scheduler, "schedule", new=schedule):
+            response = client.unary_unary(
+                protobufs.ExampleRequest(value="A"), timeout=30
+            )
+            assert response.message == "A"
+
+        assert len(timers) == 1
+        assert timers[0].cancelled
+        assert scheduler.timers == []
+
+    def test_dedicated_thread_when_pool_busy(self, client, protobufs):
+        client.client.max_workers = 1
+        release = threading.Event()
+
+        def generate_requests(value):
+            release.wait(5)
+            yield protobufs.ExampleRequest(value=value)
+
+        with patch.object(
+            client.client, "spawn_thread", wraps=client.client.spawn_thread
+        ) as spawn_thread:
+            futures = [
+                client.stream_unary.future(generate_requests(value)) for value in "AB"
+            ]
+            assert spawn_thread.call_count == 1
+            release.set()
+
+            assert [future.result().message for future in futures] == ["A", "B"]
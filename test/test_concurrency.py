@@ -1,11 +1,20 @@
 # -*- coding: utf-8 -*-
 import json
+import queue
 import random
 import string
+import time
 
 import pytest
+from eventlet import hubs
+from grpc import StatusCode
+from h2.settings import Settings
+from mock import patch
+from nameko.testing.utils import get_extension
 
 from nameko_grpc.constants import Cardinality
+from nameko_grpc.entrypoint import GrpcServer
+from nameko_grpc.errors import GrpcError
 
 
 @pytest.mark.equivalence
@@ -229,3 +238,183 @@ class TestMultipleClients:
 
             received = [(response.seqno, response.message) for response in responses]
             assert received == list(enumerate(streams[index], 1))
+
+
+class TestConcurrencyLimits:
+    @pytest.fixture
+    def start(self, start_nameko_server, start_nameko_client):
+        def make(extra_config):
+            start_nameko_server("example", extra_config=extra_config)
+            return start_nameko_client("example")
+
+        return make
+
+    def test_excess_requests_rejected(self, start, protobufs):
+        client = start({"GRPC_MAX_CONCURRENT_REQUESTS": 1})
+
+        slow = client.unary_unary.future(protobufs.ExampleRequest(value="A", delay=200))
+        time.sleep(0.05)
+
+        with pytest.raises(GrpcError) as error:
+            client.unary_unary(protobufs.ExampleRequest(value="B"))
+        assert error.value.code == StatusCode.RESOURCE_EXHAUSTED
+
+        assert slow.result().message == "A"
+
+        # capacity is released when the request completes
+        response = client.unary_unary(protobufs.ExampleRequest(value="C"))
+        assert response.message == "C"
+
+    def test_limit_is_per_entrypoint(self, start, protobufs):
+        client = start({"GRPC_MAX_CONCURRENT_REQUESTS": 1})
+
+        slow = client.unary_unary.future(protobufs.ExampleRequest(value="A", delay=200))
+        time.sleep(0.05)
+
+        responses = client.unary_stream(
+            protobufs.ExampleRequest(value="B", response_count=1)
+        )
+        assert [response.message for response in responses] == ["B"]
+
+        assert slow.result().message == "A"
+
+    def test_streaming_response_releases_capacity(self, start, protobufs):
+        client = start({"GRPC_MAX_CONCURRENT_REQUESTS": 1})
+
+        for _ in range(3):
+            responses = client.unary_stream(
+                protobufs.ExampleRequest(value="A", response_count=2)
+            )
+            assert [response.message for response in responses] == ["A", "A"]
+
+
+class TestMaxConcurrentStreams:
+    @pytest.fixture
+    def client(self, start_nameko_server, start_nameko_client):
+        start_nameko_server("example", extra_config={"GRPC_MAX_CONCURRENT_STREAMS": 1})
+        return start_nameko_client("example")
+
+    def test_setting_advertised(self, client, protobufs):
+        response = client.unary_unary(protobufs.ExampleRequest(value="A"))
+        assert response.message == "A"
+
+        connection = client.client.channel().conn_pool.get()
+        assert connection.conn.remote_settings.max_concurrent_streams == 1
+
+    def test_client_queues_requests(self, client, protobufs):
+        # wait for the server's settings to arrive
+        client.unary_unary(protobufs.ExampleRequest(value="A"))
+
+        start = time.time()
+        futures = [
+            client.unary_unary.future(protobufs.ExampleRequest(value=value, delay=100))
+            for value in "BCD"
+        ]
+        assert [future.result().message for future in futures] == ["B", "C", "D"]
+
+        # requests were executed one at a time
+        assert time.time() - start >= 0.3
+
+    def test_server_refuses_excess_streams(self, client, protobufs):
+        # keep a stream open, by which time the client has acknowledged the limit
+        requests = queue.Queue()
+        responses = client.stream_stream(iter(requests.get, None))
+        requests.put(protobufs.ExampleRequest(value="A"))
+        assert next(responses).message == "A"
+
+        # a client that ignores the limit only has its excess stream refused
+        class IgnoreLimit(Settings):
+            max_concurrent_streams = 2**32 + 1
+
+        connection = client.client.channel().conn_pool.get()
+        remote_settings = connection.conn.remote_settings
+        remote_settings.__class__ = IgnoreLimit
+        try:
+            with pytest.raises(GrpcError) as error:
+                client.unary_unary(protobufs.ExampleRequest(value="B"))
+        finally:
+            remote_settings.__class__ = Settings
+        assert error.value.code == StatusCode.UNAVAILABLE
+
+        requests.put(protobufs.ExampleRequest(value="C"))
+        assert next(responses).message == "C"
+        requests.put(None)
+        assert list(responses) == []
+
+
+class TestDispatch:
+    @pytest.fixture
+    def start(self, start_nameko_server, start_nameko_client):
+        def make(extra_config=None):
+            container = start_nameko_server("example", extra_config=extra_config)
+            return container, start_nameko_client("example")
+
+        return make
+
+    def test_no_managed_thread_per_request(self, start, protobufs):
+        container, client = start()
+        client.unary_unary(protobufs.ExampleRequest(value="A"))  # connect
+
+        with patch.object(
+            container, "spawn_managed_thread", wraps=container.spawn_managed_thread
+        ) as spawn_managed_thread:
+            response = client.unary_unary(
+                protobufs.ExampleRequest(value="B"), timeout=1
+            )
+            assert response.message == "B"
+
+            responses = client.stream_stream(
+                protobufs.ExampleRequest(value=value) for value in "CD"
+            )
+            assert [response.message for response in responses] == ["C", "D"]
+
+        assert not spawn_managed_thread.called
+
+    def test_worker_pool_full(self, start, protobufs):
+        _, client = start({"max_workers": 1})
+
+        futures = [
+            client.unary_unary.future(protobufs.ExampleRequest(value=value, delay=50))
+            for value in "ABC"
+        ]
+        assert [future.result().message for future in futures] == ["A", "B", "C"]
+
+    def test_hand_off_when_workers_busy(self, start, protobufs):
+        container, client = start({"max_workers": 1})
+        client.unary_unary(protobufs.ExampleRequest(value="A"))  # connect
+
+        with patch.object(
+            container, "spawn_managed_thread", wraps=container.spawn_managed_thread
+        ) as spawn_managed_thread:
+            futures = [
+                client.unary_unary.future(
+                    protobufs.ExampleRequest(value=value, delay=50)
+                )
+                for value in "BC"
+            ]
+            assert [future.result().message for future in futures] == ["B", "C"]
+
+        assert spawn_managed_thread.call_count == 1
+
+    def test_deadline_timer_cancelled(self, start, protobufs):
+        container, client = start()
+        server = get_extension(container, GrpcServer)
+        hub = hubs.get_hub()
+
+        timers = []
+
+        def schedule_call_global(seconds, callback, *args):
+            timer = schedule(seconds, callback, *args)
+            if args and args[0] == server.timeout:
+                timers.append(timer)
+            return timer
+
+        schedule = hub.schedule_call_global
+        with patch.object(hub, "schedule_call_global", new=schedule_call_global):
+            response = client.unary_unary(
+                protobufs.ExampleRequest(value="A"), timeout=30
+            )
+            assert response.message == "A"
+
+        assert len(timers) == 1
+        assert timers[0].called  # cancelled
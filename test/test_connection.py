@@ -1,10 +1,26 @@
 # -*- coding: utf-8 -*-
+import queue
+import time
+
+import eventlet
 import pytest
+from grpc import StatusCode
+from h2.errors import ErrorCodes
+from h2.events import PingReceived
+from h2.settings import SettingCodes
+from mock import Mock, call, patch
 from nameko.testing.utils import get_extension
 from nameko.testing.waiting import wait_for_call
 
 from nameko_grpc.client import Client
+from nameko_grpc.connection import (
+    ClientConnectionManager,
+    FrameCounter,
+    KeepaliveTimeoutError,
+    ServerConnectionManager,
+)
 from nameko_grpc.entrypoint import GrpcServer
+from nameko_grpc.errors import GrpcError
 
 
 class TestCloseSocketOnClientExit:
@@ -33,5 +49,558 @@ class TestCloseSocketOnClientExit:
         response = proxy.unary_unary(protobufs.ExampleRequest(value="A"))
         assert response.message == "A"
 
-        with wait_for_call(connection.sock, "close"):
+        with wait_for_call(connection.transport.sock, "close"):
             client.stop()
+
+
+class TestClientKeepalive:
+    @pytest.fixture
+    def connection(self):
+        connection = ClientConnectionManager(keepalive_time=10, keepalive_timeout=5)
+        connection.conn = Mock()
+        return connection
+
+    def test_no_ping_when_disabled(self, connection):
+        connection.keepalive_time = None
+        connection.last_received -= 100
+
+        connection.send_keepalive()
+        assert not connection.conn.ping.called
+
+    def test_no_ping_when_recently_active(self, connection):
+        connection.send_keepalive()
+        assert not connection.conn.ping.called
+
+    def test_ping_when_idle(self, connection):
+        connection.last_received -= 10
+
+        connection.send_keepalive()
+        assert connection.conn.ping.call_args == call(connection.ping_data)
+
+        # only one ping is outstanding at a time
+        connection.send_keepalive()
+        assert connection.conn.ping.call_count == 1
+
+    def test_ping_ack_clears_outstanding_ping(self, connection):
+        connection.last_received -= 10
+        connection.send_keepalive()
+
+        connection.ping_ack_received(Mock(ping_data=connection.ping_data))
+        assert connection.ping_data is None
+
+    def test_ping_timeout(self, connection):
+        connection.last_received -= 10
+        connection.send_keepalive()
+        connection.ping_sent_at -= 6
+
+        with pytest.raises(KeepaliveTimeoutError):
+            connection.send_keepalive()
+
+
+class TestClientKeepaliveEndToEnd:
+    @pytest.fixture(params=["server=nameko"])
+    def server_type(self, request):
+        return request.param[7:]
+
+    def test_keepalive_acknowledged(
+        self, server, load_stubs, spec_dir, grpc_port, protobufs
+    ):
+        stubs = load_stubs("example")
+
+        client = Client(
+            "//localhost:{}".format(grpc_port),
+            stubs.exampleStub,
+            keepalive_time=0.01,
+        )
+        proxy = client.start()
+
+        connection = client.channel().conn_pool.get()
+        with wait_for_call(connection, "ping_ack_received"):
+            pass
+
+        response = proxy.unary_unary(protobufs.ExampleRequest(value="A"))
+        assert response.message == "A"
+        assert connection.alive
+
+        client.stop()
+
+
+class TestServerConnectionAge:
+    @pytest.fixture
+    def connection(self):
+        connection = ServerConnectionManager(
+            Mock(),
+            max_connection_age=100,
+            max_connection_age_grace=5,
+            max_connection_idle=10,
+        )
+        connection.conn = Mock()
+        return connection
+
+    def test_max_connection_age_is_jittered(self, connection):
+        assert 90 <= connection.max_connection_age <= 110
+
+    def test_young_connection_not_terminated(self, connection):
+        connection.check_connection_age()
+        assert not connection.terminating
+
+    def test_max_connection_age(self, connection):
+        connection.receive_streams[1] = Mock()
+        connection.created_at -= 111
+
+        connection.check_connection_age()
+        assert connection.terminating
+        assert connection.conn.close_connection.called
+
+    def test_max_connection_idle(self, connection):
+        connection.last_active -= 11
+
+        connection.check_connection_age()
+        assert connection.terminating
+        assert connection.conn.close_connection.called
+
+    def test_open_streams_are_not_idle(self, connection):
+        connection.receive_streams[1] = Mock()
+        connection.last_active -= 11
+
+        connection.check_connection_age()
+        assert not connection.terminating
+
+    def test_grace_period(self, connection):
+        connection.receive_streams[1] = Mock()
+        connection.terminate()
+
+        connection.check_connection_age()
+        assert connection.run
+
+        connection.terminating_since -= 6
+        connection.check_connection_age()
+        assert not connection.run
+
+
+class TestServerMaxConnectionAgeEndToEnd:
+    @pytest.fixture
+    def server(self, start_nameko_server):
+        return start_nameko_server(
+            "example", extra_config={"GRPC_MAX_CONNECTION_AGE": 0.1}
+        )
+
+    def test_client_reconnects(self, server, load_stubs, grpc_port, protobufs):
+        stubs = load_stubs("example")
+
+        client = Client("//localhost:{}".format(grpc_port), stubs.exampleStub)
+        proxy = client.start()
+
+        first_connection = client.channel().conn_pool.get()
+        response = proxy.unary_unary(protobufs.ExampleRequest(value="A"))
+        assert response.message == "A"
+
+        assert first_connection.stopped.wait(5)
+
+        response = proxy.unary_unary(protobufs.ExampleRequest(value="B"))
+        assert response.message == "B"
+        assert client.channel().conn_pool.get() is not first_connection
+
+        client.stop()
+
+    def test_replacement_connected_while_draining(
+        self, start_nameko_server, load_stubs, grpc_port, protobufs
+    ):
+        # long enough that the replacement connection doesn't also age out
+        start_nameko_server("example", extra_config={"GRPC_MAX_CONNECTION_AGE": 1})
+        stubs = load_stubs("example")
+
+        client = Client("//localhost:{}".format(grpc_port), stubs.exampleStub)
+        proxy = client.start()
+        try:
+            first_connection = client.channel().conn_pool.get()
+
+            # keep a stream open on the first connection beyond its maximum age
+            requests = queue.Queue()
+            responses = proxy.stream_stream(iter(requests.get, None))
+            requests.put(protobufs.ExampleRequest(value="A"))
+            assert next(responses).message == "A"
+
+            with eventlet.Timeout(5):
+                while first_connection.alive:
+                    eventlet.sleep(0.01)
+            assert not first_connection.stopped.is_set()
+
+            # new calls use the replacement rather than waiting for the drain
+            start = time.monotonic()
+            response = proxy.unary_unary(protobufs.ExampleRequest(value="B"))
+            assert response.message == "B"
+            assert time.monotonic() - start < 1
+
+            # the draining stream is unaffected
+            requests.put(protobufs.ExampleRequest(value="C"))
+            assert next(responses).message == "C"
+            requests.put(None)
+            assert list(responses) == []
+            assert first_connection.stopped.wait(5)
+        finally:
+            client.stop()
+
+
+class TestMaxConcurrentStreams:
+    def test_server_advertises_setting(self):
+        connection = ServerConnectionManager(Mock(), max_concurrent_streams=5)
+        connection.initiate_connection()
+
+        connection.conn.local_settings.acknowledge()
+        local_settings = connection.conn.local_settings
+        assert local_settings[SettingCodes.MAX_CONCURRENT_STREAMS] == 5
+
+    def test_server_refuses_excess_streams(self):
+        handle_request = Mock()
+        connection = ServerConnectionManager(handle_request, max_concurrent_streams=1)
+        connection.conn = Mock(open_inbound_streams=2)
+
+        connection.request_received(Mock(stream_id=3, headers=[]))
+
+        assert connection.conn.reset_stream.call_args == call(
+            3, error_code=ErrorCodes.REFUSED_STREAM
+        )
+        assert not handle_request.called
+        assert connection.send_streams == {}
+
+    def test_client_respects_server_limit(self):
+        connection = ClientConnectionManager()
+        connection.conn = Mock(open_outbound_streams=1, max_outbound_frame_size=16384)
+        connection.conn.local_flow_control_window.return_value = 65535
+        connection.conn.remote_settings.max_concurrent_streams = 1
+
+        connection.send_request([(":path", "/method")])
+        connection.send_pending_requests()
+        assert not connection.conn.send_headers.called
+        assert list(connection.pending_requests) == [1]
+
+        connection.conn.open_outbound_streams = 0
+        connection.send_pending_requests()
+        assert connection.conn.send_headers.called
+        assert list(connection.pending_requests) == []
+
+    def test_client_refused_stream_unavailable(self):
+        connection = ClientConnectionManager()
+        connection.conn = Mock()
+        _, response_stream = connection.send_request([])
+
+        connection.stream_reset(Mock(stream_id=1, error_code=ErrorCodes.REFUSED_STREAM))
+        with pytest.raises(GrpcError) as error:
+            next(response_stream.consume(Mock()))
+        assert error.value.code == StatusCode.UNAVAILABLE
+
+    def test_client_pending_requests_fail_on_goaway(self):
+        connection = ClientConnectionManager()
+        connection.conn = Mock()
+        _, response_stream = connection.send_request([])
+
+        connection.connection_terminated(Mock(error_code=ErrorCodes.NO_ERROR))
+        assert list(connection.pending_requests) == []
+        with pytest.raises(GrpcError) as error:
+            next(response_stream.consume(Mock()))
+        assert error.value.code == StatusCode.UNAVAILABLE
+
+
+class TestClientSendRequest:
+    @pytest.fixture
+    def connection(self):
+        connection = ClientConnectionManager()
+        connection.conn = Mock()
+        connection.transport = Mock()
+        return connection
+
+    def test_request_is_serialized_immediately(self, connection):
+        message = Mock()
+        message.SerializeToString.return_value = b"\x01\x02"
+
+        request_stream, _ = connection.send_request(
+            [("grpc-encoding", "identity")], [message]
+        )
+
+        assert request_stream.closed
+        assert request_stream.queue.empty()
+        assert request_stream.buffer.read() == b"\x00\x00\x00\x00\x02\x01\x02"
+        assert list(connection.pending_requests) == [request_stream.stream_id]
+
+    def test_stream_ids_allocated_in_order(self, connection):
+        streams = [connection.send_request([])[0] for _ in range(3)]
+        assert [stream.stream_id for stream in streams] == [1, 3, 5]
+
+    def test_event_loop_is_woken(self, connection):
+        connection.send_request([])
+        assert connection.transport.wakeup.called
+
+    def test_connection_closed_while_preparing_request(self, connection):
+        connection.streams_closed = True
+
+        _, response_stream = connection.send_request([])
+        assert response_stream.closed
+        assert list(connection.pending_requests) == []
+
+
+class TestInMemory:
+    """The connection managers perform no I/O, so a client and server can be
+    driven against each other by passing bytes between them directly.
+    """
+
+    def test_unary_unary(self, protobufs):
+        def handle_request(request_stream, response_stream):
+            def respond():
+                request = next(request_stream.consume(protobufs.ExampleRequest))
+                response_stream.populate(
+                    [protobufs.ExampleReply(message=request.value)]
+                )
+
+            request_stream.when_ready(respond)
+
+        client = ClientConnectionManager()
+        server = ServerConnectionManager(handle_request)
+        client.connection_made(Mock())
+        server.connection_made(Mock())
+
+        _, response_stream = client.send_request(
+            [
+                (":method", "POST"),
+                (":scheme", "http"),
+                (":authority", "localhost"),
+                (":path", "/example/unary_unary"),
+                ("te", "trailers"),
+                ("content-type", "application/grpc+proto"),
+                ("grpc-encoding", "identity"),
+            ],
+            [protobufs.ExampleRequest(value="A")],
+        )
+
+        while not response_stream.closed:
+            for local, remote in ((client, server), (server, client)):
+                local.on_iteration()
+                data = local.data_to_send()
+                if data:
+                    remote.receive_data(data)
+
+        response = next(response_stream.consume(protobufs.ExampleReply))
+        assert response.message == "A"
+
+    def test_abandoned_request_is_reset(self, protobufs):
+        server_streams = []
+
+        def handle_request(request_stream, response_stream):
+            server_streams.extend([request_stream, response_stream])
+
+        client = ClientConnectionManager()
+        server = ServerConnectionManager(handle_request)
+        client.connection_made(Mock())
+        server.connection_made(Mock())
+
+        def exchange():
+            for local, remote in ((client, server), (server, client)):
+                local.on_iteration()
+                data = local.data_to_send()
+                if data:
+                    remote.receive_data(data)
+
+        _, response_stream = client.send_request(
+            [
+                (":method", "POST"),
+                (":scheme", "http"),
+                (":authority", "localhost"),
+                (":path", "/example/stream_stream"),
+                ("te", "trailers"),
+                ("content-type", "application/grpc+proto"),
+                ("grpc-encoding", "identity"),
+            ],
+        )
+        exchange()
+        request_stream, server_response_stream = server_streams
+
+        # e.g. the deadline expires
+        response_stream.close(GrpcError(code=StatusCode.DEADLINE_EXCEEDED, message=""))
+        exchange()
+
+        assert client.receive_streams == {}
+        assert client.send_streams == {}
+        assert server.receive_streams == {}
+        assert server.send_streams == {}
+
+        assert server_response_stream.closed
+        with pytest.raises(GrpcError) as error:
+            next(request_stream.consume(protobufs.ExampleRequest))
+        assert error.value.code == StatusCode.CANCELLED
+
+    def test_abandoned_pending_request_is_discarded(self):
+        client = ClientConnectionManager()
+        client.connection_made(Mock())
+        client.data_to_send()
+
+        _, response_stream = client.send_request([(":method", "POST")])
+        response_stream.close()
+
+        client.cancel_abandoned_requests()
+        assert not client.pending_requests
+        assert client.receive_streams == {}
+        assert client.data_to_send() == b""
+
+
+class TestFrameCounter:
+    # a SETTINGS frame with an empty payload, and a DATA frame with a 3-byte payload
+    FRAMES = (
+        b"\x00\x00\x00\x04\x00\x00\x00\x00\x00"
+        + b"\x00\x00\x03\x00\x01\x00\x00\x00\x01abc"
+    )
+
+    def test_count_frames(self):
+        counter = FrameCounter()
+        counter.feed(self.FRAMES)
+        assert counter.counts == {"SETTINGS": 1, "DATA": 1}
+        assert counter.total == 2
+
+    def test_frames_split_across_chunks(self):
+        counter = FrameCounter()
+        for index in range(len(self.FRAMES)):
+            counter.feed(self.FRAMES[index:][:1])
+        assert counter.counts == {"SETTINGS": 1, "DATA": 1}
+
+    def test_skip_preface(self):
+        counter = FrameCounter(skip=24)
+        counter.feed(b"PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n" + self.FRAMES)
+        assert counter.counts == {"SETTINGS": 1, "DATA": 1}
+
+
+class TestConnectionStats:
+    @pytest.fixture
+    def exchange(self, protobufs):
+        """Drive a client and server connection against each other in memory, as
+        in `TestInMemory`, until `response_stream` closes.
+        """
+
+        def handle_request(request_stream, response_stream):
+            def respond():
+                request = next(request_stream.consume(protobufs.ExampleRequest))
+                response_stream.populate(
+                    [protobufs.ExampleReply(message=request.value)]
+                )
+
+            request_stream.when_ready(respond)
+
+        client = ClientConnectionManager()
+        server = ServerConnectionManager(handle_request)
+        client.connection_made(Mock())
+        server.connection_made(Mock())
+
+        def exchange(request):
+            _, response_stream = client.send_request(
+                [
+                    (":method", "POST"),
+                    (":scheme", "http"),
+                    (":authority", "localhost"),
+                    (":path", "/example/unary_unary"),
+                    ("te", "trailers"),
+                    ("content-type", "application/grpc+proto"),
+                    ("grpc-encoding", "identity"),
+                ],
+                [request],
+            )
+            while not response_stream.closed:
+                for local, remote in ((client, server), (server, client)):
+                    local.on_iteration()
+                    data = local.data_to_send()
+                    if data:
+                        remote.receive_data(data)
+            return client, server
+
+        return exchange
+
+    def test_bytes_and_frames(self, exchange, protobufs):
+        client, server = exchange(protobufs.ExampleRequest(value="A"))
+        client_stats, server_stats = client.stats(), server.stats()
+
+        assert client_stats["bytes_sent"] == server_stats["bytes_received"] > 0
+        assert client_stats["bytes_received"] == server_stats["bytes_sent"] > 0
+        assert client_stats["frames_sent"] == server_stats["frames_received"]
+        assert client_stats["frames_received"] == server_stats["frames_sent"]
+
+        # request headers and response headers and trailers
+        assert client_stats["frames_sent"]["HEADERS"] == 1
+        assert server_stats["frames_sent"]["HEADERS"] == 2
+
+        assert client_stats["max_send_streams"] == 1
+        assert client_stats["open_send_streams"] == 0
+        assert client_stats["open_receive_streams"] == 0
+        assert client_stats["flow_control_stalls"] == 0
+
+    def test_flow_control_blocked(self, exchange, protobufs):
+        # larger than the default 64KB flow control window
+        request = protobufs.ExampleRequest(value="A" * 100000)
+        client, server = exchange(request)
+        client_stats, server_stats = client.stats(), server.stats()
+
+        assert client_stats["flow_control_stalls"] == 1
+        assert client_stats["flow_control_blocked_streams"] == 0
+        assert client_stats["flow_control_blocked_time"] > 0
+        assert client_stats["window_updates_received"] > 0
+        assert (
+            client_stats["window_updates_received"]
+            == server_stats["window_updates_sent"]
+        )
+
+
+class TestConnectionStatsEndToEnd:
+    def test_channel_stats(self, start_nameko_server, load_stubs, grpc_port, protobufs):
+        container = start_nameko_server("example")
+        stubs = load_stubs("example")
+
+        client = Client("//localhost:{}".format(grpc_port), stubs.exampleStub)
+        proxy = client.start()
+        try:
+            response = proxy.unary_unary(protobufs.ExampleRequest(value="A"))
+            assert response.message == "A"
+
+            (client_stats,) = client.channel().stats()
+            (server_stats,) = get_extension(container, GrpcServer).channel.stats()
+        finally:
+            client.stop()
+
+        assert client_stats["frames_sent"]["HEADERS"] == 1
+        assert server_stats["frames_received"]["HEADERS"] == 1
+        assert client_stats["bytes_sent"] > 0
+        assert server_stats["bytes_received"] > 0
+        assert client_stats["iterations"] > 0
+        assert server_stats["iterations"] > 0
+
+
+class TestEventHandlers:
+    @pytest.fixture
+    def client(self):
+        client = ClientConnectionManager()
+        client.connection_made(Mock())
+        return client
+
+    def test_subclass_handles_additional_event(self, client):
+        class PingHandlingServer(ServerConnectionManager):
+            event_handlers = {
+                **ServerConnectionManager.event_handlers,
+                PingReceived: "ping_received",
+            }
+            ping_received = Mock()
+
+        server = PingHandlingServer(Mock())
+        server.connection_made(Mock())
+
+        client.conn.ping(b"12345678")
+        server.receive_data(client.data_to_send())
+
+        (event,), _ = server.ping_received.call_args
+        assert event.ping_data == b"12345678"
+
+    def test_unhandled_events_are_ignored(self, client):
+        server = ServerConnectionManager(Mock())
+        server.connection_made(Mock())
+
+        client.conn.ping(b"12345678")
+        server.receive_data(client.data_to_send())
+
+        # the ping is still acknowledged by h2
+        with patch.object(client, "ping_ack_received") as ping_ack_received:
+            client.receive_data(server.data_to_send())
+        assert ping_ack_received.called
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+import time
+
+import eventlet
+import pytest
+from eventlet import hubs
+from grpc import StatusCode
+from mock import Mock, patch
+from nameko import config
+from nameko.testing.utils import get_extension
+
+from nameko_grpc.client import Client
+from nameko_grpc.context import GrpcContext
+from nameko_grpc.dependency_provider import GrpcProxy
+from nameko_grpc.entrypoint import Grpc, GrpcServer
+from nameko_grpc.errors import GrpcError
+from nameko_grpc.streams import ReceiveStream, SendStream
+
+
+class TestTimeRemaining:
+    def test_no_deadline(self):
+        context = GrpcContext(ReceiveStream(1), Mock())
+        assert context.time_remaining() is None
+
+    def test_deadline(self):
+        request_stream = ReceiveStream(1)
+        request_stream.deadline = time.monotonic() + 10
+        context = GrpcContext(request_stream, Mock())
+        assert 9 < context.time_remaining() <= 10
+
+    def test_deadline_passed(self):
+        request_stream = ReceiveStream(1)
+        request_stream.deadline = time.monotonic() - 1
+        context = GrpcContext(request_stream, Mock())
+        assert context.time_remaining() == 0
+
+
+class TestDeadlinePropagation:
+    @pytest.fixture
+    def service(self, container_factory, grpc_port, stubs, protobufs):
+        grpc = Grpc.implementing(stubs.exampleStub)
+
+        class Service:
+            """Calls itself, so that the downstream call can report the time
+            remaining that it was given.
+            """
+
+            name = "deadlines"
+
+            example_grpc = GrpcProxy(
+                f"//localhost:{grpc_port}",
+                stubs.exampleStub,
+                lazy_startup=True,
+                deadline_margin=1,
+            )
+
+            @grpc
+            def unary_unary(self, request, context):
+                return protobufs.ExampleReply(message=str(context.time_remaining()))
+
+            @grpc
+            def stream_unary(self, request, context):
+                for _ in request:
+                    pass
+                return self.example_grpc.unary_unary(protobufs.ExampleRequest())
+
+        with config.patch({"GRPC_BIND_PORT": grpc_port}):
+            container = container_factory(Service)
+            container.start()
+            yield container
+
+    @pytest.fixture
+    def client(self, service, grpc_port, stubs):
+        client = Client(f"//localhost:{grpc_port}", stubs.exampleStub)
+        yield client.start()
+        client.stop()
+
+    def test_remaining_budget_propagated(self, client, protobufs):
+        timeout = 5
+        response = client.stream_unary([protobufs.ExampleRequest()], timeout=timeout)
+
+        # the downstream call gets what's left of the timeout, less the margin
+        deadline_margin = 1
+        assert 0 < float(response.message) <= timeout - deadline_margin
+
+    def test_downstream_deadline_cancelled(self, service, client, protobufs):
+        proxy = get_extension(service, GrpcProxy)
+        hub = hubs.get_hub()
+        timers = []
+
+        def schedule_call_global(seconds, callback, *args):
+            timer = schedule(seconds, callback, *args)
+            if args and args[0] == proxy.timeout:
+                timers.append(timer)
+            return timer
+
+        schedule = hub.schedule_call_global
+        with patch.object(hub, "schedule_call_global", new=schedule_call_global):
+            client.stream_unary([protobufs.ExampleRequest()], timeout=30)
+
+        assert len(timers) == 1
+        assert timers[0].called  # cancelled
+
+    def test_no_deadline(self, client, protobufs):
+        response = client.stream_unary([protobufs.ExampleRequest()])
+        assert response.message == "None"
+
+    def test_budget_exhausted(self, client, protobufs):
+        with pytest.raises(GrpcError) as error:
+            client.stream_unary([protobufs.ExampleRequest()], timeout=0.5)
+        assert error.value.code == StatusCode.DEADLINE_EXCEEDED
+
+
+class TestAdmission:
+    @pytest.fixture
+    def calls(self):
+        return []
+
+    @pytest.fixture
+    def containers(self):
+        return []
+
+    @pytest.fixture
+    def start_service(
+        self, container_factory, grpc_port, stubs, protobufs, calls, containers
+    ):
+        clients = []
+
+        def start(**config_overrides):
+            grpc = Grpc.implementing(stubs.exampleStub)
+
+            class Service:
+                name = "admission"
+
+                @grpc
+                def unary_unary(self, request, context):
+                    calls.append(request.value)
+                    eventlet.sleep(request.delay / 1000)
+                    return protobufs.ExampleReply(message=request.value)
+
+            conf = {"GRPC_BIND_PORT": grpc_port, "max_workers": 1}
+            conf.update(config_overrides)
+            with config.patch(conf):
+                container = container_factory(Service)
+                container.start()
+            containers.append(container)
+
+            client = Client(f"//localhost:{grpc_port}", stubs.exampleStub)
+            clients.append(client)
+            return client.start()
+
+        yield start
+
+        for client in clients:
+            client.stop()
+
+    def test_expired_while_waiting_for_worker(self, start_service, protobufs, calls):
+        client = start_service()
+
+        busy = client.unary_unary.future(protobufs.ExampleRequest(value="A", delay=500))
+        eventlet.sleep(0.1)  # let the first request occupy the only worker
+
+        with pytest.raises(GrpcError) as error:
+            client.unary_unary(protobufs.ExampleRequest(value="B"), timeout=0.1)
+        assert error.value.code == StatusCode.DEADLINE_EXCEEDED
+
+        assert busy.result().message == "A"
+        eventlet.sleep(0.1)
+        assert calls == ["A"]
+
+    def test_min_time_remaining(self, start_service, protobufs, calls):
+        client = start_service(GRPC_MIN_TIME_REMAINING=1)
+
+        with pytest.raises(GrpcError) as error:
+            client.unary_unary(protobufs.ExampleRequest(value="A"), timeout=0.5)
+        assert error.value.code == StatusCode.DEADLINE_EXCEEDED
+
+        response = client.unary_unary(protobufs.ExampleRequest(value="B"), timeout=5)
+        assert response.message == "B"
+
+        response = client.unary_unary(protobufs.ExampleRequest(value="C"))
+        assert response.message == "C"
+
+        assert calls == ["B", "C"]
+
+    def test_expired_before_request_message(self, start_service, containers, calls):
+        start_service(GRPC_METRICS=True)
+        server = get_extension(containers[0], GrpcServer)
+
+        method = "/nameko.example/unary_unary"
+        request_stream = ReceiveStream(1)
+        request_stream.headers.set((":path", method))
+        request_stream.deadline = time.monotonic() + 0.05
+        response_stream = SendStream(1)
+
+        # the request message never arrives
+        server.handle_request(request_stream, response_stream)
+
+        with eventlet.Timeout(5):
+            while not response_stream.closed:
+                eventlet.sleep(0.01)
+        assert response_stream.error.code == StatusCode.DEADLINE_EXCEEDED
+        assert server.metrics.snapshot()[method].handled == {"DEADLINE_EXCEEDED": 1}
+
+        entrypoint = get_extension(containers[0], Grpc)
+        assert entrypoint.in_flight == 0
+        assert calls == []
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+import json
+
+import eventlet
+import pytest
+from grpc import StatusCode
+
+from nameko_grpc.client import Client, Future
+from nameko_grpc.constants import Cardinality
+from nameko_grpc.errors import GrpcError
+from nameko_grpc.interceptors import (
+    Interceptor,
+    InterceptorChain,
+    compose_interceptors,
+)
+
+
+class Recorder(Interceptor):
+    """Records the hooks it is called with, and the messages of streaming calls."""
+
+    def __init__(self, name, events):
+        self.name = name
+        self.events = events
+
+    def record(self, *event):
+        self.events.append((self.name,) + event)
+
+    def messages(self, direction, messages):
+        for message in messages:
+            self.record(direction, "message")
+            yield message
+
+    def intercept_request(self, call, request):
+        self.record("request", call.method)
+        if call.cardinality in (Cardinality.STREAM_UNARY, Cardinality.STREAM_STREAM):
+            return self.messages("request", request)
+        return request
+
+    def intercept_response(self, call, response):
+        self.record("response", call.method)
+        if call.cardinality in (Cardinality.UNARY_STREAM, Cardinality.STREAM_STREAM):
+            return self.messages("response", response)
+        return response
+
+    def intercept_error(self, call, error):
+        self.record("error", error.code)
+        return error
+
+
+class AddMetadata(Interceptor):
+    def intercept_request(self, call, request):
+        call.metadata.append(("authorization", "token"))
+        return request
+
+
+class Reject(Interceptor):
+    def intercept_request(self, call, request):
+        raise GrpcError(code=StatusCode.UNAUTHENTICATED, message="No token")
+
+
+class SlowRequest(Interceptor):
+    def intercept_request(self, call, request):
+        if ("slow", "true") in call.metadata:
+            eventlet.sleep(0.5)
+        return request
+
+
+class BrokenErrorHook(Interceptor):
+    def intercept_error(self, call, error):
+        raise GrpcError(code=StatusCode.DATA_LOSS, message="Broken hook")
+
+
+class TestInterceptorChain:
+    def test_only_overridden_hooks_composed(self):
+        add_metadata = AddMetadata()
+        chain = InterceptorChain([Interceptor(), add_metadata])
+        assert chain.request_hooks == (add_metadata.intercept_request,)
+        assert chain.response_hooks == ()
+        assert chain.error_hooks == ()
+
+    def test_no_interceptors(self):
+        assert compose_interceptors(None) is None
+        assert compose_interceptors([]) is None
+        assert compose_interceptors([Interceptor()]) is None
+
+    def test_order(self):
+        events = []
+        chain = compose_interceptors([Recorder("a", events), Recorder("b", events)])
+
+        class call:
+            method = "method"
+            cardinality = Cardinality.UNARY_UNARY
+
+        chain.intercept_request(call, None)
+        chain.intercept_response(call, None)
+        assert events == [
+            ("a", "request", "method"),
+            ("b", "request", "method"),
+            ("b", "response", "method"),
+            ("a", "response", "method"),
+        ]
+
+    def test_load_from_path(self):
+        chain = compose_interceptors(["test_interceptors.AddMetadata"])
+        assert len(chain.request_hooks) == 1
+
+
+class TestClientInterceptors:
+    @pytest.fixture(autouse=True)
+    def server(self, start_nameko_server):
+        start_nameko_server("example")
+
+    @pytest.fixture
+    def events(self):
+        return []
+
+    @pytest.fixture
+    def start_client(self, grpc_port, stubs):
+        clients = []
+
+        def start(interceptors):
+            client = Client(
+                f"//localhost:{grpc_port}", stubs.exampleStub, interceptors=interceptors
+            )
+            clients.append(client)
+            return client.start()
+
+        yield start
+
+        for client in clients:
+            client.stop()
+
+    def test_unary(self, start_client, protobufs, events):
+        client = start_client([Recorder("client", events), AddMetadata()])
+
+        response = client.unary_unary(protobufs.ExampleRequest(value="A"))
+        assert response.message == "A"
+        assert json.loads(response.metadata)["authorization"] == "token"
+        assert events == [
+            ("client", "request", "/nameko.example/unary_unary"),
+            ("client", "response", "/nameko.example/unary_unary"),
+        ]
+
+    def test_streaming(self, start_client, protobufs, events):
+        client = start_client([Recorder("client", events)])
+
+        requests = [protobufs.ExampleRequest(value="A")] * 2
+        responses = list(client.stream_stream(requests))
+        assert [response.message for response in responses] == ["A", "A"]
+        assert events.count(("client", "request", "message")) == 2
+        assert events.count(("client", "response", "message")) == 2
+
+    def test_error(self, start_client, protobufs, events):
+        client = start_client([Recorder("client", events)])
+
+        with pytest.raises(GrpcError) as error:
+            client.unary_grpc_error(protobufs.ExampleRequest(value="A"))
+        assert error.value.code == StatusCode.UNAUTHENTICATED
+        assert events[-1] == ("client", "error", StatusCode.UNAUTHENTICATED)
+
+    def test_not_intercepted(self, start_client, protobufs):
+        client = start_client([Interceptor()])
+        future = client.unary_unary.future(protobufs.ExampleRequest(value="A"))
+        assert type(future) is Future
+
+
+class TestServerInterceptors:
+    @pytest.fixture
+    def events(self):
+        return []
+
+    @pytest.fixture
+    def start_server(self, start_nameko_server, grpc_port, stubs):
+        clients = []
+
+        def start(interceptors):
+            start_nameko_server(
+                "example", extra_config={"GRPC_SERVER_INTERCEPTORS": interceptors}
+            )
+            client = Client(f"//localhost:{grpc_port}", stubs.exampleStub)
+            clients.append(client)
+            return client.start()
+
+        yield start
+
+        for client in clients:
+            client.stop()
+
+    def test_unary(self, start_server, protobufs, events):
+        client = start_server([Recorder("server", events)])
+
+        response = client.unary_unary(protobufs.ExampleRequest(value="A"))
+        assert response.message == "A"
+        assert events == [
+            ("server", "request", "/nameko.example/unary_unary"),
+            ("server", "response", "/nameko.example/unary_unary"),
+        ]
+
+    def test_streaming(self, start_server, protobufs, events):
+        client = start_server([Recorder("server", events)])
+
+        requests = [protobufs.ExampleRequest(value="A")] * 2
+        responses = list(client.stream_stream(requests))
+        assert [response.message for response in responses] == ["A", "A"]
+        assert events.count(("server", "request", "message")) == 2
+        assert events.count(("server", "response", "message")) == 2
+
+    def test_error(self, start_server, protobufs, events):
+        client = start_server([Recorder("server", events)])
+
+        with pytest.raises(GrpcError):
+            client.unary_grpc_error(protobufs.ExampleRequest(value="A"))
+        assert events[-1] == ("server", "error", StatusCode.UNAUTHENTICATED)
+
+    def test_reject_request(self, start_server, protobufs, events):
+        client = start_server([Recorder("server", events), Reject()])
+
+        with pytest.raises(GrpcError) as error:
+            client.unary_unary(protobufs.ExampleRequest(value="A"))
+        assert error.value.code == StatusCode.UNAUTHENTICATED
+        assert events == [
+            ("server", "request", "/nameko.example/unary_unary"),
+            ("server", "error", StatusCode.UNAUTHENTICATED),
+        ]
+
+    def test_failing_error_hook_after_request_rejected(self, start_server, protobufs):
+        client = start_server([BrokenErrorHook(), Reject()])
+
+        with pytest.raises(GrpcError) as error:
+            client.unary_unary(protobufs.ExampleRequest(value="A"), timeout=5)
+        assert error.value.code == StatusCode.DATA_LOSS
+
+    def test_failing_error_hook_after_method_failed(self, start_server, protobufs):
+        client = start_server([BrokenErrorHook()])
+
+        with pytest.raises(GrpcError) as error:
+            client.unary_grpc_error(protobufs.ExampleRequest(value="A"), timeout=5)
+        assert error.value.code == StatusCode.DATA_LOSS
+
+        response = client.unary_unary(protobufs.ExampleRequest(value="B"), timeout=5)
+        assert response.message == "B"
+
+    def test_blocking_request_hook(self, start_server, protobufs, events):
+        client = start_server([Recorder("server", events), SlowRequest()])
+
+        slow = client.unary_unary.future(
+            protobufs.ExampleRequest(value="A"), metadata=[("slow", "true")]
+        )
+        eventlet.sleep(0.1)  # let the slow hook start
+
+        # the hook runs in the slow call's worker, not on the connection
+        with eventlet.Timeout(0.3):
+            response = client.unary_unary(protobufs.ExampleRequest(value="B"))
+        assert response.message == "B"
+
+        assert slow.result().message == "A"
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import eventlet
+import pytest
+from eventlet.patcher import original
+from mock import patch
+from nameko.testing.utils import get_extension
+
+from nameko_grpc.client import Client
+from nameko_grpc.entrypoint import GrpcServer
+from nameko_grpc.lag import LagMonitor
+
+
+blocking_sleep = original("time").sleep
+
+
+def block_hub(seconds):
+    """Run without yielding to the hub, like a CPU-heavy method."""
+    blocking_sleep(seconds)
+
+
+class TestLagMonitor:
+    @pytest.fixture
+    def start_monitor(self):
+        monitors = []
+
+        def start(**kwargs):
+            monitor = LagMonitor(interval=0.01, **kwargs)
+            monitors.append(monitor)
+            monitor.start()
+            return monitor
+
+        yield start
+
+        for monitor in monitors:
+            monitor.stop()
+
+    def test_no_lag(self, start_monitor):
+        monitor = start_monitor()
+        eventlet.sleep(0.1)
+
+        snapshot = monitor.snapshot()
+        assert snapshot["count"] > 0
+        assert snapshot["p50"] < 0.01
+
+    def test_blocked_hub(self, start_monitor):
+        monitor = start_monitor()
+        eventlet.sleep(0.02)
+        block_hub(0.2)
+        eventlet.sleep(0.02)
+
+        snapshot = monitor.snapshot()
+        assert snapshot["max"] >= 0.15
+        assert snapshot["p50"] < snapshot["max"]
+        assert monitor.longest_block is None
+
+    def test_log_blocking_stack(self, start_monitor):
+        with patch("nameko_grpc.lag.log") as log:
+            monitor = start_monitor(log_threshold=0.05)
+            eventlet.sleep(0.02)
+            block_hub(0.2)
+            eventlet.sleep(0.02)
+
+        lag, stack = monitor.longest_block
+        assert lag >= 0.15
+        assert "block_hub" in stack
+        assert log.warning.call_count == 1
+
+    def test_only_longest_block_logged(self, start_monitor):
+        with patch("nameko_grpc.lag.log") as log:
+            monitor = start_monitor(log_threshold=0.05)
+            eventlet.sleep(0.02)
+            block_hub(0.3)
+            eventlet.sleep(0.02)
+            block_hub(0.15)
+            eventlet.sleep(0.02)
+
+        assert monitor.longest_block[0] >= 0.25
+        assert log.warning.call_count == 1
+
+
+class TestServerLagMonitor:
+    def test_enabled(self, start_nameko_server):
+        container = start_nameko_server(
+            "example",
+            extra_config={"GRPC_LAG_MONITOR": True, "GRPC_LAG_MONITOR_INTERVAL": 0.01},
+        )
+        monitor = get_extension(container, GrpcServer).lag_monitor
+        eventlet.sleep(0.05)
+        assert monitor.snapshot()["count"] > 0
+
+    def test_disabled(self, start_nameko_server):
+        container = start_nameko_server("example")
+        assert get_extension(container, GrpcServer).lag_monitor is None
+
+    def test_connection_loop_lag(
+        self, start_nameko_server, grpc_port, stubs, protobufs
+    ):
+        container = start_nameko_server("example")
+        client = Client(f"//localhost:{grpc_port}", stubs.exampleStub)
+        proxy = client.start()
+        try:
+            proxy.unary_unary(protobufs.ExampleRequest(value="A"))
+            block_hub(0.2)
+            eventlet.sleep(0.05)
+
+            (stats,) = get_extension(container, GrpcServer).channel.stats()
+        finally:
+            client.stop()
+
+        assert stats["max_loop_lag"] >= 0.15
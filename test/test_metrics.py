@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+import socket
+
+import eventlet
+import pytest
+from grpc import StatusCode
+from nameko import config
+from nameko.testing.services import dummy, entrypoint_hook
+from nameko.testing.utils import get_extension
+
+from nameko_grpc.client import Client
+from nameko_grpc.dependency_provider import GrpcMetrics
+from nameko_grpc.entrypoint import Grpc, GrpcServer
+from nameko_grpc.errors import GrpcError
+from nameko_grpc.metrics import (
+    Histogram,
+    Metrics,
+    bucket_index,
+    bucket_upper_bound,
+)
+
+
+class TestHistogram:
+    def test_buckets(self):
+        previous_bound = 0
+        for index in range(1000):
+            bound = bucket_upper_bound(index)
+            assert bound > previous_bound
+            assert bucket_index(previous_bound) == index
+            assert bucket_index(bound - 1) == index
+            previous_bound = bound
+
+    def test_relative_error(self):
+        for value in (1, 17, 1000, 123456, 98765432):
+            bound = bucket_upper_bound(bucket_index(value))
+            assert value < bound <= value * 1.0625 + 1
+
+    def test_percentile(self):
+        histogram = Histogram()
+        assert histogram.percentile(50) is None
+
+        for millis in range(1, 101):
+            histogram.record(millis / 1000)
+
+        assert histogram.count == 100
+        assert histogram.sum == pytest.approx(5.05)
+        assert 0.050 <= histogram.percentile(50) <= 0.050 * 1.0625
+        assert 0.099 <= histogram.percentile(99) <= 0.099 * 1.0625
+
+    def test_cumulative_counts(self):
+        histogram = Histogram()
+        for seconds in (0.001, 0.002, 0.2, 3):
+            histogram.record(seconds)
+
+        assert histogram.cumulative_counts([0.0005, 0.01, 1, 10]) == [0, 2, 3, 4]
+
+
+class TestMetrics:
+    def test_threads_merged(self):
+        # each OS thread records into its own shard
+        threading = eventlet.patcher.original("threading")
+        metrics = Metrics("client")
+        barrier = threading.Barrier(4)
+
+        def record():
+            for _ in range(1000):
+                metrics.method("/example/method").started += 1
+            barrier.wait()  # keep the threads alive so their idents are distinct
+
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(metrics.shards) == 4
+        assert metrics.snapshot()["/example/method"].started == 4000
+
+    def test_render_prometheus(self):
+        metrics = Metrics("server")
+        method = metrics.method("/example/method")
+        method.started = 2
+        method.handled = {"OK": 1}
+        method.messages_sent = 3
+        method.observe("handling", 0.002)
+
+        lines = metrics.render_prometheus().splitlines()
+        labels = 'grpc_service="example",grpc_method="method"'
+
+        assert "# TYPE grpc_server_started_total counter" in lines
+        assert "grpc_server_started_total{%s} 2" % labels in lines
+        assert "grpc_server_msg_sent_total{%s} 3" % labels in lines
+        assert 'grpc_server_handled_total{%s,grpc_code="OK"} 1' % labels in lines
+        assert "grpc_server_in_flight{%s} 1" % labels in lines
+        assert "# TYPE grpc_server_handling_seconds histogram" in lines
+        assert 'grpc_server_handling_seconds_bucket{%s,le="0.001"} 0' % labels in lines
+        assert 'grpc_server_handling_seconds_bucket{%s,le="0.005"} 1' % labels in lines
+        assert 'grpc_server_handling_seconds_bucket{%s,le="+Inf"} 1' % labels in lines
+        assert "grpc_server_handling_seconds_count{%s} 1" % labels in lines
+
+
+def finished(metrics, method):
+    """Return the `MethodMetrics` of `method` once it has no calls in flight.
+
+    A client records a call as finished on the thread that closes its response
+    stream, which may be just after the response is returned to the caller.
+    """
+    with eventlet.Timeout(5):
+        while True:
+            snapshot = metrics.snapshot().get(method)
+            if snapshot is not None and snapshot.in_flight == 0:
+                return snapshot
+            eventlet.sleep(0.01)
+
+
+class TestCallMetrics:
+    @pytest.fixture
+    def server_metrics(self, start_nameko_server):
+        container = start_nameko_server("example", extra_config={"GRPC_METRICS": True})
+        return get_extension(container, GrpcServer).metrics
+
+    @pytest.fixture
+    def client(self, server_metrics, grpc_port, stubs):
+        client = Client(f"//localhost:{grpc_port}", stubs.exampleStub, metrics=True)
+        yield client
+        client.stop()
+
+    def test_unary(self, client, server_metrics, protobufs):
+        proxy = client.start()
+        response = proxy.unary_unary(protobufs.ExampleRequest(value="A"))
+        assert response.message == "A"
+
+        method = "/nameko.example/unary_unary"
+        client_method = finished(client.metrics, method)
+        server_method = finished(server_metrics, method)
+
+        for metrics in (client_method, server_method):
+            assert metrics.started == 1
+            assert metrics.handled == {"OK": 1}
+            assert metrics.in_flight == 0
+            assert metrics.messages_sent == metrics.messages_received == 1
+
+        assert client_method.bytes_sent == server_method.bytes_received > 0
+        assert client_method.bytes_received == server_method.bytes_sent > 0
+
+        assert set(client_method.latency) == {"handling"}
+        assert set(server_method.latency) == {"queued", "handler", "handling"}
+
+    def test_streaming(self, client, server_metrics, protobufs):
+        proxy = client.start()
+        requests = [protobufs.ExampleRequest(value="A")] * 3
+        responses = list(proxy.stream_stream(requests))
+        assert len(responses) == 3
+
+        method = "/nameko.example/stream_stream"
+        client_method = finished(client.metrics, method)
+        server_method = finished(server_metrics, method)
+
+        assert client_method.messages_sent == server_method.messages_received == 3
+        assert client_method.messages_received == server_method.messages_sent == 3
+
+    def test_error(self, client, server_metrics, protobufs):
+        proxy = client.start()
+        with pytest.raises(GrpcError):
+            proxy.unary_grpc_error(protobufs.ExampleRequest(value="A"))
+
+        method = "/nameko.example/unary_grpc_error"
+        assert finished(client.metrics, method).handled == {"UNAUTHENTICATED": 1}
+        assert finished(server_metrics, method).handled == {"UNAUTHENTICATED": 1}
+
+    def test_deadline_exceeded(self, client, server_metrics, protobufs):
+        proxy = client.start()
+        with pytest.raises(GrpcError) as error:
+            proxy.unary_unary(
+                protobufs.ExampleRequest(value="A", delay=500), timeout=0.1
+            )
+        assert error.value.code == StatusCode.DEADLINE_EXCEEDED
+
+        method = "/nameko.example/unary_unary"
+        assert finished(client.metrics, method).handled == {"DEADLINE_EXCEEDED": 1}
+
+        # the server times out the call, unless the client's reset arrives first
+        assert finished(server_metrics, method).handled in (
+            {"DEADLINE_EXCEEDED": 1},
+            {"CANCELLED": 1},
+        )
+
+    def test_cancelled(self, client, server_metrics, protobufs):
+        proxy = client.start()
+        future = proxy.unary_unary.future(
+            protobufs.ExampleRequest(value="A", delay=500)
+        )
+
+        method = "/nameko.example/unary_unary"
+        with eventlet.Timeout(5):
+            while method not in server_metrics.snapshot():
+                eventlet.sleep(0.01)
+        assert future.cancel()
+
+        # the request was complete when the client reset the stream
+        assert finished(server_metrics, method).handled == {"CANCELLED": 1}
+
+    def test_disabled(self, start_nameko_server, grpc_port, stubs, protobufs):
+        container = start_nameko_server("example")
+        assert get_extension(container, GrpcServer).metrics is None
+
+        client = Client(f"//localhost:{grpc_port}", stubs.exampleStub)
+        proxy = client.start()
+        try:
+            proxy.unary_unary(protobufs.ExampleRequest(value="A"))
+            assert client.metrics is None
+        finally:
+            client.stop()
+
+
+class TestGrpcMetrics:
+    @pytest.fixture(autouse=True)
+    def enable_metrics(self, grpc_port):
+        with config.patch({"GRPC_BIND_PORT": grpc_port, "GRPC_METRICS": True}):
+            yield
+
+    def test_server_metrics(self, container_factory, stubs):
+        grpc = Grpc.implementing(stubs.exampleStub)
+
+        class Service:
+            name = "metrics"
+
+            grpc_metrics = GrpcMetrics()
+
+            @grpc
+            def unary_unary(self, request, context):
+                pass
+
+            @dummy
+            def get_metrics(self):
+                return self.grpc_metrics
+
+        container = container_factory(Service)
+        container.start()
+
+        with entrypoint_hook(container, "get_metrics") as get_metrics:
+            metrics = get_metrics()
+        assert metrics is get_extension(container, GrpcServer).metrics
+        assert metrics is not None
+
+    def test_no_grpc_entrypoints(self, container_factory, grpc_port):
+        class Service:
+            name = "metrics"
+
+            grpc_metrics = GrpcMetrics()
+
+            @dummy
+            def get_metrics(self):
+                return self.grpc_metrics
+
+        container = container_factory(Service)
+        container.start()
+
+        assert get_extension(container, GrpcServer) is None
+        with entrypoint_hook(container, "get_metrics") as get_metrics:
+            assert get_metrics() is None
+
+        # the gRPC port isn't bound
+        sock = socket.socket()
+        try:
+            sock.bind(("127.0.0.1", grpc_port))
+        finally:
+            sock.close()
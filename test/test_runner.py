@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from nameko_grpc.client import Client
+
+
+class TestReusePort:
+    @pytest.fixture(params=["server=nameko"])
+    def server_type(self, request):
+        return request.param[7:]
+
+    def test_servers_share_port(self, start_nameko_server, start_client, protobufs):
+        start_nameko_server("example", extra_config={"GRPC_REUSE_PORT": True})
+        start_nameko_server("example", extra_config={"GRPC_REUSE_PORT": True})
+
+        client = start_client("example")
+        response = client.unary_unary(protobufs.ExampleRequest(value="A"))
+        assert response.message == "A"
+
+    def test_port_not_shared_by_default(self, start_nameko_server):
+        start_nameko_server("example")
+        with pytest.raises(OSError):
+            start_nameko_server("example")
+
+
+class TestRunner:
+    @pytest.fixture
+    def start_runner(self, spec_dir, grpc_port):
+        procs = []
+
+        def start(processes):
+            env = os.environ.copy()
+            env["PYTHONPATH"] = os.pathsep.join(
+                [spec_dir.strpath, os.path.dirname(__file__)]
+            )
+            proc = subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "nameko_grpc.runner",
+                    "--processes",
+                    str(processes),
+                    "--define",
+                    f"GRPC_BIND_PORT={grpc_port}",
+                    "example_nameko:example",
+                ],
+                env=env,
+            )
+            procs.append(proc)
+
+            # wait for a worker to start
+            while True:
+                try:
+                    socket.create_connection(("127.0.0.1", grpc_port)).close()
+                    break
+                except OSError:
+                    assert proc.poll() is None
+                    time.sleep(0.1)
+            return proc
+
+        yield start
+
+        for proc in procs:
+            if proc.poll() is None:
+                proc.terminate()
+                proc.wait(timeout=30)
+
+    def test_workers_serve_requests(self, start_runner, grpc_port, stubs, protobufs):
+        proc = start_runner(2)
+
+        for _ in range(4):
+            client = Client(f"//localhost:{grpc_port}", stubs.exampleStub)
+            proxy = client.start()
+            response = proxy.unary_unary(protobufs.ExampleRequest(value="A"))
+            assert response.message == "A"
+            client.stop()
+
+        proc.terminate()
+        assert proc.wait(timeout=30) == 0
@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import socket
+
 import pytest
 
 
@@ -36,3 +38,79 @@ class TestStandard:
             ("A", 1),
             ("B", 2),
         ]
+
+
+@pytest.mark.secure
+class TestSessionResumption:
+    @pytest.fixture(params=["server=nameko"])
+    def server_type(self, request):
+        return request.param[7:]
+
+    @pytest.fixture(params=["client=nameko"])
+    def client_type(self, request):
+        return request.param[7:]
+
+    def test_context_reused(self, client):
+        ssl_config = client.client.ssl
+        assert ssl_config.client_context() is ssl_config.client_context()
+
+    def test_reconnect_resumes_session(self, client, protobufs):
+        response = client.unary_unary(protobufs.ExampleRequest(value="A"))
+        assert response.message == "A"
+
+        conn_pool = client.client._channel.conn_pool
+        connection = conn_pool.get()
+        assert not connection.transport.sock.session_reused
+
+        connection.terminate()
+        connection.stopped.wait(5)
+
+        response = client.unary_unary(protobufs.ExampleRequest(value="B"))
+        assert response.message == "B"
+
+        reconnection = conn_pool.get()
+        assert reconnection is not connection
+        assert reconnection.transport.sock.session_reused
+
+
+@pytest.mark.secure
+class TestHandshake:
+    @pytest.fixture(params=["server=nameko"])
+    def server_type(self, request):
+        return request.param[7:]
+
+    @pytest.fixture(params=["client=nameko"])
+    def client_type(self, request):
+        return request.param[7:]
+
+    @pytest.fixture
+    def stalled_socket_factory(self, grpc_port):
+        """Make connections that never start their TLS handshake."""
+        socks = []
+
+        def make():
+            sock = socket.create_connection(("127.0.0.1", grpc_port))
+            socks.append(sock)
+            return sock
+
+        yield make
+
+        for sock in socks:
+            sock.close()
+
+    def test_stalled_handshake_does_not_block_accept(
+        self, start_nameko_server, start_client, stalled_socket_factory, protobufs
+    ):
+        start_nameko_server("example")
+        stalled_socket_factory()
+
+        client = start_client("example")
+        response = client.unary_unary(protobufs.ExampleRequest(value="A"))
+        assert response.message == "A"
+
+    def test_handshake_timeout(self, start_nameko_server, stalled_socket_factory):
+        start_nameko_server("example", extra_config={"GRPC_HANDSHAKE_TIMEOUT": 0.1})
+        sock = stalled_socket_factory()
+
+        sock.settimeout(5)
+        assert sock.recv(1) == b""
@@ -233,6 +233,38 @@ class TestReceiveStream:
         ]
 
 
+class TestReceiveStreamWhenReady:
+    def test_ready_on_message(self):
+        stream = ReceiveStream(1)
+        callback = Mock()
+
+        stream.when_ready(callback)
+        stream.write(b"\x00\x00\x00\x00\x02")
+        assert not callback.called
+
+        stream.write(b"ab")
+        assert callback.call_count == 1
+
+        stream.write(b"\x00\x00\x00\x00\x01c")
+        assert callback.call_count == 1
+
+    def test_ready_on_close(self):
+        stream = ReceiveStream(1)
+        callback = Mock()
+
+        stream.when_ready(callback)
+        stream.close()
+        assert callback.call_count == 1
+
+    def test_already_ready(self):
+        stream = ReceiveStream(1)
+        callback = Mock()
+
+        stream.write(b"\x00\x00\x00\x00\x01a")
+        stream.when_ready(callback)
+        assert callback.call_count == 1
+
+
 class TestSendStream:
     def test_populate(self):
         stream = SendStream(1)
@@ -249,6 +281,46 @@ class TestSendStream:
         stream.populate(range(10))
         assert stream.queue.qsize() == 1
 
+    def test_populate_closes_generator_when_stream_closed(self):
+        stream = SendStream(1)
+        closed = []
+
+        def generate():
+            try:
+                for i in range(10):
+                    yield i
+                    if i == 1:
+                        stream.close()
+            finally:
+                closed.append(i)
+
+        stream.populate(generate())
+        assert closed == [2]
+        assert stream.queue.qsize() == 3  # 0, 1, and STREAM_END
+
+
+class TestSendStreamWhenClosed:
+    def test_callback_invoked_on_close(self):
+        stream = SendStream(1)
+        callback = Mock()
+
+        assert stream.when_closed(callback) is True
+        assert not callback.called
+
+        stream.close()
+        assert callback.call_args_list == [call()]
+
+        stream.close()
+        assert callback.call_args_list == [call()]
+
+    def test_already_closed(self):
+        stream = SendStream(1)
+        stream.close()
+        callback = Mock()
+
+        assert stream.when_closed(callback) is False
+        assert not callback.called
+
 
 class TestSendStreamHeadersToSend:
     def test_no_headers(self):
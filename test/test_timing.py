@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+import eventlet
+import pytest
+from grpc import StatusCode
+from mock import Mock, patch
+
+from nameko_grpc.client import Client
+from nameko_grpc.errors import GrpcError
+from nameko_grpc.timing import Timings
+
+
+def finished(records, count=1):
+    """Wait for `count` timing records. A client's record is passed on by the
+    thread that closes its response stream, which may be just after the response
+    is returned to the caller.
+    """
+    with eventlet.Timeout(5):
+        while len(records) < count:
+            eventlet.sleep(0.01)
+    return records
+
+
+class TestTimings:
+    def test_all_sampled_by_default(self):
+        callback = Mock()
+        timings = Timings(callback)
+        timing = timings.start("client", "/example/method")
+        timing.finish(StatusCode.OK)
+        assert callback.call_args_list == [((timing,),)]
+
+    def test_slow_calls_sampled(self):
+        callback = Mock()
+        timings = Timings(callback, slow_threshold=1)
+
+        with patch("nameko_grpc.timing.time.monotonic", side_effect=[0, 0.5]):
+            timings.start("client", "/example/method").finish(StatusCode.OK)
+        assert not callback.called
+
+        with patch("nameko_grpc.timing.time.monotonic", side_effect=[0, 1.5]):
+            timings.start("client", "/example/method").finish(StatusCode.OK)
+        assert callback.called
+
+    def test_sample_rate(self):
+        callback = Mock()
+        timings = Timings(callback, sample_rate=0.5)
+
+        with patch("nameko_grpc.timing.random.random", side_effect=[0.7, 0.3]):
+            timings.start("client", "/example/method").finish(StatusCode.OK)
+            assert not callback.called
+            timings.start("client", "/example/method").finish(StatusCode.OK)
+            assert callback.called
+
+    def test_callback_from_path(self):
+        timings = Timings("test_timing.finished")
+        assert timings.callback is finished
+
+    def test_callback_error_logged(self):
+        timings = Timings(Mock(side_effect=ValueError))
+        with patch("nameko_grpc.timing.log") as log:
+            timings.start("client", "/example/method").finish(StatusCode.OK)
+        assert log.exception.called
+
+    def test_as_dict(self):
+        timings = Timings(Mock())
+        with patch("nameko_grpc.timing.time.monotonic", side_effect=[10, 12, 11, 13]):
+            timing = timings.start("server", "/example/method")
+            timing.mark("first_data_sent")
+            timing.mark("headers_sent")
+            timing.mark("headers_sent")  # only the first occurrence is recorded
+            timing.finish(StatusCode.OK)
+
+        assert timing.as_dict() == {
+            "side": "server",
+            "method": "/example/method",
+            "code": "OK",
+            "duration": 3,
+            "events": {"headers_sent": 1, "first_data_sent": 2},
+            "serialize_time": 0.0,
+            "compress_time": 0.0,
+        }
+
+
+class TestCallTiming:
+    @pytest.fixture
+    def server_records(self, start_nameko_server):
+        records = []
+        start_nameko_server(
+            "example", extra_config={"GRPC_TIMING_CALLBACK": records.append}
+        )
+        return records
+
+    @pytest.fixture
+    def client_records(self):
+        return []
+
+    @pytest.fixture
+    def client(self, server_records, client_records, grpc_port, stubs):
+        client = Client(
+            f"//localhost:{grpc_port}",
+            stubs.exampleStub,
+            timings=Timings(client_records.append),
+        )
+        yield client.start()
+        client.stop()
+
+    def test_unary(self, client, client_records, server_records, protobufs):
+        future = client.unary_unary.future(protobufs.ExampleRequest(value="A"))
+        assert future.result().message == "A"
+
+        (client_timing,) = finished(client_records)
+        (server_timing,) = finished(server_records)
+        assert future.timing is client_timing
+
+        assert client_timing.side == "client"
+        assert client_timing.method == "/nameko.example/unary_unary"
+        assert client_timing.code == StatusCode.OK
+        assert list(client_timing.as_dict()["events"]) == [
+            "enqueued",
+            "headers_sent",
+            "first_data_sent",
+            "end_stream_sent",
+            "first_data_received",
+        ]
+        assert client_timing.serialize_time > 0
+
+        assert server_timing.side == "server"
+        assert server_timing.code == StatusCode.OK
+        assert set(server_timing.events) == {
+            "first_data_received",
+            "worker_started",
+            "handler_finished",
+            "headers_sent",
+            "first_data_sent",
+            "end_stream_sent",
+        }
+        assert server_timing.duration <= client_timing.duration
+
+    def test_error(self, client, client_records, server_records, protobufs):
+        with pytest.raises(GrpcError):
+            client.unary_grpc_error(protobufs.ExampleRequest(value="A"))
+
+        (client_timing,) = finished(client_records)
+        (server_timing,) = finished(server_records)
+        assert client_timing.code == StatusCode.UNAUTHENTICATED
+        assert server_timing.code == StatusCode.UNAUTHENTICATED
+        assert "first_data_sent" not in server_timing.events
+
+    def test_disabled(self, start_nameko_server, grpc_port, stubs, protobufs):
+        start_nameko_server("example")
+
+        client = Client(f"//localhost:{grpc_port}", stubs.exampleStub)
+        proxy = client.start()
+        try:
+            future = proxy.unary_unary.future(protobufs.ExampleRequest(value="A"))
+            assert future.result().message == "A"
+            assert future.timing is None
+        finally:
+            client.stop()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import socket
+
+import pytest
+from mock import MagicMock, Mock, call
+
+from nameko_grpc.transport import SocketOptions, SocketTransport
+
+
+class TestSocketTransport:
+    @pytest.fixture
+    def socks(self):
+        sock, peer = socket.socketpair()
+        yield sock, peer
+        peer.close()
+
+    @pytest.fixture
+    def transport(self, socks):
+        sock, _ = socks
+        connection = MagicMock(run=True)
+        connection.data_to_send.return_value = b""
+        transport = SocketTransport(sock, connection, recv_buffer_size=4)
+        yield transport
+        transport.close()
+
+    def test_wakeups_are_coalesced(self, transport):
+        transport.wakeup()
+        transport.wakeup()
+
+        transport.wakeup_sock.setblocking(False)
+        assert transport.wakeup_sock.recv(4096) == b"\x00"
+        with pytest.raises(BlockingIOError):
+            transport.wakeup_sock.recv(4096)
+
+    def test_wakeup_after_close(self, transport):
+        transport.close()
+        transport.wakeup()
+
+    def test_received_data_passed_to_connection(self, transport, socks):
+        _, peer = socks
+        connection = transport.connection
+
+        peer.sendall(b"data")
+        peer.shutdown(socket.SHUT_WR)  # ends the event loop after the data is read
+
+        transport.run_forever()
+
+        assert connection.connection_made.call_args[0] == (transport,)
+        assert connection.receive_data.call_args[0] == (b"data",)
+        assert transport.sock.fileno() == -1
+
+    def test_receive_drains_socket(self, transport, socks):
+        _, peer = socks
+        connection = transport.connection
+
+        peer.sendall(b"abcdefghij")
+
+        assert transport.receive() is True
+        assert connection.receive_data.call_args_list == [
+            call(b"abcd"),
+            call(b"efgh"),
+            call(b"ij"),
+        ]
+        # the socket's timeout is restored
+        assert transport.sock.gettimeout() is None
+
+    def test_receive_detects_closed_peer(self, transport, socks):
+        _, peer = socks
+        peer.shutdown(socket.SHUT_WR)
+
+        assert transport.receive() is False
+
+    def test_empty_writes_skipped(self, socks):
+        sock, peer = socks
+        sock = Mock(wraps=sock)
+
+        connection = MagicMock(run=True)
+        connection.data_to_send.side_effect = [b"", b"data"]
+        # close the peer on the second iteration, ending the event loop
+        iterations = iter([lambda: None, lambda: peer.shutdown(socket.SHUT_WR)])
+        connection.on_iteration.side_effect = lambda: next(iterations)()
+
+        transport = SocketTransport(sock, connection)
+        transport.run_forever()
+
+        assert sock.sendall.call_args_list == [call(b"data")]
+        assert peer.recv(4096) == b"data"
+
+
+class TestSocketOptions:
+    @pytest.fixture
+    def sock(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        yield sock
+        sock.close()
+
+    def test_defaults(self, sock):
+        SocketOptions().apply(sock)
+
+        assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+
+    def test_disabled(self, sock):
+        SocketOptions({"nodelay": False, "keepalive": False}).apply(sock)
+
+        assert not sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        assert not sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+
+    def test_buffer_sizes(self, sock):
+        default_sndbuf = sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+
+        SocketOptions({"sndbuf": default_sndbuf * 2, "rcvbuf": 65536}).apply(sock)
+
+        # the kernel may round or double the requested size
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF) > default_sndbuf
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) >= 65536
+
+    def test_non_tcp_socket_untouched(self):
+        sock, peer = socket.socketpair()
+        try:
+            SocketOptions().apply(sock)
+            assert not sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+        finally:
+            sock.close()
+            peer.close()
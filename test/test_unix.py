@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import os
+import socket
+
+import pytest
+
+from nameko_grpc.aio import AsyncClient, AsyncServer, run
+from nameko_grpc.client import Client
+
+from helpers import AsyncExample
+
+
+@pytest.fixture
+def socket_path(tmpdir):
+    return tmpdir.join("grpc.sock").strpath
+
+
+class TestNamekoServer:
+    @pytest.fixture
+    def start_server(self, start_nameko_server, socket_path):
+        def start():
+            return start_nameko_server(
+                "example", extra_config={"GRPC_BIND_UNIX": socket_path}
+            )
+
+        return start
+
+    def test_unix_target(self, start_server, socket_path, stubs, protobufs):
+        start_server()
+
+        client = Client(f"unix://{socket_path}", stubs.exampleStub)
+        proxy = client.start()
+        try:
+            response = proxy.unary_unary(protobufs.ExampleRequest(value="A"))
+            assert response.message == "A"
+
+            responses = proxy.unary_stream(
+                protobufs.ExampleRequest(value="A", response_count=2)
+            )
+            assert [response.seqno for response in responses] == [1, 2]
+        finally:
+            client.stop()
+
+    def test_stale_socket_replaced(self, start_server, socket_path):
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(socket_path)
+        stale.close()
+
+        start_server()
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(socket_path)
+        sock.close()
+
+    def test_socket_removed_on_stop(self, start_server, socket_path):
+        container = start_server()
+        assert os.path.exists(socket_path)
+
+        container.stop()
+        assert not os.path.exists(socket_path)
+
+
+class TestAsync:
+    def test_unix_target(self, socket_path, stubs, protobufs):
+        async def main():
+            server = AsyncServer(bind_unix=socket_path)
+            server.add_servicer(stubs.exampleStub, AsyncExample(protobufs))
+            async with server:
+                client = AsyncClient(f"unix://{socket_path}", stubs.exampleStub)
+                async with client as proxy:
+                    response = await proxy.unary_unary(
+                        protobufs.ExampleRequest(value="A")
+                    )
+            return response, os.path.exists(socket_path)
+
+        response, exists = run(main())
+        assert response.message == "A"
+        assert not exists